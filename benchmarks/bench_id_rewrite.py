@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""Benchmark the OVAL ID rewriting engine against the previous per-line, per-ID str.replace engine.
+
+The previous engine costs lines x IDs, which is far too slow to run over a whole feed with 100k+ IDs, so it is
+timed on a sample of lines and the result is extrapolated to the full feed.
+
+Usage: python benchmarks/bench_id_rewrite.py [--ids 100000] [--collision-ratio 0.5] [--legacy-sample-lines 200]
+"""
+import argparse
+import time
+from typing import Dict, List, Union
+
+from oval_xml_feed_merge.xml_utils import XMLUtils
+
+ID_TYPES = ["def", "tst", "obj", "ste", "var"]
+
+
+def legacy_replace_element_ids(current_file_old_to_new_id_map: Dict[str, Union[str, None]], xml_file_line: str) -> str:
+    """The engine replaced by XMLUtils.replace_element_ids"""
+    for current_element_id, new_element_id in current_file_old_to_new_id_map.items():
+        if new_element_id:
+            xml_file_line = xml_file_line.replace(current_element_id, new_element_id)
+    return xml_file_line
+
+
+def generate_feed_lines(id_count: int) -> List[str]:
+    """Generate feed-shaped lines, each declaring one ID and referencing the previously declared ID"""
+    lines = []
+    for i in range(id_count):
+        id_type = ID_TYPES[i % len(ID_TYPES)]
+        element_id = f"oval:com.ubuntu.jammy:{id_type}:{i + 1}"
+        previous_id = f"oval:com.ubuntu.jammy:{ID_TYPES[(i - 1) % len(ID_TYPES)]}:{max(i, 1)}"
+        lines.append(f'    <element id="{element_id}" version="1" comment="A benchmark element">')
+        lines.append(f'      <reference {id_type}_ref="{previous_id}"/>')
+        lines.append("    </element>")
+    return lines
+
+
+def generate_id_map(id_count: int, collision_ratio: float) -> Dict[str, Union[str, None]]:
+    """Map every generated ID, marking collision_ratio of them as colliding with a new ID"""
+    collision_step = max(int(round(1 / collision_ratio)), 1) if collision_ratio else 0
+    id_map = {}
+    for i in range(id_count):
+        element_id = f"oval:com.ubuntu.jammy:{ID_TYPES[i % len(ID_TYPES)]}:{i + 1}"
+        id_map[element_id] = None
+        if collision_step and i % collision_step == 0:
+            id_map[element_id] = element_id + f"{i:016d}"
+    return id_map
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ids", type=int, default=100000, help="Number of OVAL IDs in the synthetic feed")
+    parser.add_argument("--collision-ratio", type=float, default=0.5, help="Fraction of IDs that need a new ID")
+    parser.add_argument(
+        "--legacy-sample-lines", type=int, default=200, help="Number of lines the legacy engine is timed on"
+    )
+    args = parser.parse_args()
+
+    lines = generate_feed_lines(args.ids)
+    id_map = generate_id_map(args.ids, args.collision_ratio)
+    print(f"Feed: {len(lines)} lines, {len(id_map)} IDs, {sum(1 for v in id_map.values() if v)} colliding")
+
+    start = time.perf_counter()
+    for line in lines:
+        XMLUtils.replace_element_ids(id_map, line)
+    new_engine_seconds = time.perf_counter() - start
+    print(f"Single-pass engine, whole feed:   {new_engine_seconds:10.3f}s")
+
+    sample = lines[: args.legacy_sample_lines]
+    start = time.perf_counter()
+    for line in sample:
+        legacy_replace_element_ids(id_map, line)
+    legacy_sample_seconds = time.perf_counter() - start
+    legacy_engine_seconds = legacy_sample_seconds * len(lines) / max(len(sample), 1)
+    print(f"Legacy engine, {len(sample)} sampled lines: {legacy_sample_seconds:10.3f}s")
+    print(f"Legacy engine, whole feed (est.): {legacy_engine_seconds:10.3f}s")
+    print(f"Speedup: {legacy_engine_seconds / new_engine_seconds:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+"""Benchmark every phase of a merge on synthetic feeds of increasing size.
+
+A base feed and an overlay a tenth of its size, whose packages partly update the base feed's and whose IDs partly
+collide with the base feed's, are generated with FeedGenerator for every size and merged in a fresh process, so that
+the peak RSS of one size does not leak into the next. The time spent in every phase is attributed to the innermost
+phase running, e.g. the namespace extraction of the output file counts as namespace_extraction, not as setup, and the
+time spent out of every phase is reported as "other".
+
+For every phase, the wall time, the CPU time and the peak RSS reached while it ran are reported. The peak RSS is
+reset at the start of every phase on Linux; elsewhere it is the peak of the process so far.
+
+The results can be saved as a JSON baseline, and compared with a previous baseline: the script exits with status 1
+if any phase got slower than the baseline by more than the tolerance.
+
+Usage: python benchmarks/bench_phases.py [--definitions 1000 10000 100000] [--engine etree]
+                                         [--save baseline.json] [--compare baseline.json] [--tolerance 0.25]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+from oval_xml_feed_merge.definition_tree import DefinitionTree
+from oval_xml_feed_merge.feed_generator import FeedGenerator
+from oval_xml_feed_merge.merge_stats import MergeStats
+from oval_xml_feed_merge.oval_xml_feed_merge import OvalXMLFeedMerge
+from oval_xml_feed_merge.xml_engine import XMLEngine
+from oval_xml_feed_merge.xml_file import XMLFile
+
+BASELINE_FORMAT_VERSION = 1
+
+PHASES = [
+    ("parse", OvalXMLFeedMerge, "create_xml_file"),
+    ("id_regeneration", XMLFile, "allocate_element_ids"),
+    ("id_regeneration", XMLFile, "replace_element_ids"),
+    ("setup", OvalXMLFeedMerge, "setup_output_xml_file"),
+    ("namespace_extraction", XMLFile, "update_ns_map_and_register_ns"),
+    ("definition_map", OvalXMLFeedMerge, "update_package_to_definition_map"),
+    ("closure_building", OvalXMLFeedMerge, "update_definitions_element_and_references"),
+    ("closure_building", DefinitionTree, "build_referenced_elements_tree"),
+    ("reference_collection", OvalXMLFeedMerge, "update_definition_element_references_at_path"),
+    ("validation", XMLFile, "validate_xml_ids"),
+    ("dump_to_file", XMLFile, "dump_to_file"),
+]  # Phases of a merge, and the methods whose calls are attributed to them
+
+
+class PhaseTimer:
+    """Accumulates the wall time, CPU time and peak RSS of every phase. Phases nest: the time spent in a phase
+    started while another one runs is only attributed to the inner phase"""
+
+    def __init__(self):
+        self.results: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: {"wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_bytes": 0, "calls": 0}
+        )
+        self.stack: List[str] = []
+        self.can_reset_peak_rss: bool = MergeStats.reset_peak_rss()
+        self.last_wall: float = time.perf_counter()
+        self.last_cpu: float = time.process_time()
+
+    def switch(self):
+        """Attribute the resources used since the previous switch to the innermost running phase"""
+        wall, cpu = time.perf_counter(), time.process_time()
+        if self.stack:
+            result = self.results[self.stack[-1]]
+            result["wall_seconds"] += wall - self.last_wall
+            result["cpu_seconds"] += cpu - self.last_cpu
+            result["peak_rss_bytes"] = max(result["peak_rss_bytes"], MergeStats.get_peak_rss())
+        if self.can_reset_peak_rss:
+            MergeStats.reset_peak_rss()
+        self.last_wall, self.last_cpu = time.perf_counter(), time.process_time()
+
+    def wrap(self, phase: str, method: Callable) -> Callable:
+        """Return method, timed as part of phase"""
+
+        def timed_method(*args, **kwargs):
+            self.switch()
+            self.stack.append(phase)
+            self.results[phase]["calls"] += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.switch()
+                self.stack.pop()
+
+        return timed_method
+
+
+def run_merge(definitions: int, engine: str, directory: str) -> Dict[str, Dict[str, float]]:
+    """Generate the feeds for the given number of definitions, merge them and return the resources used by every
+    phase"""
+    feed_generator = FeedGenerator(package_count=definitions, overlay_package_count=max(definitions // 10, 1))
+    base_path, overlay_path = feed_generator.write_feeds(directory)
+
+    timer = PhaseTimer()
+    for phase, cls, method_name in PHASES:
+        setattr(cls, method_name, timer.wrap(phase, getattr(cls, method_name)))
+    timer.switch()
+    timer.stack.append("other")  # Time spent out of every phase
+    with open(base_path, "rb") as base_file, open(overlay_path, "rb") as overlay_file:
+        with open(os.path.join(directory, "merged.xml"), "w", encoding="utf-8") as output_file:
+            OvalXMLFeedMerge([base_file, overlay_file], output_file, xml_engine_name=engine).merge_oval_xml_feeds()
+    timer.switch()
+    results = dict(timer.results)
+    results["total"] = {
+        "wall_seconds": sum(result["wall_seconds"] for result in results.values()),
+        "cpu_seconds": sum(result["cpu_seconds"] for result in results.values()),
+        "peak_rss_bytes": max(result["peak_rss_bytes"] for result in results.values()),
+        "calls": 1,
+    }
+    return results
+
+
+def run_merge_in_process(definitions: int, engine: str) -> Dict[str, Dict[str, float]]:
+    """Run run_merge in a fresh Python process and return its results"""
+    output = subprocess.run(
+        [sys.executable, __file__, "--run-merge", str(definitions), "--engine", engine],
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    return json.loads(output)
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float, min_seconds: float) -> List[str]:
+    """Return the phases that got slower than in the baseline by more than tolerance, ignoring differences of less
+    than min_seconds that are noise"""
+    regressions = []
+    for definitions, phases in results.items():
+        for phase, result in phases.items():
+            baseline_result = baseline.get(definitions, {}).get(phase)
+            if not baseline_result:
+                continue
+            baseline_seconds, seconds = baseline_result["wall_seconds"], result["wall_seconds"]
+            if seconds > baseline_seconds * (1 + tolerance) and seconds - baseline_seconds > min_seconds:
+                regressions.append(f"{definitions} definitions, {phase}: {baseline_seconds:.3f}s -> {seconds:.3f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--definitions",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="Numbers of definitions in the base feed, up to 500000",
+    )
+    parser.add_argument("--engine", default=XMLEngine.name, help="XML engine used to parse the feeds")
+    parser.add_argument("--save", metavar="FILE", help="Save the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="Compare the results with a JSON baseline")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="Slowdown of a phase relative to the baseline that fails"
+    )
+    parser.add_argument(
+        "--min-seconds", type=float, default=0.05, help="Slowdown of a phase, in seconds, that is never a failure"
+    )
+    parser.add_argument("--run-merge", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_merge:
+        with tempfile.TemporaryDirectory() as directory:
+            print(json.dumps(run_merge(args.run_merge, args.engine, directory)))
+        return
+
+    results = {}
+    for definitions in args.definitions:
+        results[str(definitions)] = run_merge_in_process(definitions, args.engine)
+        print(f"{definitions} definitions ({args.engine}):")
+        print(f"  {'phase':24} {'wall':>10} {'cpu':>10} {'peak rss':>12}")
+        for phase, result in results[str(definitions)].items():
+            print(
+                f"  {phase:24} {result['wall_seconds']:9.3f}s {result['cpu_seconds']:9.3f}s "
+                f"{result['peak_rss_bytes'] / 2 ** 20:9.1f}MiB"
+            )
+
+    if args.save:
+        with open(args.save, "w") as baseline_file:
+            json.dump(
+                {
+                    "format_version": BASELINE_FORMAT_VERSION,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "engine": args.engine,
+                    "results": results,
+                },
+                baseline_file,
+                indent=2,
+            )
+        print(f"Saved the baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("format_version") != BASELINE_FORMAT_VERSION or baseline.get("engine") != args.engine:
+            sys.exit(f"{args.compare} is not a baseline of this benchmark with the {args.engine} engine")
+        regressions = compare(results, baseline["results"], args.tolerance, args.min_seconds)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No phase is slower than in {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import logging
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from typing import IO, Dict, Generator, List, Optional, Set, Tuple
+
+from oval_xml_feed_merge.compression import Compression
+from oval_xml_feed_merge.oval_xml_feed_merge import OvalXMLFeedMerge
+from oval_xml_feed_merge.utils import Utils
+from oval_xml_feed_merge.worker_pool import WorkerPool
+from oval_xml_feed_merge.xml_engine import XMLEngine
+from oval_xml_feed_merge.xml_file import XMLFile
+
+batch_merge: Optional["BatchOvalXMLFeedMerge"] = None  # Batch merge run by the worker processes, which inherit it
+# when they are forked
+
+
+class SharedXMLFile(XMLFile):
+    """An input file parsed once and shared by several merges, e.g. a base feed merged with several overlays. It is
+    always the first input file of these merges, so its IDs are regenerated once, up front"""
+
+    def __init__(self, raw_xml_file: IO, xml_engine: XMLEngine = None):
+        super().__init__(raw_xml_file, {}, xml_engine)
+        self.global_input_id_set: Set[str] = set()  # OVAL IDs seen in the file, that later input files must not reuse
+        suffix_generator = Utils.next_int(0)
+        self.regenerate_element_ids(suffix_generator, self.global_input_id_set)
+        self.replace_element_ids_in_tree()  # Its elements are written to the output of every merge
+        self.next_suffix: int = next(suffix_generator)  # First suffix left for the IDs generated in later input files
+        self.definition_elements: Optional[List[ET.Element]] = None  # Definition elements, as parsed
+
+    def start_merge(self, ns_prefix_map: Dict[str, str]):
+        """Prepare the file for a new merge sharing ns_prefix_map, forgetting the elements referenced in the previous
+        merge"""
+        self.ns_prefix_map = ns_prefix_map
+        self.type_to_referenced_ids_map = defaultdict(set)
+
+    def get_definition_elements(self) -> List[ET.Element]:
+        """Return the definition elements of the file as they were parsed. lxml moves the elements appended to the
+        output of a merge out of this file's tree, so they are listed before the first merge"""
+        if self.definition_elements is None:
+            self.definition_elements = super().get_definition_elements()
+        return self.definition_elements
+
+
+class OverlayOvalXMLFeedMerge(OvalXMLFeedMerge):
+    """Merges input files on top of a shared base file that was parsed beforehand. The output is identical to the
+    one of OvalXMLFeedMerge with the base file as the first input file"""
+
+    def __init__(
+        self,
+        base_xml_file: SharedXMLFile,
+        raw_xml_files: List[IO],
+        output_file: IO,
+        xml_engine_name: str = XMLEngine.name,
+    ):
+        self.base_xml_file: SharedXMLFile = base_xml_file  # Base file the input files are merged on top of
+        super().__init__(raw_xml_files, output_file, 1, xml_engine_name)
+
+    def create_xml_files(
+        self, raw_xml_files: List[IO], suffix_generator: Generator[int, None, None], global_input_id_set: Set[str]
+    ) -> List[XMLFile]:
+        """Create the XMLFile objects for the input files following the base file, which keeps the IDs it was given"""
+        self.base_xml_file.start_merge(self.ns_prefix_map)
+        suffix_generator = Utils.next_int(self.base_xml_file.next_suffix)
+        global_input_id_set = set(self.base_xml_file.global_input_id_set)
+        return [self.base_xml_file] + super().create_xml_files(raw_xml_files, suffix_generator, global_input_id_set)
+
+
+class BatchOvalXMLFeedMerge:
+    """Merges several overlays on top of the same base feed, writing one output file per overlay. The base feed is
+    parsed, indexed and given its IDs once. The overlays are then merged in worker processes that are forked from
+    this process, so they share the parsed base feed copy-on-write instead of each parsing it again.
+    Every output file is identical to the output of OvalXMLFeedMerge for the base feed followed by the overlay"""
+
+    def __init__(
+        self,
+        raw_base_file: IO,
+        overlays: List[Tuple[str, str]],
+        jobs: int = 1,
+        xml_engine_name: str = XMLEngine.name,
+        compress: str = "auto",
+    ):
+        self.overlays: List[Tuple[str, str]] = overlays  # Names of the input file and of the output file of every
+        # overlay
+        self.xml_engine_name: str = xml_engine_name  # Name of the engine used to parse the XML files
+        self.compress: str = compress  # Value of the --compress option, applied to every output file
+        if not WorkerPool.can_fork():
+            logging.debug("Worker processes cannot share the base feed on this platform, merging in-process")
+            jobs = 1
+        self.worker_pool: WorkerPool = WorkerPool(min(jobs, len(overlays)), "fork")  # Worker processes, started
+        # once the base feed is parsed
+        logging.debug("Parsing the base feed {}".format(raw_base_file.name))
+        self.base_xml_file: SharedXMLFile = SharedXMLFile(
+            Compression.open_input(raw_base_file), XMLEngine.get_engine(xml_engine_name)
+        )  # Base feed shared by every merge
+
+    def merge_overlay(self, overlay_number: int) -> int:
+        """Merge an overlay on top of the base feed and write its output file. Return the exit status of the merge"""
+        xml_file_name, output_file_name = self.overlays[overlay_number]
+        logging.debug("Merging {} into {}".format(xml_file_name, output_file_name))
+        codec_name = Compression.get_output_codec_name(self.compress, output_file_name)
+        try:
+            with open(xml_file_name, "rb") as raw_xml_file, open(output_file_name, "wb") as raw_output_file:
+                with Compression.open_output(raw_output_file, codec_name) as output_file:
+                    oxfm = OverlayOvalXMLFeedMerge(
+                        self.base_xml_file, [raw_xml_file], output_file, self.xml_engine_name
+                    )
+                    oxfm.merge_oval_xml_feeds()
+        except SystemExit as error:  # Raised once the error was logged, it must not take down a worker process
+            return error.code
+        except OSError as error:
+            logging.critical("Failed to merge {} into {}: {}".format(xml_file_name, output_file_name, error))
+            return 1
+        return 0
+
+    @staticmethod
+    def merge_overlay_in_worker(overlay_number: int) -> int:
+        """Merge an overlay with the batch merge inherited from the parent process"""
+        return batch_merge.merge_overlay(overlay_number)
+
+    def merge_oval_xml_feeds(self) -> int:
+        """Merge every overlay, in parallel if there are several jobs. Return 0 if all of them were merged, else the
+        exit status of the first failed merge"""
+        global batch_merge
+        batch_merge = self
+        try:
+            statuses = self.worker_pool.map(BatchOvalXMLFeedMerge.merge_overlay_in_worker, range(len(self.overlays)), 1)
+        finally:
+            self.worker_pool.close()
+            batch_merge = None
+        return next((status for status in statuses if status), 0)
@@ -1,11 +1,21 @@
 """Console script for oval_xml_feed_merge."""
 import logging
+import os
 import sys
-from typing import IO, List
+from typing import IO, List, Optional, Tuple
 
 import click
 
+from oval_xml_feed_merge.batch_oval_xml_feed_merge import BatchOvalXMLFeedMerge
+from oval_xml_feed_merge.compression import Compression
+from oval_xml_feed_merge.feed_generator import FeedGenerator
+from oval_xml_feed_merge.incremental_oval_xml_feed_merge import IncrementalOvalXMLFeedMerge
+from oval_xml_feed_merge.index_cache import IndexCache
+from oval_xml_feed_merge.merge_stats import MergeStats
 from oval_xml_feed_merge.oval_xml_feed_merge import OvalXMLFeedMerge
+from oval_xml_feed_merge.streaming_oval_xml_feed_merge import StreamingOvalXMLFeedMerge
+from oval_xml_feed_merge.utils import Utils
+from oval_xml_feed_merge.xml_engine import LXMLEngine, XMLEngine
 
 
 def setup_logging(verbose: bool):
@@ -18,20 +28,282 @@ def setup_logging(verbose: bool):
     logger.addHandler(logger_handler)
 
 
+def parse_jobs(ctx: click.Context, param: click.Parameter, value: str) -> int:
+    """Convert the value of the --jobs option to a number of threads or worker processes"""
+    if value == "auto":
+        return Utils.get_available_cpu_count()
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        raise click.BadParameter("must be a positive integer or 'auto'")
+    return jobs
+
+
+def parse_engine(ctx: click.Context, param: click.Parameter, value: str) -> str:
+    """Convert the value of the --engine option to the name of an XML engine"""
+    if value == "auto":
+        return XMLEngine.get_default_engine_name()
+    if value == LXMLEngine.name and not XMLEngine.is_lxml_available():
+        raise click.BadParameter("lxml is not installed")
+    return value
+
+
+def parse_compress(ctx: click.Context, param: click.Parameter, value: str) -> str:
+    """Check that the codec selected by the --compress option can be used"""
+    if value == "zst" and not Compression.is_zstandard_available():
+        raise click.BadParameter("zstandard is not installed")
+    return value
+
+
+def parse_overlays(ctx: click.Context, param: click.Parameter, value: Tuple[str, ...]) -> List[Tuple[str, str]]:
+    """Split the values of the --overlay option into the names of the input file and of the output file"""
+    overlays = []
+    for overlay in value:
+        xml_file_name, _, output_file_name = overlay.rpartition(":")
+        if not xml_file_name or not output_file_name:
+            raise click.BadParameter("'{}' is not of the form INPUT:OUTPUT".format(overlay))
+        overlays.append((xml_file_name, output_file_name))
+    return overlays
+
+
 @click.command("OVAL XML Merge")
-@click.argument("xml_files", nargs=-1, type=click.File("r"))
+@click.argument("xml_files", nargs=-1, type=click.File("rb"))
 @click.option(
     "--output",
-    type=click.File("w"),
-    default=sys.stdout,
+    type=click.File("wb"),
+    default="-",
     help="If provided, the output XML will be written to this file else to stdout",
 )
+@click.option(
+    "--compress",
+    type=click.Choice(["auto", "none"] + Compression.codec_names),
+    default="auto",
+    show_default=True,
+    callback=parse_compress,
+    help="Codec the output XML is compressed with. 'auto' picks it from the suffix of the --output file name "
+    "and does not compress stdout. Input files compressed with any of these codecs are detected and decompressed",
+)
+@click.option(
+    "--jobs",
+    default="auto",
+    show_default=True,
+    callback=parse_jobs,
+    help="Number of threads reading and parsing the input files, or of worker processes indexing them with "
+    "--streaming or merging the --overlay feeds, or 'auto' to use every CPU available to the process (honours cgroup "
+    "CPU limits). The threads share the GIL, so only reading and decompressing the files runs in parallel on them. "
+    "With 1, all work is done one file at a time",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(["auto"] + XMLEngine.get_engine_names()),
+    default="auto",
+    show_default=True,
+    callback=parse_engine,
+    help="XML engine used to parse the input files. 'auto' means etree, from the standard library, even when lxml is "
+    "installed: it merges faster and in less memory than lxml. Both produce identical output",
+)
+@click.option(
+    "--streaming",
+    is_flag=True,
+    help="Merge in two passes over the input files, keeping only a compact index of them in memory instead of the "
+    "parsed files. Peak memory no longer grows with the size of the input files. The output is the same",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    help="Directory where the indexes of the input files are cached, so that input files that did not change since "
+    "a previous run are not parsed again. Implies --streaming",
+)
+@click.option(
+    "--cache-size",
+    type=click.IntRange(min=1),
+    default=1024,
+    show_default=True,
+    help="Maximum size of the --cache-dir directory in MiB. The least recently used indexes are evicted first",
+)
+@click.option(
+    "--incremental",
+    "previous_output",
+    type=click.Path(dir_okay=False),
+    metavar="PREVIOUS_OUTPUT",
+    help="Output file of a previous run. The elements that did not change since then are copied from it instead of "
+    "being read from the input files again, using the manifest written next to it. A manifest is written next to the "
+    "--output file as well, which is required and must be another file. Implies --streaming",
+)
+@click.option(
+    "--base",
+    type=click.File("rb"),
+    help="Base feed every --overlay is merged on top of. It is parsed once and shared by the worker processes "
+    "merging the overlays, instead of being parsed again for each of them",
+)
+@click.option(
+    "--overlay",
+    "overlays",
+    multiple=True,
+    metavar="INPUT:OUTPUT",
+    callback=parse_overlays,
+    help="An XML file to merge on top of --base and the file the result is written to. Can be repeated, the overlays "
+    "are merged in parallel. Each output is the same as merging the base feed and the overlay as XML_FILES",
+)
+@click.option(
+    "--stats",
+    "stats_file_name",
+    is_flag=False,
+    flag_value="-",
+    metavar="[FILE]",
+    help="Write a JSON report of the merge to FILE, or to stderr if no FILE is given: the wall time, CPU time, peak "
+    "RSS and peak traced memory of every phase, the bytes read and written and the elements parsed, given new IDs, "
+    "shadowed by a later file and written. Tracing memory slows the merge down",
+)
 @click.option("--verbose", is_flag=True, help="Enable verbose logging")
-def main(xml_files: List[IO], output: IO, verbose: bool):
+def main(
+    xml_files: List[IO],
+    output: IO,
+    compress: str,
+    jobs: int,
+    engine: str,
+    streaming: bool,
+    cache_dir: Optional[str],
+    cache_size: int,
+    previous_output: Optional[str],
+    base: Optional[IO],
+    overlays: List[Tuple[str, str]],
+    stats_file_name: Optional[str],
+    verbose: bool,
+):
     """XML_FILES: List of files to process in the order of increasing priority.
     Any OVAL data present in the XML files in this list will replace any equivalent data in the preceding XML files."""
     setup_logging(verbose)
-    OvalXMLFeedMerge(xml_files, output).merge_oval_xml_feeds()
+    if base is not None or overlays:
+        if base is None or not overlays:
+            raise click.UsageError("--base and --overlay must be used together")
+        if xml_files or output.name not in ("-", "<stdout>"):
+            raise click.UsageError("--base cannot be combined with XML_FILES or --output")
+        if streaming or cache_dir or previous_output or stats_file_name:
+            raise click.UsageError("--base cannot be combined with --streaming, --cache-dir, --incremental or --stats")
+        logging.debug("Merging {} overlays using {} worker process(es)".format(len(overlays), jobs))
+        status = BatchOvalXMLFeedMerge(base, overlays, jobs, engine, compress).merge_oval_xml_feeds()
+        if status:
+            sys.exit(status)
+        return 0
+    if previous_output is not None:
+        if output.name in ("-", "<stdout>"):
+            raise click.UsageError("--incremental requires an --output file")
+        if os.path.abspath(output.name) == os.path.abspath(previous_output):
+            raise click.UsageError("--incremental requires an --output file other than PREVIOUS_OUTPUT")
+    logging.debug("Using {} thread(s) to read the input files".format(jobs))
+    logging.debug("Using the {} XML engine".format(engine))
+    codec_name = Compression.get_output_codec_name(compress, output.name)
+    logging.debug("Compressing the output with {}".format(codec_name or "no codec"))
+    stats = MergeStats() if stats_file_name is not None else None
+    with Compression.open_output(output, codec_name) as output_file:
+        index_cache = None
+        if cache_dir:
+            logging.debug("Caching the indexes of the input files in {}".format(cache_dir))
+            index_cache = IndexCache(cache_dir, cache_size * 1048576)
+        if previous_output is not None:
+            logging.debug("Reusing the previous output {}".format(previous_output))
+            IncrementalOvalXMLFeedMerge(
+                xml_files, output_file, jobs, engine, index_cache, previous_output, stats
+            ).merge_oval_xml_feeds()
+        elif index_cache is not None:
+            StreamingOvalXMLFeedMerge(xml_files, output_file, jobs, engine, index_cache, stats).merge_oval_xml_feeds()
+        elif streaming:
+            StreamingOvalXMLFeedMerge(xml_files, output_file, jobs, engine, stats=stats).merge_oval_xml_feeds()
+        else:
+            OvalXMLFeedMerge(xml_files, output_file, jobs, engine, stats).merge_oval_xml_feeds()
+    if stats is not None:
+        stats.write(stats_file_name)
+    return 0
+
+
+@click.command("OVAL XML Feed Generator")
+@click.argument("output_dir", type=click.Path(file_okay=False))
+@click.option(
+    "--packages",
+    type=click.IntRange(min=1),
+    default=1000,
+    show_default=True,
+    help="Number of packages in the base feed",
+)
+@click.option("--overlays", type=click.IntRange(min=0), default=1, show_default=True, help="Number of overlays")
+@click.option(
+    "--overlay-packages",
+    type=click.IntRange(min=1),
+    default=100,
+    show_default=True,
+    help="Number of packages in every overlay",
+)
+@click.option(
+    "--overlap",
+    type=click.FloatRange(0, 1),
+    default=0.5,
+    show_default=True,
+    help="Fraction of the packages of an overlay that update a package of the base feed, the others are new packages",
+)
+@click.option(
+    "--collision",
+    type=click.FloatRange(0, 1),
+    default=0.5,
+    show_default=True,
+    help="Fraction of the packages of an overlay whose OVAL IDs collide with the IDs of the base feed",
+)
+@click.option(
+    "--fan-out",
+    type=click.IntRange(1, 500),
+    default=4,
+    show_default=True,
+    help="Average number of tests referenced by a definition",
+)
+@click.option(
+    "--criteria-depth",
+    type=click.IntRange(min=1),
+    default=2,
+    show_default=True,
+    help="Number of levels of nested criteria of a definition",
+)
+@click.option(
+    "--kernel",
+    type=click.FloatRange(0, 1),
+    default=0.05,
+    show_default=True,
+    help="Fraction of the packages that also check the kernel version through the shared uname object",
+)
+@click.option("--seed", type=int, default=0, show_default=True, help="Seed of the random choices")
+@click.option(
+    "--compress",
+    type=click.Choice(["none"] + Compression.codec_names),
+    default="none",
+    show_default=True,
+    callback=parse_compress,
+    help="Codec the feeds are compressed with",
+)
+@click.option("--verbose", is_flag=True, help="Enable verbose logging")
+def generate(
+    output_dir: str,
+    packages: int,
+    overlays: int,
+    overlay_packages: int,
+    overlap: float,
+    collision: float,
+    fan_out: int,
+    criteria_depth: int,
+    kernel: float,
+    seed: int,
+    compress: str,
+    verbose: bool,
+):
+    """OUTPUT_DIR: Directory the synthetic base feed and overlays are written to, to load test the merge.
+    Their paths are printed in the order they are merged in, e.g. `oval-xml-feed-merge $(oval-xml-feed-merge-gen DIR)`
+    """
+    setup_logging(verbose)
+    feed_generator = FeedGenerator(
+        packages, overlays, overlay_packages, overlap, collision, fan_out, criteria_depth, kernel, seed
+    )
+    for path in feed_generator.write_feeds(output_dir, Compression.get_output_codec_name(compress, None)):
+        click.echo(path)
     return 0
 
 
@@ -0,0 +1,304 @@
+import bz2
+import contextlib
+import gzip
+import io
+import logging
+import lzma
+import os
+import queue
+import sys
+import tempfile
+import threading
+import zlib
+from typing import IO, Dict, Generator, List, Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, only .zst files need it
+    zstandard = None
+
+
+class Compression:
+    """Detects compressed files and opens them for reading and writing, decompressing and compressing on the fly"""
+
+    codec_names: List[str] = ["bz2", "xz", "gz", "zst"]  # Supported codecs, named after their file suffix
+    magic_to_codec_name: Dict[bytes, str] = {
+        b"BZh": "bz2",
+        b"\xfd7zXZ\x00": "xz",
+        b"\x1f\x8b": "gz",
+        b"\x28\xb5\x2f\xfd": "zst",
+    }  # The bytes every file compressed with a codec starts with
+    magic_size = 6  # Number of bytes needed to tell the codecs apart
+    chunk_size = 1048576  # Number of bytes decompressed or compressed at a time
+
+    @staticmethod
+    def is_zstandard_available() -> bool:
+        """Return True if zstandard is installed"""
+        return zstandard is not None
+
+    @staticmethod
+    def get_codec_name_by_suffix(file_name: Optional[str]) -> Optional[str]:
+        """Return the codec a file is compressed with according to its suffix, or None if the suffix is not one of
+        a supported codec"""
+        suffix = os.path.splitext(file_name or "")[1][1:]
+        return suffix if suffix in Compression.codec_names else None
+
+    @staticmethod
+    def get_codec_name_by_magic(magic: bytes) -> Optional[str]:
+        """Return the codec a file starting with the given bytes is compressed with, or None if it is not compressed
+        with a supported codec"""
+        for codec_magic, codec_name in Compression.magic_to_codec_name.items():
+            if magic.startswith(codec_magic):
+                return codec_name
+        return None
+
+    @staticmethod
+    def peek_magic(binary_file: IO) -> Optional[bytes]:
+        """Return the first bytes of a binary file object without consuming them, or None if that is not possible"""
+        if hasattr(binary_file, "peek"):
+            return binary_file.peek(Compression.magic_size)[: Compression.magic_size]
+        if binary_file.seekable():
+            position = binary_file.tell()
+            magic = binary_file.read(Compression.magic_size)
+            binary_file.seek(position)
+            return magic
+        return None
+
+    @staticmethod
+    def detect_codec_name(binary_file: IO) -> Optional[str]:
+        """Return the codec a binary file object is compressed with, detected from its first bytes or else from the
+        suffix of its name. Return None if the file is not compressed"""
+        magic = Compression.peek_magic(binary_file)
+        if magic:
+            return Compression.get_codec_name_by_magic(magic)
+        return Compression.get_codec_name_by_suffix(getattr(binary_file, "name", None))
+
+    @staticmethod
+    def get_output_codec_name(compress: str, file_name: Optional[str]) -> Optional[str]:
+        """Return the codec an output file is compressed with, given the value of the --compress option: "auto"
+        picks it from the suffix of the file name, "none" disables compression, else it is the name of the codec"""
+        return {"auto": Compression.get_codec_name_by_suffix(file_name), "none": None}.get(compress, compress)
+
+    @staticmethod
+    def check_codec_available(codec_name: str):
+        """Exit if the library needed by a codec is not installed"""
+        if codec_name == "zst" and not Compression.is_zstandard_available():
+            logging.critical("zstandard must be installed to read and write .zst files")
+            sys.exit(1)
+
+    @staticmethod
+    def open_decompressed_reader(compressed_file: IO, codec_name: str) -> IO:
+        """Return a file object reading the decompressed contents of compressed_file, which is left open once the
+        returned file object is closed. Concatenated compressed streams are read as one"""
+        if codec_name == "bz2":
+            return bz2.BZ2File(compressed_file)
+        if codec_name == "xz":
+            return lzma.LZMAFile(compressed_file)
+        if codec_name == "gz":
+            return gzip.GzipFile(fileobj=compressed_file)
+        return zstandard.ZstdDecompressor().stream_reader(compressed_file, read_across_frames=True, closefd=False)
+
+    @staticmethod
+    def get_compressor(codec_name: str):
+        """Return an incremental compressor, with compress and flush methods, for a codec"""
+        if codec_name == "bz2":
+            return bz2.BZ2Compressor()
+        if codec_name == "xz":
+            return lzma.LZMACompressor(lzma.FORMAT_XZ)
+        if codec_name == "gz":
+            return zlib.compressobj(wbits=31)  # A gzip stream, with no file name and a zero timestamp
+        return zstandard.ZstdCompressor().compressobj()
+
+    @staticmethod
+    def open_input(raw_xml_file: IO) -> IO:
+        """Return a binary file object with the decompressed contents of raw_xml_file if it is a compressed binary file
+        object, else return raw_xml_file itself"""
+        if not isinstance(raw_xml_file, (io.RawIOBase, io.BufferedIOBase)):
+            return raw_xml_file
+        codec_name = Compression.detect_codec_name(raw_xml_file)
+        if codec_name is None:
+            return raw_xml_file
+        Compression.check_codec_available(codec_name)
+        logging.debug("Decompressing {} with {}".format(raw_xml_file.name, codec_name))
+        return io.BufferedReader(DecompressedFile(raw_xml_file, codec_name), Compression.chunk_size)
+
+    @staticmethod
+    def is_decompressed_file(binary_file: IO) -> bool:
+        """Return True if binary_file was returned by open_input for a compressed file"""
+        return isinstance(getattr(binary_file, "raw", None), DecompressedFile)
+
+    @staticmethod
+    def get_random_access_file(binary_file: IO) -> IO:
+        """Return binary_file if it can be read at random offsets efficiently. Else, e.g. for stdin or a decompressed
+        file, copy it to a temporary file and return that instead"""
+        if binary_file.seekable() and not Compression.is_decompressed_file(binary_file):
+            return binary_file
+        temporary_file = tempfile.TemporaryFile()
+        for chunk in iter(lambda: binary_file.read(Compression.chunk_size), b""):
+            temporary_file.write(chunk)
+        temporary_file.flush()  # So that the copy can be read from its descriptor too
+        return temporary_file
+
+    @staticmethod
+    @contextlib.contextmanager
+    def open_output(output_file: IO, codec_name: Optional[str]) -> Generator[IO, None, None]:
+        """Return a context manager for a binary file object writing to the binary output_file, compressing what is
+        written with codec_name unless it is None. The compressed stream is completed on exit, while output_file
+        itself is left open"""
+        binary_file: IO = output_file
+        if codec_name is not None:
+            Compression.check_codec_available(codec_name)
+            binary_file = io.BufferedWriter(CompressedFile(output_file, codec_name), Compression.chunk_size)
+        try:
+            yield binary_file
+        finally:
+            if codec_name is None:
+                binary_file.flush()
+            else:
+                binary_file.close()
+
+
+class DecompressedFile(io.RawIOBase):
+    """A read-only binary file object with the decompressed contents of a compressed file. The file is decompressed
+    ahead of the reads on a separate thread, so that decompression overlaps with parsing. Seeking backwards starts
+    decompressing the file again from its beginning"""
+
+    queue_size = 8  # Number of decompressed chunks kept ready for reading
+
+    def __init__(self, compressed_file: IO, codec_name: str):
+        super().__init__()
+        self.compressed_file: IO = compressed_file  # Compressed binary file object
+        self.codec_name: str = codec_name  # Codec the file is compressed with
+        self.name: str = compressed_file.name  # Name of the file on disk or stdin
+        self.position: int = 0  # Offset in the decompressed contents of the next byte read
+        self.chunk: memoryview = memoryview(b"")  # Decompressed chunk being read
+        self.is_eof: bool = False  # True once the last decompressed chunk has been read
+        self.chunks: queue.Queue = queue.Queue(DecompressedFile.queue_size)  # Decompressed chunks, or the exception
+        # that stopped the decompression, in order
+        self.stop_event: threading.Event = threading.Event()  # Set to stop the decompression thread
+        self.thread: threading.Thread = self.start()  # Thread decompressing the file
+
+    def start(self) -> threading.Thread:
+        """Start decompressing the file from its current position on a new thread"""
+        thread = threading.Thread(target=self.decompress, args=(self.chunks, self.stop_event), daemon=True)
+        thread.start()
+        return thread
+
+    def decompress(self, chunks: queue.Queue, stop_event: threading.Event):
+        """Decompress the file into chunks until its end or until stop_event is set"""
+        try:
+            with Compression.open_decompressed_reader(self.compressed_file, self.codec_name) as reader:
+                while not stop_event.is_set():
+                    chunk = reader.read(Compression.chunk_size)
+                    chunks.put(chunk)
+                    if not chunk:
+                        break
+        except Exception as error:
+            chunks.put(error)
+
+    def stop(self):
+        """Stop the decompression thread, discarding the chunks it has not handed over yet"""
+        self.stop_event.set()
+        while self.thread.is_alive():
+            try:
+                self.chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.thread.join()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        while not len(self.chunk):
+            if self.is_eof:
+                return 0
+            chunk: Union[bytes, Exception] = self.chunks.get()
+            if isinstance(chunk, Exception):
+                logging.critical("Failed to decompress {}: {}".format(self.name, chunk))
+                sys.exit(1)
+            self.chunk = memoryview(chunk)
+            self.is_eof = not chunk
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        self.position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Decompressed files can only be seeked from their start")
+        if offset < self.position:  # Start over from the beginning of the compressed file
+            self.stop()
+            self.compressed_file.seek(0)
+            self.position, self.chunk, self.is_eof = 0, memoryview(b""), False
+            self.chunks, self.stop_event = queue.Queue(DecompressedFile.queue_size), threading.Event()
+            self.thread = self.start()
+        while self.position < offset and self.read(min(offset - self.position, Compression.chunk_size)):
+            pass
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            self.stop()
+        super().close()
+
+
+class CompressedFile(io.RawIOBase):
+    """A write-only binary file object compressing what is written to it into another binary file object. The data
+    is compressed on a separate thread, so that compression overlaps with serialization. The compressed stream is
+    completed when the file object is closed, while the file object written to is left open"""
+
+    queue_size = 8  # Number of chunks waiting to be compressed before writes block
+
+    def __init__(self, output_file: IO, codec_name: str):
+        super().__init__()
+        self.output_file: IO = output_file  # Binary file object the compressed data is written to
+        self.name: str = getattr(output_file, "name", "")  # Name of the file on disk or stdout
+        self.chunks: queue.Queue = queue.Queue(CompressedFile.queue_size)  # Chunks to compress, then None
+        self.error: Optional[Exception] = None  # Exception that stopped the compression
+        self.thread: threading.Thread = threading.Thread(
+            target=self.compress, args=(Compression.get_compressor(codec_name),), daemon=True
+        )  # Thread compressing the data
+        self.thread.start()
+
+    def compress(self, compressor):
+        """Compress the chunks into output_file until None is received"""
+        try:
+            for chunk in iter(self.chunks.get, None):
+                self.output_file.write(compressor.compress(chunk))
+            self.output_file.write(compressor.flush())
+            self.output_file.flush()
+        except Exception as error:
+            self.error = error
+            for _ in iter(self.chunks.get, None):  # Keep accepting writes until the file object is closed
+                pass
+
+    def raise_error(self):
+        """Raise the exception that stopped the compression, if any"""
+        if self.error is not None:
+            raise self.error
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, buffer) -> int:
+        self.raise_error()
+        chunk = bytes(buffer)
+        self.chunks.put(chunk)
+        return len(chunk)
+
+    def close(self):
+        if not self.closed:
+            self.chunks.put(None)
+            self.thread.join()
+            super().close()
+            self.raise_error()
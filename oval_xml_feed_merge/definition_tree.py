@@ -1,52 +1,109 @@
-import re
 import xml.etree.ElementTree as ET
 from collections import defaultdict
-from typing import Dict, Set, Tuple, List
+from typing import Dict, Set, Tuple, List, Optional
+
+from oval_xml_feed_merge.id_interner import IDInterner
+from oval_xml_feed_merge.xml_utils import XMLUtils
 
 
 class DefinitionTree:
-    def __init__(self, definition_element, ns_prefix_map, id_to_element_map, type_to_referenced_ids_map):
+    def __init__(
+        self,
+        definition_element,
+        ns_prefix_map,
+        id_to_element_map,
+        type_to_referenced_ids_map,
+        id_to_referenced_ids_map: Optional[Dict[str, List[Tuple[str, str]]]] = None,
+        pkg_name: Optional[str] = None,
+        id_interner: Optional[IDInterner] = None,
+        xml_file_name: Optional[str] = None,
+        old_to_new_id_map: Optional[Dict[str, str]] = None,
+        id_to_nested_ids_map: Optional[Dict[str, List[str]]] = None,
+    ):
         self.definition_element: ET.Element = definition_element  # XML Element object
-        self.pkg_name: str = definition_element.find("./metadata/title", ns_prefix_map).text  # Package name
+        self.pkg_name: str = (
+            definition_element.find("./metadata/title", ns_prefix_map).text if pkg_name is None else pkg_name
+        )  # Package name, looked up in the definition element unless given
         self.ns_prefix_map: Dict[str, str] = ns_prefix_map  # A map of namespace prefix and URIs
         self.id_to_element_map: Dict[str, ET.Element] = id_to_element_map  # A map that tracks element identifier
         # to the respective element object
 
-        self.type_to_referenced_ids_map: Dict[str, Set[str]] = type_to_referenced_ids_map  # A map of element type (test
-        # , variable, object, state, definition) to a set of element identifiers that were directly or indirectly
-        # referenced by a definition element that is chosen to be written to the output file. The current DefinitionTree
-        # object will update this map only when chosen to be written to the output file
+        self.type_to_referenced_ids_map: Dict[str, Set[int]] = type_to_referenced_ids_map  # A map of element type (test
+        # , variable, object, state, definition) to a set of handles of element identifiers that were directly or
+        # indirectly referenced by a definition element that is chosen to be written to the output file. The current
+        # DefinitionTree object will update this map only when chosen to be written to the output file
 
-        self.local_type_to_referenced_ids_map: Dict[str, Set[str]] = defaultdict(
+        self.local_type_to_referenced_ids_map: Dict[str, Set[int]] = defaultdict(
             set
-        )  # A map of element type (test, variable, object, state, definition) to a set of element identifiers that were
-        # directly or indirectly referenced by a definition element.
+        )  # A map of element type (test, variable, object, state, definition) to a set of handles of element
+        # identifiers that were directly or indirectly referenced by a definition element, and are not in
+        # type_to_referenced_ids_map yet. It is emptied once merged into type_to_referenced_ids_map
+
+        self.id_to_referenced_ids_map: Dict[str, List[Tuple[str, str]]] = (
+            {} if id_to_referenced_ids_map is None else id_to_referenced_ids_map
+        )  # An index of element identifier to the references found in that element's tree. It is built by the
+        # XMLFile object along with id_to_element_map and shared by all its DefinitionTree objects
 
-        self.ref_attr_regex = re.compile(r"([a-z]+)_ref")  # Regex to find references to other XML elements
+        self.ref_attr_regex = XMLUtils.ref_regex  # Regex to find references to other XML elements
+
+        self.id_interner: IDInterner = IDInterner() if id_interner is None else id_interner  # Interns the
+        # references into the handles stored in the maps above. It is shared by all DefinitionTree objects of the file
+        self.xml_file_name: Optional[str] = xml_file_name  # Name of the file the definition element comes from
+        self.old_to_new_id_map: Dict[str, str] = {} if old_to_new_id_map is None else old_to_new_id_map  # Identifiers
+        # of the file that were given a new ID, mapped to the new ID, and not replaced in the definition element yet
+        self.id_to_nested_ids_map: Dict[str, List[str]] = (
+            {} if id_to_nested_ids_map is None else id_to_nested_ids_map
+        )  # Identifiers in the trees of the elements of the file, built by the XMLFile object along with
+        # id_to_element_map, see XMLUtils.generate_id_map
 
     def build_referenced_elements_tree(self):
         """Find all the element identifiers and the element objects themselves referenced directly or indirectly by
-        the current definition element
+        the current definition element. Every referenced element is expanded only once, however many paths lead to
+        it, so shared elements are not walked repeatedly and reference cycles terminate. Elements already in
+        type_to_referenced_ids_map are not expanded either, the definitions written before this one brought their
+        whole trees in. References are followed as interned handles, converted back to identifiers only when the
+        output is assembled. The regenerated identifiers are put in place in the definition element first, as it is
+        chosen to be written to the output file
         """
-        referenced_ids = self.find_refs_in_tree(self.definition_element)
-        while referenced_ids:
-            ref_type, referenced_id = referenced_ids.pop()
-            referenced_element = self.id_to_element_map[referenced_id]
-            self.local_type_to_referenced_ids_map[ref_type].add(referenced_id)
-            referenced_ids += self.find_refs_in_tree(referenced_element)
+        XMLUtils.replace_element_ids_in_tree(self.old_to_new_id_map, self.definition_element)
+        definition_id = self.definition_element.get("id")
+        if definition_id in self.id_to_referenced_ids_map:
+            referenced_ids = self.id_to_referenced_ids_map[definition_id]
+        else:
+            referenced_ids = self.find_refs_in_tree(self.definition_element)
+        id_interner = self.id_interner
+        references, referenced_handles = id_interner.references, id_interner.referenced_handles
+        handles = id_interner.intern_all(referenced_ids)
+        while handles:
+            handle = handles.pop()
+            ref_type, referenced_id = references[handle]
+            if handle in self.type_to_referenced_ids_map.get(ref_type, ()):
+                continue
+            visited_handles = self.local_type_to_referenced_ids_map[ref_type]  # A handle always has the same type
+            if handle in visited_handles:
+                continue
+            visited_handles.add(handle)
+            next_handles = referenced_handles[handle]
+            if next_handles is None:  # Interned once for all the definitions sharing id_interner
+                next_handles = referenced_handles[handle] = id_interner.intern_all(
+                    self.get_refs_of_element(referenced_id)
+                )
+            handles += next_handles
+
+    def get_refs_of_element(self, element_id: str) -> List[Tuple[str, str]]:
+        """Return the references found in the tree of the element with the given identifier. They are looked up in
+        id_to_referenced_ids_map and the tree is only searched for elements missing from it"""
+        referenced_ids = self.id_to_referenced_ids_map.get(element_id)
+        if referenced_ids is None:
+            referenced_ids = self.find_refs_in_tree(self.id_to_element_map[element_id])
+            self.id_to_referenced_ids_map[element_id] = referenced_ids
+        return referenced_ids
 
     def find_refs_in_element(self, element: ET.Element, referenced_ids: List[Tuple[str, str]]):
         """Find references to the identifiers of other XML elements in the given element
         and return them
         """
-
-        for attr, val in element.attrib.items():
-            match = self.ref_attr_regex.match(attr)
-            if match:
-                referenced_ids += [(match.group(1), val)]
-        match = self.ref_attr_regex.search(element.tag)
-        if match:
-            referenced_ids += [(match.group(1), element.text)]
+        XMLUtils.find_refs_in_element(element, referenced_ids)
 
     def find_refs_in_tree(self, root_element: ET.Element) -> List[Tuple[str, str]]:
         """Find references to the identifiers of other XML elements in the given element and its children
@@ -56,6 +113,12 @@ class DefinitionTree:
             self.find_refs_in_element(child, referenced_ids)
         return referenced_ids
 
+    def get_element_ids(self) -> List[str]:
+        """Return the identifiers in the tree of the definition element, once it is chosen to be written to the output
+        file, from id_to_nested_ids_map rather than searching the tree"""
+        definition_id = self.definition_element.get("id")
+        return [definition_id, *self.id_to_nested_ids_map.get(definition_id, ())]
+
     def sync_referenced_element_ids_to_xml_file(self):
         """This DefinitionTree object's definition element has been chosen to be written to the output XML.
         Add all the elements from the local_type_to_referenced_ids_map to the associated XML file's
@@ -63,3 +126,4 @@ class DefinitionTree:
         """
         for ref_type, referenced_element_ids in self.local_type_to_referenced_ids_map.items():
             self.type_to_referenced_ids_map[ref_type] |= referenced_element_ids
+        self.local_type_to_referenced_ids_map.clear()  # Only needed until it is merged into the file's map
@@ -0,0 +1,38 @@
+import logging
+import sys
+from typing import Dict, Iterable, List
+
+
+class DuplicateIDDetector:
+    """Detects the identifiers given to more than one element of the output XML file while the elements are added to
+    it, so the output does not have to be searched for them once it is assembled. All the duplicates are reported at
+    once, with the files the elements come from"""
+
+    def __init__(self):
+        self.id_to_source_name: Dict[str, str] = {}  # Name of the file the first element with every identifier of the
+        # output comes from
+        self.duplicate_id_to_source_names: Dict[str, List[str]] = {}  # Names of the files all the elements with a
+        # duplicate identifier come from, in the order they were added, for the duplicate identifiers only
+
+    def add_all(self, element_ids: Iterable[str], source_name: str):
+        """Record elements with the given identifiers, added to the output from the file called source_name"""
+        id_to_source_name = self.id_to_source_name
+        for element_id in element_ids:
+            first_source_name = id_to_source_name.get(element_id)
+            if first_source_name is None:
+                id_to_source_name[element_id] = source_name
+            elif element_id in self.duplicate_id_to_source_names:
+                self.duplicate_id_to_source_names[element_id].append(source_name)
+            else:
+                self.add_duplicate(element_id, first_source_name, source_name)
+
+    def add_duplicate(self, element_id: str, first_source_name: str, source_name: str):
+        """Record a second element with the given identifier"""
+        self.duplicate_id_to_source_names[element_id] = [first_source_name, source_name]
+
+    def validate(self):
+        """Log every duplicate identifier with the files its elements come from, then exit if there is any"""
+        for element_id, source_names in self.duplicate_id_to_source_names.items():
+            logging.critical("Found elements with duplicate id '{}' in {}".format(element_id, ", ".join(source_names)))
+        if self.duplicate_id_to_source_names:
+            sys.exit(1)
@@ -0,0 +1,358 @@
+import io
+import logging
+import os
+import random
+from typing import IO, List, Optional
+
+from oval_xml_feed_merge.compression import Compression
+
+
+class GeneratedPackage:
+    """A package of a generated feed, and the numbers its OVAL IDs are made of"""
+
+    def __init__(self, name: str, id_prefix: str, number: int, test_count: int, is_kernel: bool):
+        self.name: str = name  # Package name, the title of its definition
+        self.id_prefix: str = id_prefix  # Prefix of its OVAL IDs, e.g. "oval:com.ubuntu.jammy"
+        self.number: int = number  # Position of the package in the feed its IDs are allocated in
+        self.test_count: int = test_count  # Number of criteria, and tests, of its definition
+        self.is_kernel: bool = is_kernel  # True if the package also checks the running kernel version
+
+    def get_id(self, id_type: str, offset: int = 0) -> str:
+        """Return the OVAL ID of the element of the package of the given type, e.g. "tst", and offset"""
+        return "{}:{}:{}".format(self.id_prefix, id_type, 11110000000000 + (self.number + 1) * 1000 + offset)
+
+
+class FeedGenerator:
+    """Generates synthetic OVAL feeds shaped like the Canonical package feeds, to load test the merge: a base feed
+    and overlays, each overlay updating some packages of the base feed and adding new ones.
+    Every definition extends the shared inventory definition and has a tree of criteria criteria_depth levels deep,
+    with about fan_out tests. The tests of a package share its objects, and kernel packages also check the running
+    kernel version through the shared uname object and kernel local_variable.
+    The packages of an overlay whose IDs collide with the base feed's are allocated IDs from the base feed's
+    namespace, like the IDs of a package of the base feed, so that the merge has to regenerate them.
+    The feeds only depend on the parameters and the seed"""
+
+    section_names = ["definitions", "tests", "objects", "states", "variables"]
+
+    header = """<?xml version="1.0" ?>
+<oval_definitions xmlns="http://oval.mitre.org/XMLSchema/oval-definitions-5" \
+xmlns:ind-def="http://oval.mitre.org/XMLSchema/oval-definitions-5#independent" \
+xmlns:oval="http://oval.mitre.org/XMLSchema/oval-common-5" \
+xmlns:unix-def="http://oval.mitre.org/XMLSchema/oval-definitions-5#unix" \
+xmlns:linux-def="http://oval.mitre.org/XMLSchema/oval-definitions-5#linux">
+  <generator>
+    <oval:product_name>OVAL XML Feed Merge Feed Generator</oval:product_name>
+    <oval:schema_version>5.11.1</oval:schema_version>
+    <oval:timestamp>2024-06-03T10:42:03</oval:timestamp>
+  </generator>
+"""
+
+    def __init__(
+        self,
+        package_count: int = 1000,
+        overlay_count: int = 1,
+        overlay_package_count: int = 100,
+        overlap_ratio: float = 0.5,
+        collision_ratio: float = 0.5,
+        fan_out: int = 4,
+        criteria_depth: int = 2,
+        kernel_ratio: float = 0.05,
+        seed: int = 0,
+    ):
+        self.package_count: int = package_count  # Number of packages in the base feed
+        self.overlay_count: int = overlay_count  # Number of overlays
+        self.overlay_package_count: int = overlay_package_count  # Number of packages in every overlay
+        self.overlap_ratio: float = overlap_ratio  # Fraction of the packages of an overlay that update a package of
+        # the base feed, the others are new packages
+        self.collision_ratio: float = collision_ratio  # Fraction of the packages of an overlay whose IDs collide
+        # with the IDs of a package of the base feed
+        self.fan_out: int = fan_out  # Average number of tests referenced by a definition
+        self.criteria_depth: int = criteria_depth  # Number of levels of criteria of a definition
+        self.kernel_ratio: float = kernel_ratio  # Fraction of the packages that are kernel packages
+        self.seed: int = seed  # Seed of the random choices, so that the same feeds can be generated again
+
+    def get_id_prefix(self, feed_number: int) -> str:
+        """Return the prefix of the OVAL IDs allocated in a feed, 0 being the base feed and 1 the first overlay"""
+        return "oval:com.ubuntu.{}".format("jammy" if not feed_number else "overlay-{}_jammy".format(feed_number))
+
+    def get_package_name(self, number: int, feed_number: int = 0) -> str:
+        """Return the name of a package of the base feed, or of a new package of an overlay"""
+        is_kernel = self.kernel_ratio and number % max(round(1 / self.kernel_ratio), 1) == 0
+        prefix = "overlay-{}-".format(feed_number) if feed_number else ""
+        return "{}{}-{}".format(prefix, "linux" if is_kernel else "package", number)
+
+    def get_packages(self, feed_number: int) -> List[GeneratedPackage]:
+        """Return the packages of a feed, 0 being the base feed and 1 the first overlay"""
+        rng = random.Random("{}-{}".format(self.seed, feed_number))
+        if not feed_number:
+            return [
+                self.create_package(rng, self.get_package_name(number), self.get_id_prefix(0), number)
+                for number in range(self.package_count)
+            ]
+        base_numbers = rng.sample(range(self.package_count), min(self.overlay_package_count, self.package_count))
+        # Distinct packages of the base feed the packages of the overlay update or take the IDs of
+        packages = []
+        for number in range(self.overlay_package_count):
+            base_number: Optional[int] = base_numbers[number] if number < len(base_numbers) else None
+            is_update = base_number is not None and rng.random() < self.overlap_ratio
+            is_collision = base_number is not None and rng.random() < self.collision_ratio
+            name = self.get_package_name(base_number) if is_update else self.get_package_name(number, feed_number)
+            if is_collision:
+                packages.append(self.create_package(rng, name, self.get_id_prefix(0), base_number))
+            else:
+                packages.append(self.create_package(rng, name, self.get_id_prefix(feed_number), number))
+        return packages
+
+    def create_package(self, rng: random.Random, name: str, id_prefix: str, number: int) -> GeneratedPackage:
+        """Create a package, picking the number of tests of its definition"""
+        test_count = rng.randint(1, min(2 * self.fan_out - 1, 999))
+        return GeneratedPackage(name, id_prefix, number, test_count, "linux-" in name)
+
+    def get_shared_package(self, rng: random.Random, feed_number: int) -> GeneratedPackage:
+        """Return a pseudo package holding the IDs of the elements shared by all the packages of a feed: the
+        inventory definition, the uname object and the kernel local_variable. In an overlay, they collide with the
+        base feed's according to collision_ratio"""
+        is_collision = feed_number and rng.random() < self.collision_ratio
+        return GeneratedPackage("", self.get_id_prefix(0 if is_collision else feed_number), -1, 0, False)
+
+    def write_feed(self, output_file: IO, feed_number: int):
+        """Write a feed, 0 being the base feed and 1 the first overlay, to the text file object output_file.
+        Elements are written one package at a time, so memory use does not grow with the size of the feed"""
+        packages = self.get_packages(feed_number)
+        shared = self.get_shared_package(random.Random("{}-{}-shared".format(self.seed, feed_number)), feed_number)
+        output_file.write(FeedGenerator.header)
+        for section_name in FeedGenerator.section_names:
+            output_file.write("  <{}>\n".format(section_name))
+            output_file.write(getattr(self, "get_shared_{}".format(section_name))(shared))
+            get_package_elements = getattr(self, "get_package_{}".format(section_name))
+            for package in packages:
+                output_file.write(get_package_elements(package, shared))
+            output_file.write("  </{}>\n".format(section_name))
+        output_file.write("</oval_definitions>\n")
+
+    def write_feeds(self, output_dir: str, codec_name: Optional[str] = None) -> List[str]:
+        """Write the base feed and the overlays to output_dir, compressed with codec_name unless it is None, and
+        return their paths in the order they are merged in"""
+        os.makedirs(output_dir, exist_ok=True)
+        suffix = ".oval.xml" + ("." + codec_name if codec_name else "")
+        paths = [os.path.join(output_dir, "base" + suffix)] + [
+            os.path.join(output_dir, "overlay-{}{}".format(feed_number, suffix))
+            for feed_number in range(1, self.overlay_count + 1)
+        ]
+        for feed_number, path in enumerate(paths):
+            logging.debug("Generating {}".format(path))
+            with open(path, "wb") as raw_output_file, Compression.open_output(raw_output_file, codec_name) as output:
+                text_output = io.TextIOWrapper(output, encoding="utf-8")
+                self.write_feed(text_output, feed_number)
+                text_output.detach()
+        return paths
+
+    def get_shared_definitions(self, shared: GeneratedPackage) -> str:
+        return (
+            '    <definition class="inventory" id="{}" version="1">\n'
+            "      <metadata>\n"
+            "        <title>Check that Ubuntu 22.04 LTS (jammy) is installed.</title>\n"
+            "        <description/>\n"
+            "      </metadata>\n"
+            "      <criteria>\n"
+            '        <criterion test_ref="{}" comment="The host is part of the unix family."/>\n'
+            '        <criterion test_ref="{}" comment="The host is running Ubuntu jammy."/>\n'
+            "      </criteria>\n"
+            "    </definition>\n"
+        ).format(shared.get_id("def", 100), shared.get_id("tst", 100), shared.get_id("tst", 101))
+
+    def get_package_definitions(self, package: GeneratedPackage, shared: GeneratedPackage) -> str:
+        """Return the inventory definition every definition of the feed extends"""
+        test_refs = [package.get_id("tst", test_number) for test_number in range(package.test_count)]
+        if package.is_kernel:
+            test_refs.append(package.get_id("tst", 999))
+        return (
+            '    <definition class="vulnerability" id="{id}" version="1">\n'
+            "      <metadata>\n"
+            "        <title>{name}</title>\n"
+            '        <reference source="Package" ref_id="{name}" '
+            'ref_url="https://launchpad.net/ubuntu/+source/{name}"/>\n'
+            "        <description/>\n"
+            '        <affected family="unix">\n'
+            "          <platform>Ubuntu 22.04 LTS</platform>\n"
+            "        </affected>\n"
+            "      </metadata>\n"
+            '      <criteria operator="AND">\n'
+            '        <extend_definition definition_ref="{inventory_id}" comment="Ubuntu 22.04 LTS is installed." '
+            'applicability_check="true"/>\n'
+            "{criteria}"
+            "      </criteria>\n"
+            "    </definition>\n"
+        ).format(
+            id=package.get_id("def"),
+            name=package.name,
+            inventory_id=shared.get_id("def", 100),
+            criteria=self.get_criteria(package, test_refs, 1, 8),
+        )
+
+    def get_criteria(self, package: GeneratedPackage, test_refs: List[str], depth: int, indent: int) -> str:
+        """Return the definition of the package"""
+        """Return the criteria testing test_refs, nested criteria_depth levels deep from depth, alternating between
+        the OR and AND operators. The tests are split between two criteria at every level but the last one"""
+        if depth >= self.criteria_depth or len(test_refs) < 2:
+            criteria = "".join(
+                '{}  <criterion test_ref="{}" comment="{} package in jammy is vulnerable."/>\n'.format(
+                    " " * indent, test_ref, package.name
+                )
+                for test_ref in test_refs
+            )
+        else:
+            middle = len(test_refs) // 2
+            criteria = self.get_criteria(package, test_refs[:middle], depth + 1, indent + 2) + self.get_criteria(
+                package, test_refs[middle:], depth + 1, indent + 2
+            )
+        operator = "OR" if depth % 2 else "AND"
+        return '{0}<criteria operator="{1}">\n{2}{0}</criteria>\n'.format(" " * indent, operator, criteria)
+
+    def get_shared_tests(self, shared: GeneratedPackage) -> str:
+        return (
+            '    <ind-def:family_test id="{}" check="at least one" check_existence="at_least_one_exists" version="1" '
+            'comment="Is the host part of the unix family?">\n'
+            '      <ind-def:object object_ref="{}"/>\n'
+            '      <ind-def:state state_ref="{}"/>\n'
+            "    </ind-def:family_test>\n"
+            '    <ind-def:textfilecontent54_test id="{}" check="at least one" check_existence="at_least_one_exists" '
+            'version="1" comment="Is the host running Ubuntu jammy?">\n'
+            '      <ind-def:object object_ref="{}"/>\n'
+            '      <ind-def:state state_ref="{}"/>\n'
+            "    </ind-def:textfilecontent54_test>\n"
+        ).format(
+            shared.get_id("tst", 100),
+            shared.get_id("obj", 100),
+            shared.get_id("ste", 100),
+            shared.get_id("tst", 101),
+            shared.get_id("obj", 101),
+            shared.get_id("ste", 101),
+        )
+
+    def get_package_tests(self, package: GeneratedPackage, shared: GeneratedPackage) -> str:
+        """Return the tests of the inventory definition"""
+        tests = "".join(
+            '    <linux-def:dpkginfo_test id="{}" version="1" check_existence="at_least_one_exists" '
+            "check=\"at least one\" comment=\"Does the '{}' package exist and is the version less than '{}'?\">\n"
+            '      <linux-def:object object_ref="{}"/>\n'
+            '      <linux-def:state state_ref="{}"/>\n'
+            "    </linux-def:dpkginfo_test>\n".format(
+                package.get_id("tst", test_number),
+                package.name,
+                self.get_version(package, test_number),
+                package.get_id("obj", test_number % 2),  # Binaries of the package are split between two objects
+                package.get_id("ste", test_number),
+            )
+            for test_number in range(package.test_count)
+        )
+        if package.is_kernel:
+            tests += (
+                '    <ind-def:variable_test id="{}" version="1" check="all" check_existence="all_exist" '
+                "comment=\"Is the kernel version of {} less than '{}'?\">\n"
+                '      <ind-def:object object_ref="{}"/>\n'
+                '      <ind-def:state state_ref="{}"/>\n'
+                "    </ind-def:variable_test>\n"
+            ).format(
+                package.get_id("tst", 999),
+                package.name,
+                self.get_version(package, 999),
+                shared.get_id("obj", 1),
+                package.get_id("ste", 999),
+            )
+        return tests
+
+    def get_shared_objects(self, shared: GeneratedPackage) -> str:
+        """Return the tests of the package, and the kernel version test of a kernel package"""
+        return (
+            '    <ind-def:family_object id="{}" version="1" comment="The singleton family object."/>\n'
+            '    <ind-def:textfilecontent54_object id="{}" version="1" comment="The singleton jammy object.">\n'
+            "      <ind-def:filepath>/etc/lsb-release</ind-def:filepath>\n"
+            '      <ind-def:pattern operation="pattern match">^[\\s\\S]*DISTRIB_CODENAME=([a-z]+)$</ind-def:pattern>\n'
+            '      <ind-def:instance datatype="int">1</ind-def:instance>\n'
+            "    </ind-def:textfilecontent54_object>\n"
+            '    <unix-def:uname_object id="{}" version="1" comment="The uname object."/>\n'
+            '    <ind-def:variable_object id="{}" version="1" comment="The kernel version.">\n'
+            "      <ind-def:var_ref>{}</ind-def:var_ref>\n"
+            "    </ind-def:variable_object>\n"
+        ).format(
+            shared.get_id("obj", 100),
+            shared.get_id("obj", 101),
+            shared.get_id("obj"),
+            shared.get_id("obj", 1),
+            shared.get_id("var"),
+        )
+
+    def get_package_objects(self, package: GeneratedPackage, shared: GeneratedPackage) -> str:
+        """Return the objects of the inventory definition, the uname object and the kernel version object"""
+        return "".join(
+            '    <linux-def:dpkginfo_object id="{}" version="1" comment="The \'{}\' package binaries">\n'
+            '      <linux-def:name var_ref="{}" var_check="at least one"/>\n'
+            "    </linux-def:dpkginfo_object>\n".format(
+                package.get_id("obj", object_number), package.name, package.get_id("var", object_number)
+            )
+            for object_number in range(min(package.test_count, 2))
+        )
+
+    def get_shared_states(self, shared: GeneratedPackage) -> str:
+        """Return the objects of the package, which its tests share"""
+        return (
+            '    <ind-def:family_state id="{}" version="1" comment="The singleton family state.">\n'
+            "      <ind-def:family>unix</ind-def:family>\n"
+            "    </ind-def:family_state>\n"
+            '    <ind-def:textfilecontent54_state id="{}" version="1" comment="The singleton jammy state.">\n'
+            "      <ind-def:subexpression>jammy</ind-def:subexpression>\n"
+            "    </ind-def:textfilecontent54_state>\n"
+        ).format(shared.get_id("ste", 100), shared.get_id("ste", 101))
+
+    def get_package_states(self, package: GeneratedPackage, shared: GeneratedPackage) -> str:
+        """Return the states of the inventory definition"""
+        states = "".join(
+            '    <linux-def:dpkginfo_state id="{}" version="1" comment="The package version is less than \'{}\'">\n'
+            '      <linux-def:evr datatype="debian_evr_string" operation="less than">0:{}</linux-def:evr>\n'
+            "    </linux-def:dpkginfo_state>\n".format(
+                package.get_id("ste", test_number),
+                self.get_version(package, test_number),
+                self.get_version(package, test_number),
+            )
+            for test_number in range(package.test_count)
+        )
+        if package.is_kernel:
+            states += (
+                '    <ind-def:variable_state id="{}" version="1" comment="The kernel version is less than \'{}\'">\n'
+                '      <ind-def:value datatype="debian_evr_string" operation="less than">0:{}</ind-def:value>\n'
+                "    </ind-def:variable_state>\n"
+            ).format(package.get_id("ste", 999), self.get_version(package, 999), self.get_version(package, 999))
+        return states
+
+    def get_shared_variables(self, shared: GeneratedPackage) -> str:
+        """Return the states of the tests of the package"""
+        return (
+            '    <local_variable id="{}" version="1" datatype="debian_evr_string" comment="Kernel version in evr '
+            'format">\n'
+            "      <concat>\n"
+            "        <literal_component>0:</literal_component>\n"
+            '        <regex_capture pattern="^([\\d|\\.]+-\\d+)[-|\\w]+$">\n'
+            '          <object_component object_ref="{}" item_field="os_release"/>\n'
+            "        </regex_capture>\n"
+            "      </concat>\n"
+            "    </local_variable>\n"
+        ).format(shared.get_id("var"), shared.get_id("obj"))
+
+    def get_package_variables(self, package: GeneratedPackage, shared: GeneratedPackage) -> str:
+        """Return the kernel local_variable, computed from the uname object"""
+        return "".join(
+            '    <constant_variable id="{}" version="1" datatype="string" comment="The \'{}\' package binaries">\n'
+            "      <value>{}</value>\n"
+            "      <value>{}-dev</value>\n"
+            "    </constant_variable>\n".format(
+                package.get_id("var", object_number), package.name, package.name, package.name
+            )
+            for object_number in range(min(package.test_count, 2))
+        )
+
+    @staticmethod
+    def get_version(package: GeneratedPackage, test_number: int) -> str:
+        """Return the variables holding the binary package names of the objects of the package"""
+        """Return the version a test of the package compares the installed version with"""
+        return "{}.{}.{}-0ubuntu1".format(len(package.name), package.number % 100, test_number)
@@ -0,0 +1,37 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class IDInterner:
+    """Interns the references to the elements of an XML file, (element type, identifier) pairs, into dense integer
+    handles. The closures of the definitions are built as sets of these small integers, which are cheaper to hash,
+    compare and keep than the long identifier strings, and the handles are converted back to identifiers only when
+    the output is assembled. The references found in the tree of the element of every handle are cached as handles
+    too, so they are only interned once for all the definitions of the file"""
+
+    def __init__(self):
+        self.reference_to_handle: Dict[Tuple[str, str], int] = {}  # Map of every interned reference to its handle
+        self.references: List[Tuple[str, str]] = []  # Interned references, indexed by handle
+        self.referenced_handles: List[Optional[List[int]]] = []  # Handles of the references found in the tree of the
+        # element of every handle, indexed by handle, None until they are looked up
+
+    def __len__(self) -> int:
+        return len(self.references)
+
+    def intern_all(self, references: Iterable[Tuple[str, str]]) -> List[int]:
+        """Return the handles of the given references, in the same order. A reference that was not interned yet is
+        allocated the next handle"""
+        reference_to_handle, interned_references = self.reference_to_handle, self.references
+        handles = []
+        for reference in references:
+            handle = reference_to_handle.get(reference)
+            if handle is None:
+                handle = reference_to_handle[reference] = len(interned_references)
+                interned_references.append(reference)
+                self.referenced_handles.append(None)
+            handles.append(handle)
+        return handles
+
+    def get_ids(self, handles: Iterable[int]) -> List[str]:
+        """Return the identifiers of the elements referenced by the given handles, in the same order"""
+        references = self.references
+        return [references[handle][1] for handle in handles]
@@ -0,0 +1,324 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import tempfile
+from typing import IO, Dict, List, Optional, Tuple, Union
+
+from oval_xml_feed_merge import __version__
+from oval_xml_feed_merge.compression import Compression
+from oval_xml_feed_merge.index_cache import IndexCache
+from oval_xml_feed_merge.merge_stats import MergeStats
+from oval_xml_feed_merge.oval_xml_feed_merge import OvalXMLFeedMerge
+from oval_xml_feed_merge.streaming_oval_xml_feed_merge import StreamingOvalXMLFeedMerge
+from oval_xml_feed_merge.xml_engine import XMLEngine
+from oval_xml_feed_merge.xml_file_index import IndexedElement, IndexedOutputXMLFile, XMLFileIndex
+from oval_xml_feed_merge.xml_writer import XMLWriter
+
+
+class MergeManifest:
+    """Describes a merged output file: a key identifying how every element of its OVAL sections was written, where
+    that element is in the output file and a key of the closure of every package. It is written next to the output
+    file, so that the next merge can copy the elements that did not change from the output file instead of reading
+    them from the input files again"""
+
+    format_version = 2  # Version of the manifest format, bumped whenever it changes
+    suffix = ".manifest.json"  # Suffix added to the name of the output file to name its manifest
+
+    def __init__(self):
+        self.layout_key: str = ""  # Hash of how the elements are indented and their lines separated
+        self.namespace_prefixes: Dict[str, str] = {}  # Prefix of every namespace URI used in the output file
+        self.element_locations: Dict[str, List[Union[str, int]]] = {}  # Output element identifier to the key of the
+        # element, see XMLFileIndex.get_element_keys, and its start and end byte offsets in the output file
+        self.package_keys: Dict[str, str] = {}  # Package name to the key of the closure of its definition, see
+        # IncrementalOutputXMLFile.get_package_key
+        self.output_size: int = 0  # Size of the output file in bytes
+        self.output_hash: str = ""  # SHA-256 of the output file
+
+    @staticmethod
+    def get_path(output_file_name: str) -> str:
+        """Return the path of the manifest of an output file"""
+        return output_file_name + MergeManifest.suffix
+
+    @staticmethod
+    def get_layout_key(xml_writer: XMLWriter) -> str:
+        """Return a key identifying how xml_writer indents the elements and separates their lines"""
+        key = (xml_writer.indent, os.linesep)
+        return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def load(path: str) -> Optional["MergeManifest"]:
+        """Return the manifest stored at path, or None if it is missing, unreadable or written by another version"""
+        try:
+            with open(path, "r", encoding="utf-8") as manifest_file:
+                state = json.load(manifest_file)
+            if state["version"] != [__version__, MergeManifest.format_version]:
+                logging.info("Ignoring {}, it was written by another version".format(path))
+                return None
+            manifest = MergeManifest()
+            for name in vars(manifest):
+                setattr(manifest, name, state[name])
+            return manifest
+        except FileNotFoundError:
+            logging.info("No manifest found at {}".format(path))
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            logging.warning("Ignoring unreadable manifest {}: {}".format(path, error))
+        return None
+
+    def save(self, path: str):
+        """Store the manifest at path, with the permissions of a file created by open() rather than the private ones
+        of the temporary file it is written to first"""
+        state = dict(vars(self), version=[__version__, MergeManifest.format_version])
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as manifest_file:
+                manifest_file.write(json.dumps(state, separators=(",", ":")))  # Much faster than json.dump
+            umask = os.umask(0)  # The umask can only be read by setting it
+            os.umask(umask)
+            os.chmod(temporary_path, 0o666 & ~umask)
+            os.replace(temporary_path, path)
+        except Exception:
+            IndexCache.remove(temporary_path)
+            raise
+
+
+class TrackedOutputFile:
+    """Wraps the file object the output is written to, tracking the size and the hash of the UTF-8 encoded output"""
+
+    def __init__(self, output_file: IO):
+        self.output_file: IO = output_file  # Binary or text file object the output is written to
+        self.is_text: bool = XMLWriter.is_text_file(output_file)  # True if output_file is a text file object
+        self.size: int = 0  # Number of bytes written
+        self.digest = hashlib.sha256()  # Hash of the bytes written
+
+    def write(self, data: Union[bytes, str]) -> int:
+        encoded_data = data.encode("utf-8") if self.is_text else data
+        self.size += len(encoded_data)
+        self.digest.update(encoded_data)
+        return self.output_file.write(data)
+
+
+class IncrementalOutputXMLFile(IndexedOutputXMLFile):
+    """The output XML file of an incremental merge. Elements written to the previous output file with the same
+    identifier and key, i.e. the same bytes in their input file and the same identifiers regenerated in them, are
+    copied from the previous output file instead of being read from the input file, parsed and serialized again,
+    wherever they are in their input file. The key and location of every element in the output file are recorded in
+    a new manifest"""
+
+    def __init__(
+        self,
+        xml_files: List[XMLFileIndex],
+        ns_prefix_map: Dict[str, str],
+        previous_manifest: Optional[MergeManifest] = None,
+        previous_output_file: Optional[IO] = None,
+    ):
+        super().__init__(xml_files[-1], ns_prefix_map)
+        self.previous_manifest: Optional[MergeManifest] = previous_manifest  # Manifest of the previous output file
+        self.previous_output_file: Optional[IO] = previous_output_file  # Binary file object of the previous output
+        self.manifest: MergeManifest = MergeManifest()  # Manifest of the output file
+        self.element_keys: Dict[str, str] = {}  # Identifier of every element of the output to its key, see
+        # XMLFileIndex.get_element_keys
+        self.copied_element_count: int = 0  # Number of elements copied from the previous output file
+        self.namespace_uris_to_is_same: Dict[Tuple[str, ...], bool] = {}  # Whether the namespace URIs used by an
+        # element have the same prefixes as in the previous output file
+
+    def update_element_keys(self):
+        """Compute the key of every element of the output, reading the elements of each input file together"""
+        xml_file_index_to_elements: Dict[XMLFileIndex, List[IndexedElement]] = {}
+        for elements in self.path_to_elements.values():
+            for element in elements:
+                if element.element_id is not None:
+                    xml_file_index_to_elements.setdefault(element.xml_file_index, []).append(element)
+        for xml_file_index, elements in xml_file_index_to_elements.items():
+            for element, key in zip(elements, xml_file_index.get_element_keys(elements)):
+                self.element_keys[element.get("id")] = key
+
+    def get_package_key(self, definition: IndexedElement) -> str:
+        """Return a key identifying how the closure of a definition, the definition and all the elements it references
+        directly or indirectly, is written to the output file"""
+        id_to_referenced_ids_map = definition.xml_file_index.id_to_referenced_ids_map
+        element_ids = {definition.get("id")}
+        element_ids_to_visit = list(element_ids)
+        while element_ids_to_visit:
+            for _, referenced_id in id_to_referenced_ids_map.get(element_ids_to_visit.pop(), ()):
+                if referenced_id and referenced_id not in element_ids:
+                    element_ids.add(referenced_id)
+                    element_ids_to_visit.append(referenced_id)
+        key = hashlib.sha256()
+        for element_id in sorted(element_ids):
+            key.update("{} {}\n".format(element_id, self.element_keys.get(element_id, "")).encode("utf-8"))
+        return key.hexdigest()
+
+    def get_previous_location(self, element: IndexedElement) -> Optional[Tuple[int, int]]:
+        """Return the start and end byte offsets of an element in the previous output file, if it was written there
+        with the same key"""
+        if self.previous_manifest is None or element.element_id is None:
+            return None
+        element_id = element.get("id")
+        location = self.previous_manifest.element_locations.get(element_id)
+        if location is None:
+            return None
+        key, start, end = location
+        if key != self.element_keys.get(element_id):
+            return None
+        if not self.has_same_prefixes(element.namespace_uris):
+            return None
+        return start, end
+
+    def record_location(self, element: IndexedElement, start: int, end: int):
+        """Record the start and end byte offsets of an element in the output file"""
+        if element.element_id is not None:
+            element_id = element.get("id")
+            self.manifest.element_locations[element_id] = [self.element_keys.get(element_id, ""), start, end]
+
+    def check_layout(self, xml_writer: XMLWriter):
+        """Record the layout of the output, once xml_writer has collected the namespaces used in it, and stop copying
+        elements if they are indented differently"""
+        self.manifest.layout_key = MergeManifest.get_layout_key(xml_writer)
+        self.manifest.namespace_prefixes = dict(xml_writer.used_namespaces)
+        if self.previous_manifest is not None and self.previous_manifest.layout_key != self.manifest.layout_key:
+            logging.info("The layout of the output changed, no element is copied from the previous output")
+            self.previous_manifest = None
+
+    def has_same_prefixes(self, namespace_uris: Tuple[str, ...]) -> bool:
+        """Return True if the given namespace URIs have the same prefix as in the previous output file"""
+        is_same = self.namespace_uris_to_is_same.get(namespace_uris)
+        if is_same is None:
+            previous_prefixes, prefixes = self.previous_manifest.namespace_prefixes, self.manifest.namespace_prefixes
+            is_same = all(previous_prefixes.get(uri) == prefixes.get(uri) for uri in namespace_uris)
+            self.namespace_uris_to_is_same[namespace_uris] = is_same
+        return is_same
+
+    def copy_elements(self, xml_writer: XMLWriter, elements: List[Tuple[IndexedElement, Tuple[int, int]]]):
+        """Copy elements, given along with their location, from the previous output file. Elements next to each other
+        in the previous output file are copied together, at most batch_size bytes at a time"""
+        xml_writer.flush()
+        output_file: TrackedOutputFile = xml_writer.output_file
+        run: List[Tuple[IndexedElement, int, int]] = []
+        for element, (start, end) in elements + [(None, (-1, -1))]:
+            if run and (start != run[-1][2] or run[-1][2] - run[0][1] >= IndexedOutputXMLFile.batch_size):
+                run_start, run_end = run[0][1], run[-1][2]
+                offset = output_file.size - run_start
+                self.previous_output_file.seek(run_start)
+                data = self.previous_output_file.read(run_end - run_start)
+                output_file.write(data.decode("utf-8") if output_file.is_text else data)
+                for run_element, run_element_start, run_element_end in run:
+                    self.record_location(run_element, run_element_start + offset, run_element_end + offset)
+                self.copied_element_count += len(run)
+                run = []
+            if element is not None:
+                run.append((element, start, end))
+
+    def write_elements(self, xml_writer: XMLWriter, indexed_elements: List[IndexedElement]):
+        """Write the given elements as the children of an open section, copying the unchanged ones from the previous
+        output file"""
+        if not self.manifest.layout_key:
+            self.check_layout(xml_writer)
+        output_file: TrackedOutputFile = xml_writer.output_file
+        elements = [(element, self.get_previous_location(element)) for element in indexed_elements]
+        for is_unchanged, run in itertools.groupby(elements, key=lambda item: item[1] is not None):
+            run = list(run)
+            if is_unchanged:
+                self.copy_elements(xml_writer, run)
+                continue
+            indexed_run = [element for element, _ in run]
+            for indexed_element, element in zip(indexed_run, self.read_elements(indexed_run)):
+                xml_writer.flush()
+                start = output_file.size
+                xml_writer.write_child(element, 2)
+                xml_writer.flush()
+                self.record_location(indexed_element, start, output_file.size)
+
+    def dump_to_file(self, output_file: IO):
+        """Write XML to specified file, recording the location of every element in the manifest"""
+        tracked_output_file = TrackedOutputFile(output_file)
+        super().dump_to_file(tracked_output_file)
+        self.manifest.output_size = tracked_output_file.size
+        self.manifest.output_hash = tracked_output_file.digest.hexdigest()
+        logging.debug("Copied {} elements from the previous output".format(self.copied_element_count))
+
+
+class IncrementalOvalXMLFeedMerge(StreamingOvalXMLFeedMerge):
+    """Merges OVAL XML feeds like StreamingOvalXMLFeedMerge, reusing the output of a previous merge. The elements
+    that did not change since the previous merge are copied from its output file, found through the manifest written
+    next to it, so that only the changed packages are read from the input files and serialized again.
+    A manifest is written next to the output file as well. The output is identical to the one of OvalXMLFeedMerge"""
+
+    def __init__(
+        self,
+        raw_xml_files: List[IO],
+        output_file: IO,
+        jobs: int = 1,
+        xml_engine_name: str = XMLEngine.name,
+        index_cache: Optional[IndexCache] = None,
+        previous_output_name: Optional[str] = None,
+        stats: Optional[MergeStats] = None,
+    ):
+        self.previous_manifest: Optional[MergeManifest] = None  # Manifest of the previous output file
+        self.previous_output_file: Optional[IO] = None  # Binary file object of the previous output file
+        self.changed_pkg_names: List[str] = []  # Packages whose closure changed since the previous merge
+        if previous_output_name is not None:
+            self.open_previous_output(previous_output_name)
+        super().__init__(raw_xml_files, output_file, jobs, xml_engine_name, index_cache, stats)
+
+    def open_previous_output(self, previous_output_name: str):
+        """Open the previous output file and load its manifest, unless either is missing or they do not match"""
+        previous_manifest = MergeManifest.load(MergeManifest.get_path(previous_output_name))
+        if previous_manifest is None:
+            return
+        try:
+            previous_output_file = open(previous_output_name, "rb")
+        except OSError as error:
+            logging.warning("Cannot read the previous output: {}".format(error))
+            return
+        previous_output_file = Compression.get_random_access_file(Compression.open_input(previous_output_file))
+        if IndexCache.get_content_hash(previous_output_file) != previous_manifest.output_hash:
+            logging.warning("{} changed since its manifest was written, it is not reused".format(previous_output_name))
+            previous_output_file.close()
+            return
+        self.previous_manifest, self.previous_output_file = previous_manifest, previous_output_file
+
+    def setup_output_xml_file(self) -> IncrementalOutputXMLFile:
+        """Setup an IncrementalOutputXMLFile object, based on the index of the last input file, that will be updated
+        with merged contents and finally written to disk"""
+        xml_file = IncrementalOutputXMLFile(
+            self.xml_files, self.ns_prefix_map, self.previous_manifest, self.previous_output_file
+        )
+        xml_file.update_ns_map_and_register_ns()
+        xml_file.clear_elements(OvalXMLFeedMerge.xml_elements_to_merge)
+        return xml_file
+
+    def update_definitions_element_and_references(self):
+        """Update the output XML from the pkgname_to_definition map, compute the key of every element of the output
+        and of the closure of every package, and report the packages that changed since the previous merge"""
+        super().update_definitions_element_and_references()
+        self.output_xml_file.update_element_keys()
+        manifest = self.output_xml_file.manifest
+        for pkg_name, definition_tree in self.pkgname_to_definition_tree.items():
+            manifest.package_keys[pkg_name] = self.output_xml_file.get_package_key(definition_tree.definition_element)
+            if not self.previous_manifest or self.previous_manifest.package_keys.get(pkg_name) != (
+                manifest.package_keys[pkg_name]
+            ):
+                self.changed_pkg_names.append(pkg_name)
+        if self.previous_manifest is not None:
+            removed_pkg_names = set(self.previous_manifest.package_keys) - set(manifest.package_keys)
+            logging.info(
+                "{} of {} packages changed and {} were removed since the previous merge".format(
+                    len(self.changed_pkg_names), len(manifest.package_keys), len(removed_pkg_names)
+                )
+            )
+            if self.changed_pkg_names:
+                logging.debug("Changed packages: {}".format(", ".join(self.changed_pkg_names)))
+
+    def validate_and_produce_output(self):
+        """Validate and dump the output XML to a file, then write its manifest next to it"""
+        try:
+            super().validate_and_produce_output()
+        finally:
+            if self.previous_output_file is not None:
+                self.previous_output_file.close()
+        self.output_file.flush()
+        manifest_path = MergeManifest.get_path(self.output_file.name)
+        logging.debug("Writing the manifest to: {}".format(manifest_path))
+        self.output_xml_file.manifest.save(manifest_path)
@@ -0,0 +1,96 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from typing import IO, Any, Optional
+
+from oval_xml_feed_merge import __version__
+
+
+class IndexCache:
+    """An on-disk cache of the indexes of input files, so that unchanged files are not parsed again.
+    Entries are keyed by the SHA-256 of the file contents, the version of the tool and the version of the index
+    format. The cache is kept under max_size bytes by evicting the least recently used entries"""
+
+    format_version = 3  # Version of the cached index format, bumped whenever the index changes
+    suffix = ".index"  # Suffix of the cache entry files
+    read_size = 1048576  # Number of bytes read from a file at a time to hash its contents
+
+    def __init__(self, cache_dir: str, max_size: int):
+        self.cache_dir: str = cache_dir  # Directory the cache entries are stored in
+        self.max_size: int = max_size  # Maximum total size of the cache entries in bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_content_hash(binary_file: IO) -> str:
+        """Return the SHA-256 of the whole contents of a binary file object"""
+        digest = hashlib.sha256()
+        binary_file.seek(0)
+        for chunk in iter(lambda: binary_file.read(IndexCache.read_size), b""):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def get_key(content_hash: str, *parameters: Any) -> str:
+        """Return the cache key of a file, from the hash of its contents and the other parameters its index depends
+        on"""
+        key = (__version__, IndexCache.format_version, content_hash) + parameters
+        return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        """Return the path of the cache entry with the given key"""
+        return os.path.join(self.cache_dir, key + IndexCache.suffix)
+
+    def load(self, key: str) -> Optional[Any]:
+        """Return the index stored under key, or None if there is none. Unreadable entries are removed"""
+        path = self.get_path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                index = pickle.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception as error:
+            logging.warning("Removing unreadable cache entry {}: {}".format(path, error))
+            self.remove(path)
+            return None
+        os.utime(path)  # Mark the entry as recently used
+        return index
+
+    def store(self, key: str, index: Any):
+        """Store an index under key, then evict the least recently used entries if the cache is too large"""
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as cache_file:
+                pickle.dump(index, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, self.get_path(key))  # Concurrent runs never see a partial entry
+        except Exception:
+            self.remove(temporary_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_size"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(IndexCache.suffix):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # Evicted by another thread or process meanwhile
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            logging.debug("Evicting cache entry {}".format(path))
+            self.remove(path)
+            total_size -= size
+
+    @staticmethod
+    def remove(path: str):
+        """Remove a file, if it still exists"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,147 @@
+import json
+import logging
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import IO, Dict, Generator, Iterable, Union
+
+from oval_xml_feed_merge import __version__
+from oval_xml_feed_merge.xml_writer import XMLWriter
+
+
+class MergeStats:
+    """Records the wall time, CPU time, peak RSS and peak traced memory of every phase of a merge, and counts what
+    the merge processed, for the --stats report. A disabled MergeStats only keeps the counts, which are cheap"""
+
+    counter_names = [
+        "bytes_read",
+        "elements_indexed",
+        "ids_rewritten",
+        "definitions_shadowed",
+        "elements_emitted",
+        "bytes_written",
+    ]
+
+    def __init__(self, enabled: bool = True):
+        self.enabled: bool = enabled  # False to only keep the counts
+        self.phases: Dict[str, Dict[str, Union[int, float]]] = {}  # Resources used by every phase, in the order the
+        # phases first ran. A phase that runs several times accumulates its times and keeps its highest peaks
+        self.counters: Dict[str, int] = dict.fromkeys(MergeStats.counter_names, 0)  # Counts of what was processed
+        self.start_wall: float = time.perf_counter()  # Wall clock when the merge started
+        self.start_cpu: float = time.process_time()  # CPU time of the process when the merge started
+        self.is_tracing: bool = enabled and not tracemalloc.is_tracing()  # True if tracemalloc was started here
+        if self.is_tracing:
+            tracemalloc.start()
+
+    @staticmethod
+    def reset_peak_rss() -> bool:
+        """Reset the peak RSS of the process to its current RSS. Return False if the platform cannot"""
+        try:
+            with open("/proc/self/clear_refs", "w") as clear_refs:
+                clear_refs.write("5")
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def get_peak_rss() -> int:
+        """Return the peak RSS of the process in bytes, since it was last reset if the platform can reset it"""
+        try:
+            with open("/proc/self/status") as status:
+                for line in status:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss if sys.platform == "darwin" else peak_rss * 1024  # Kilobytes, except on macOS
+
+    @contextmanager
+    def phase(self, name: str) -> Generator[None, None, None]:
+        """Return a context manager recording the resources used by the code it runs as the phase called name"""
+        if not self.enabled:
+            yield
+            return
+        is_reset = MergeStats.reset_peak_rss()
+        if self.is_tracing and hasattr(tracemalloc, "reset_peak"):  # Python 3.9+, else the peak is the global one
+            tracemalloc.reset_peak()
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            phase = self.phases.setdefault(
+                name,
+                {"wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_bytes": 0, "tracemalloc_peak_bytes": 0},
+            )
+            phase["wall_seconds"] += time.perf_counter() - start_wall
+            phase["cpu_seconds"] += time.process_time() - start_cpu
+            phase["peak_rss_bytes"] = max(phase["peak_rss_bytes"], MergeStats.get_peak_rss() if is_reset else 0)
+            if self.is_tracing:
+                phase["tracemalloc_peak_bytes"] = max(
+                    phase["tracemalloc_peak_bytes"], tracemalloc.get_traced_memory()[1]
+                )
+            logging.debug("Phase {} took {:.3f}s".format(name, time.perf_counter() - start_wall))
+
+    def count(self, name: str, value: int = 1):
+        """Add value to the counter called name"""
+        self.counters[name] += value
+
+    def count_bytes_read(self, raw_xml_files: Iterable[IO]):
+        """Count the bytes read from the input files, i.e. their position once they were parsed. Files whose
+        position is unknown, e.g. pipes, are not counted. Only counted if enabled"""
+        if not self.enabled:
+            return
+        for raw_xml_file in raw_xml_files:
+            try:
+                self.count("bytes_read", raw_xml_file.tell())
+            except (OSError, ValueError):
+                pass
+
+    def to_dict(self) -> Dict:
+        """Return the report, ready to be serialized to JSON"""
+        wall_seconds = time.perf_counter() - self.start_wall
+
+        def get_throughput(counter_name: str, phase_name: str) -> float:
+            seconds = self.phases.get(phase_name, {}).get("wall_seconds")
+            return round(self.counters[counter_name] / seconds) if seconds else 0
+
+        return {
+            "version": __version__,
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": time.process_time() - self.start_cpu,
+            "peak_rss_bytes": max([phase["peak_rss_bytes"] for phase in self.phases.values()] + [0]),
+            "phases": self.phases,
+            "counters": self.counters,
+            "throughput": {
+                "bytes_read_per_second": get_throughput("bytes_read", "parse"),
+                "bytes_written_per_second": get_throughput("bytes_written", "dump_to_file"),
+                "elements_emitted_per_second": round(self.counters["elements_emitted"] / wall_seconds),
+            },
+        }
+
+    def write(self, stats_file_name: str):
+        """Write the report as JSON to the file called stats_file_name, or to stderr if it is "-" """
+        if self.is_tracing:
+            tracemalloc.stop()
+            self.is_tracing = False
+        stats = json.dumps(self.to_dict(), indent=2)
+        if stats_file_name == "-":
+            print(stats, file=sys.stderr)
+            return
+        with open(stats_file_name, "w") as stats_file:
+            stats_file.write(stats + "\n")
+
+
+class CountingOutputFile:
+    """Wraps the file object the output is written to, counting the bytes of the UTF-8 encoded output"""
+
+    def __init__(self, output_file: IO, merge_stats: MergeStats):
+        self.output_file: IO = output_file  # Binary or text file object the output is written to
+        self.merge_stats: MergeStats = merge_stats  # Stats the bytes written are counted in
+        self.is_text: bool = XMLWriter.is_text_file(output_file)  # True if output_file is a text file object
+
+    def write(self, data: Union[bytes, str]) -> int:
+        self.merge_stats.count("bytes_written", len(data.encode("utf-8") if self.is_text else data))
+        return self.output_file.write(data)
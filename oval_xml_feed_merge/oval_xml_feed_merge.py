@@ -1,13 +1,15 @@
 """Main module."""
 import logging
-from typing import List, IO, Dict
+from typing import List, IO, Dict, Generator, Optional, Set
 
+from oval_xml_feed_merge.compression import Compression
+from oval_xml_feed_merge.merge_stats import CountingOutputFile, MergeStats
 from oval_xml_feed_merge.utils import Utils
-from oval_xml_feed_merge.xml_utils import XMLUtils
+from oval_xml_feed_merge.worker_pool import WorkerPool
 
 from oval_xml_feed_merge.definition_tree import DefinitionTree
+from oval_xml_feed_merge.xml_engine import XMLEngine
 from oval_xml_feed_merge.xml_file import XMLFile
-import xml.etree.ElementTree as ET
 
 
 class OvalXMLFeedMerge:
@@ -17,28 +19,75 @@ class OvalXMLFeedMerge:
 
     xml_elements_to_merge = ["./definitions", "./tests", "./objects", "./states", "./variables"]
 
-    def __init__(self, raw_xml_files: List[IO], output_file: IO):
+    def __init__(
+        self,
+        raw_xml_files: List[IO],
+        output_file: IO,
+        jobs: int = 1,
+        xml_engine_name: str = XMLEngine.name,
+        stats: Optional[MergeStats] = None,
+    ):
+        self.stats: MergeStats = stats if stats is not None else MergeStats(False)  # Resources used by every phase
+        # of the merge and counts of what it processed
+        self.worker_pool: WorkerPool = WorkerPool(jobs)  # Threads reading and parsing the input files and replacing
+        # their IDs, one file per thread. They share the GIL, so only reading and decompressing the files overlap. See
+        # StreamingOvalXMLFeedMerge.read_xml_files for the indexes built in worker processes
+        self.xml_engine: XMLEngine = XMLEngine.get_engine(xml_engine_name)  # Engine used to parse the XML files
         self.ns_prefix_map: Dict[str, str] = {}  # Map namespace prefix to URI
         self.pkgname_to_definition_tree: Dict[
             str, DefinitionTree
         ] = {}  # Map of the package name to "definition" XML element
-        suffix_generator = Utils.next_int(0)
-        global_input_id_set = set()  # A global set to track all seen OVAL IDs
-        self.xml_files: List[XMLFile] = [
-            XMLFile(
-                XMLUtils.as_string_io_with_regenerated_ids(xml_file, suffix_generator, global_input_id_set),
-                self.ns_prefix_map,
-            )
-            for xml_file in raw_xml_files
-        ]  # Input files
-        self.output_xml_file: XMLFile = self.setup_output_xml_file(raw_xml_files[-1])  # Bootstrap an object to store
-        # the output XML
+        opened_xml_files = [Compression.open_input(raw_xml_file) for raw_xml_file in raw_xml_files]  # Compressed
+        # input files are decompressed while they are parsed
+        with self.worker_pool:  # Its threads are shut down once the input files are created
+            self.xml_files: List[XMLFile] = self.create_xml_files(
+                opened_xml_files, Utils.next_int(0), set()
+            )  # Input files
+        self.stats.count_bytes_read(raw_xml_files)
+        with self.stats.phase("setup_output"):
+            self.output_xml_file: XMLFile = self.setup_output_xml_file()  # Bootstrap an object
+            # to store the output XML
 
         self.output_file: IO = output_file
 
-    def setup_output_xml_file(self, raw_xml_file: IO) -> XMLFile:
-        """Setup an XMLFile object that will be updated with merged contents and finally written to disk or stdout"""
-        xml_file = XMLFile(raw_xml_file, self.ns_prefix_map)
+    def create_xml_file(self, raw_xml_file: IO) -> XMLFile:
+        """Create the XMLFile object for an input file"""
+        return XMLFile(raw_xml_file, self.ns_prefix_map, self.xml_engine)
+
+    def read_xml_files(self, raw_xml_files: List[IO]) -> List[XMLFile]:
+        """Create the XMLFile objects for the input files, reading and parsing them concurrently on the threads of
+        worker_pool"""
+        return self.worker_pool.map_in_threads(self.create_xml_file, raw_xml_files)
+
+    def create_xml_files(
+        self, raw_xml_files: List[IO], suffix_generator: Generator[int, None, None], global_input_id_set: Set[str]
+    ) -> List[XMLFile]:
+        """Create the XMLFile objects for the input files. Every OVAL ID already in global_input_id_set, a global set
+        to track all seen OVAL IDs, is given a new ID generated with suffix_generator.
+        The files are read and parsed concurrently, then the new IDs are allocated for one file after another in
+        priority order, then replaced in every file concurrently again, so the IDs do not depend on the number of
+        jobs"""
+        with self.stats.phase("parse"):
+            xml_files = self.read_xml_files(raw_xml_files)
+        with self.stats.phase("id_regeneration"):
+            old_to_new_id_maps = [
+                xml_file.allocate_element_ids(suffix_generator, global_input_id_set) for xml_file in xml_files
+            ]
+            self.worker_pool.map_in_threads(
+                lambda xml_file, old_to_new_id_map: xml_file.replace_element_ids(old_to_new_id_map),
+                xml_files,
+                old_to_new_id_maps,
+            )
+        for xml_file, old_to_new_id_map in zip(xml_files, old_to_new_id_maps):
+            self.stats.count("elements_indexed", xml_file.get_element_id_count())
+            self.stats.count("ids_rewritten", sum(1 for new_element_id in old_to_new_id_map.values() if new_element_id))
+        return xml_files
+
+    def setup_output_xml_file(self) -> XMLFile:
+        """Setup an XMLFile object that will be updated with merged contents and finally written to disk or stdout.
+        It is made of the root element and the sections of the last input file, copied from the tree it was parsed
+        into rather than parsed again"""
+        xml_file = self.xml_files[-1].copy_skeleton(OvalXMLFeedMerge.xml_elements_to_merge)
         xml_file.update_ns_map_and_register_ns()
         xml_file.clear_elements(OvalXMLFeedMerge.xml_elements_to_merge)
         return xml_file
@@ -47,11 +96,13 @@ class OvalXMLFeedMerge:
         """Update the pkgname_to_definition map with the package name and a DefinitionTree object that encapsulates
         its 'definition' element
         If the package already exits in the map, it is discarded and overwritten, thus enforcing the XML file order
-        priority. Only the latest definition tree for a given package name is chosen to be written to the output file
+        priority. Only the latest definition tree for a given package name is chosen to be written to the output file.
+        The elements referenced by a definition are looked up later, once it is known to be written to the output file
         """
         for definition_tree in xml_file.get_definition_trees():
+            if definition_tree.pkg_name in self.pkgname_to_definition_tree:
+                self.stats.count("definitions_shadowed")
             self.pkgname_to_definition_tree[definition_tree.pkg_name] = definition_tree
-            definition_tree.build_referenced_elements_tree()
             logging.debug("Updated definition XML for package: {}".format(definition_tree.pkg_name))
 
     def process_xml_file(self, xml_file: XMLFile):
@@ -75,30 +126,50 @@ class OvalXMLFeedMerge:
     def update_definition_element_references_at_path(self, element_path: str):
         """Get elements directly or indirectly referenced by a definition element chosen to be written to the
         output file and add them to the output file as well"""
-        referenced_elements: List[ET.Element] = []
         for xml_file in self.xml_files:
-            referenced_elements += xml_file.get_referenced_elements(element_path)
-        self.output_xml_file.extend_element_at_path(element_path, referenced_elements)
+            referenced_elements = xml_file.get_referenced_elements(element_path)
+            self.stats.count("elements_emitted", len(referenced_elements))
+            self.output_xml_file.extend_element_at_path(
+                element_path, referenced_elements, xml_file.name, xml_file.get_element_ids(referenced_elements)
+            )
 
     def update_definitions_element_and_references(self):
         """Update the 'definitions' element along with all XML elements that are referenced by individual
-        definition elemnts in the output XML from the pkgname_to_definition map"""
-        for definition_tree in self.pkgname_to_definition_tree.values():
-            self.output_xml_file.append_element_to_path("./definitions", definition_tree.definition_element)
-            definition_tree.sync_referenced_element_ids_to_xml_file()
-
-        for element_path in OvalXMLFeedMerge.xml_elements_to_merge:
-            self.update_definition_element_references_at_path(element_path)
+        definition elemnts in the output XML from the pkgname_to_definition map. Only these definitions have the
+        elements they reference looked up, definitions overwritten by a later XML file are never traversed"""
+        with self.stats.phase("closure_building"):
+            for definition_tree in self.pkgname_to_definition_tree.values():
+                definition_tree.build_referenced_elements_tree()
+                self.output_xml_file.append_element_to_path(
+                    "./definitions",
+                    definition_tree.definition_element,
+                    definition_tree.xml_file_name,
+                    definition_tree.get_element_ids(),
+                )
+                definition_tree.sync_referenced_element_ids_to_xml_file()
+            self.stats.count("elements_emitted", len(self.pkgname_to_definition_tree))
+
+        with self.stats.phase("reference_collection"):
+            for element_path in OvalXMLFeedMerge.xml_elements_to_merge:
+                self.update_definition_element_references_at_path(element_path)
         logging.debug("Updated the 'definitions' element and its dependencies in the output XML")
 
     def validate_and_produce_output(self):
         """Validate and dump the output XML to a file"""
-        self.output_xml_file.validate_xml_ids()
+        with self.stats.phase("validation"):
+            self.output_xml_file.validate_xml_ids()
         logging.debug("Writing XML to: {}".format(self.output_file.name))
-        self.output_xml_file.dump_to_file(self.output_file)
+        with self.stats.phase("dump_to_file"):
+            self.output_xml_file.dump_to_file(
+                CountingOutputFile(self.output_file, self.stats) if self.stats.enabled else self.output_file
+            )
 
     def merge_oval_xml_feeds(self):
         """Self-explanatory"""
-        self.process_xml_files()
-        self.update_definitions_element_and_references()
-        self.validate_and_produce_output()
+        try:
+            with self.stats.phase("process_files"):
+                self.process_xml_files()
+            self.update_definitions_element_and_references()
+            self.validate_and_produce_output()
+        finally:
+            self.worker_pool.close()
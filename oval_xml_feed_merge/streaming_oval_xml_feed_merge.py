@@ -0,0 +1,80 @@
+import io
+from typing import IO, Any, Dict, List, Optional
+
+from oval_xml_feed_merge.index_cache import IndexCache
+from oval_xml_feed_merge.merge_stats import MergeStats
+from oval_xml_feed_merge.oval_xml_feed_merge import OvalXMLFeedMerge
+from oval_xml_feed_merge.xml_engine import XMLEngine
+from oval_xml_feed_merge.worker_pool import WorkerPool
+from oval_xml_feed_merge.xml_file_index import IndexedOutputXMLFile, XMLFileIndex, XMLFileIndexBuilder
+
+xml_files_to_index: List[XMLFileIndex] = []  # Input files indexed by the worker processes, which inherit them when
+# they are forked
+
+
+class StreamingOvalXMLFeedMerge(OvalXMLFeedMerge):
+    """Merges OVAL XML feeds in two passes over the input files, with peak memory that does not depend on their size.
+    The first pass builds a compact index of every input file: the location of each element, the references between
+    elements and the package of each definition. The merge is decided on these indexes, then the second pass reads
+    only the elements chosen to be written from the input files and streams them to the output file.
+    The output is identical to the one of OvalXMLFeedMerge"""
+
+    def __init__(
+        self,
+        raw_xml_files: List[IO],
+        output_file: IO,
+        jobs: int = 1,
+        xml_engine_name: str = XMLEngine.name,
+        index_cache: Optional[IndexCache] = None,
+        stats: Optional[MergeStats] = None,
+    ):
+        self.index_cache: Optional[IndexCache] = index_cache  # Cache of the indexes of input files seen before
+        super().__init__(raw_xml_files, output_file, jobs, xml_engine_name, stats)
+
+    def create_xml_file(self, raw_xml_file: IO) -> XMLFileIndex:
+        """Open an input file and load its index from the cache. Indexes that are not in the cache are built by
+        read_xml_files"""
+        return XMLFileIndex(raw_xml_file, self.ns_prefix_map, self.xml_engine, self.index_cache, defer_build=True)
+
+    @staticmethod
+    def build_index_in_worker(file_number: int) -> Dict[str, Any]:
+        """Build the index of an input file inherited from the parent process and return it, to be sent back. Files
+        with a descriptor are read without moving its offset, which the parent process shares"""
+        xml_file = xml_files_to_index[file_number]
+        XMLFileIndexBuilder(xml_file).build(XMLFileIndexBuilder.get_file_descriptor(xml_file.binary_file))
+        return xml_file.get_index()
+
+    def read_xml_files(self, raw_xml_files: List[IO]) -> List[XMLFileIndex]:
+        """Create the XMLFileIndex objects for the input files. The files are opened, decompressed and looked up in
+        the cache on the threads of worker_pool. The indexes that are not in the cache are then built in worker
+        processes forked from this process, so that parsing runs on several CPUs, and sent back to it. Where processes
+        cannot be forked, they are built on the threads"""
+        global xml_files_to_index
+        xml_files = self.worker_pool.map_in_threads(self.create_xml_file, raw_xml_files)
+        unindexed_xml_files = [xml_file for xml_file in xml_files if not xml_file.indexed]
+        jobs = min(self.worker_pool.jobs, len(unindexed_xml_files))
+        if jobs <= 1 or not WorkerPool.can_fork():
+            self.worker_pool.map_in_threads(XMLFileIndex.build_index, unindexed_xml_files)
+            return xml_files
+        self.worker_pool.close()  # Forking a process while other threads run is unsafe, they are started again later
+        xml_files_to_index = unindexed_xml_files
+        try:
+            with WorkerPool(jobs, "fork") as process_pool:
+                indexes = process_pool.map(
+                    StreamingOvalXMLFeedMerge.build_index_in_worker, range(len(unindexed_xml_files)), 1
+                )
+        finally:
+            xml_files_to_index = []
+        for xml_file, index in zip(unindexed_xml_files, indexes):
+            xml_file.binary_file.seek(0, io.SEEK_END)  # Where building the index leaves it, for MergeStats
+            xml_file.set_index(index)
+            xml_file.store_index()
+        return xml_files
+
+    def setup_output_xml_file(self) -> IndexedOutputXMLFile:
+        """Setup an IndexedOutputXMLFile object, based on the index of the last input file, that will be updated with
+        merged contents and finally written to disk or stdout"""
+        xml_file = IndexedOutputXMLFile(self.xml_files[-1], self.ns_prefix_map)
+        xml_file.update_ns_map_and_register_ns()
+        xml_file.clear_elements(OvalXMLFeedMerge.xml_elements_to_merge)
+        return xml_file
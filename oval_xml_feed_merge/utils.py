@@ -1,4 +1,6 @@
-from typing import Generator
+import os
+from math import ceil
+from typing import Generator, Optional
 
 
 class Utils:
@@ -7,3 +9,35 @@ class Utils:
         while True:
             yield seed
             seed += 1
+
+    @staticmethod
+    def get_cgroup_cpu_limit() -> Optional[int]:
+        """Return the number of CPUs this process may use according to its cgroup (v2 or v1) CPU quota, rounded up.
+        Return None if no quota is set or it cannot be read"""
+        try:
+            with open("/sys/fs/cgroup/cpu.max") as cpu_max_file:  # cgroup v2, e.g. "200000 100000" or "max 100000"
+                quota, period = cpu_max_file.read().split()
+            return ceil(int(quota) / int(period)) if quota != "max" else None
+        except (OSError, ValueError):
+            pass
+
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as quota_file, open(
+                "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+            ) as period_file:  # cgroup v1, quota is -1 when unlimited
+                quota, period = int(quota_file.read()), int(period_file.read())
+            return ceil(quota / period) if quota > 0 and period > 0 else None
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def get_available_cpu_count() -> int:
+        """Return the number of CPUs this process can actually run on, honouring CPU affinity and cgroup CPU quota"""
+        try:
+            cpu_count = len(os.sched_getaffinity(0))
+        except AttributeError:  # sched_getaffinity is not available on all platforms
+            cpu_count = os.cpu_count() or 1
+        cgroup_cpu_limit = Utils.get_cgroup_cpu_limit()
+        if cgroup_cpu_limit:
+            cpu_count = min(cpu_count, cgroup_cpu_limit)
+        return max(cpu_count, 1)
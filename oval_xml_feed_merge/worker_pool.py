@@ -0,0 +1,71 @@
+import concurrent.futures
+import logging
+import multiprocessing
+import multiprocessing.pool
+from typing import Callable, Iterable, List, Optional
+
+
+class WorkerPool:
+    """A pool of up to jobs workers: worker processes for map and threads of this process for map_in_threads.
+    The worker processes and the threads are only started the first time map or map_in_threads is called, are reused
+    by the later calls and are shut down deterministically by close(). With a single job everything runs in-process,
+    one item at a time"""
+
+    def __init__(self, jobs: int = 1, start_method: Optional[str] = None):
+        self.jobs: int = max(jobs, 1)  # Number of worker processes or threads
+        self.start_method: Optional[str] = start_method  # How worker processes are started, the platform default if
+        # None. With "fork", they share the memory of the process at the time the pool is started, copy-on-write
+        self.pool: Optional[multiprocessing.pool.Pool] = None  # Started lazily by get_pool
+        self.executor: Optional[concurrent.futures.ThreadPoolExecutor] = None  # Started lazily by get_executor
+
+    @staticmethod
+    def can_fork() -> bool:
+        """Return True if worker processes can be started with the "fork" start method on this platform"""
+        return "fork" in multiprocessing.get_all_start_methods()
+
+    def get_pool(self) -> multiprocessing.pool.Pool:
+        """Return the underlying multiprocessing pool, starting it if needed"""
+        if self.pool is None:
+            logging.debug("Starting {} worker processes".format(self.jobs))
+            context = multiprocessing if self.start_method is None else multiprocessing.get_context(self.start_method)
+            self.pool = context.Pool(self.jobs)
+        return self.pool
+
+    def get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Return the executor running the threads of map_in_threads, starting it if needed"""
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.jobs)
+        return self.executor
+
+    def map(self, func: Callable, iterable: Iterable, chunksize: Optional[int] = None) -> List:
+        """Apply func to every item of iterable and return the results in order"""
+        if self.jobs == 1:
+            return list(map(func, iterable))
+        return self.get_pool().map(func, iterable, chunksize)
+
+    def map_in_threads(self, func: Callable, *iterables: Iterable) -> List:
+        """Apply func to every item of the iterables, taken in parallel like map does, on up to jobs threads of this
+        process and return the results in order.
+        This suits work on objects that cannot be sent to worker processes, like parsed trees. The threads share the
+        GIL, so only the work waiting on I/O or on code that releases the GIL, like decompression, runs in parallel"""
+        if self.jobs == 1:
+            return list(map(func, *iterables))
+        return list(self.get_executor().map(func, *iterables))
+
+    def close(self):
+        """Wait for the worker processes and the threads to finish their work and shut them down. The pool can still
+        be used afterwards, it is started again"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+            logging.debug("Stopped worker processes")
+
+    def __enter__(self) -> "WorkerPool":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,94 @@
+import copy
+import xml.etree.ElementTree as ET
+from typing import IO, Dict, List, Optional
+
+from oval_xml_feed_merge.xml_utils import XMLUtils
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # lxml is optional, the stdlib engine is used without it
+    lxml_etree = None
+
+
+class XMLEngine:
+    """Parses XML files into element trees using xml.etree.ElementTree. This engine has no dependencies beyond the
+    standard library and is the default, selected by "auto", whether lxml is available or not"""
+
+    name = "etree"  # Name of the engine as accepted by the --engine option
+
+    @staticmethod
+    def get_engine_names() -> List[str]:
+        """Return the names of all engines"""
+        return [XMLEngine.name, LXMLEngine.name]
+
+    @staticmethod
+    def is_lxml_available() -> bool:
+        """Return True if lxml is installed"""
+        return lxml_etree is not None
+
+    @staticmethod
+    def get_default_engine_name() -> str:
+        """Return the name of the engine used unless one is selected: etree. lxml only parses faster, the rest of
+        the merge handles its elements through Python proxies, so a whole merge is slower and uses more memory with
+        it"""
+        return XMLEngine.name
+
+    @staticmethod
+    def get_engine(name: Optional[str] = None) -> "XMLEngine":
+        """Return the engine with the given name, or the default engine if no name is given"""
+        name = name or XMLEngine.get_default_engine_name()
+        if name == LXMLEngine.name:
+            if not XMLEngine.is_lxml_available():
+                raise ValueError("The lxml engine requires lxml to be installed")
+            return LXMLEngine()
+        if name == XMLEngine.name:
+            return XMLEngine()
+        raise ValueError("Unknown XML engine: {}".format(name))
+
+    def parse(self, xml_file: IO, namespace_map: Dict[str, str]) -> ET.Element:
+        """Parse xml_file and return its root element. The namespace prefixes and URIs declared in the file are
+        collected into namespace_map"""
+        return XMLUtils.get_xml_root(xml_file, namespace_map)
+
+    def get_path_namespaces(self, ns_prefix_map: Dict[str, str]) -> Dict[str, str]:
+        """Return ns_prefix_map in the form expected by the find methods of this engine's elements"""
+        return ns_prefix_map
+
+    def get_appendable_element(self, element: ET.Element, xml_tree_root: ET.Element) -> ET.Element:
+        """Return element in a form that can be appended to the tree of xml_tree_root. An etree element can be
+        appended to several places at once, so it is returned as is"""
+        return element
+
+
+class LXMLEngine(XMLEngine):
+    """Parses XML files into element trees using lxml's C parser. The trees hold the same elements, attributes, text
+    and tails as the ones built by the etree engine, so the merged output is identical"""
+
+    name = "lxml"
+    read_size = 65536  # Number of characters or bytes read from the file and fed to the parser at a time
+
+    def parse(self, xml_file: IO, namespace_map: Dict[str, str]):
+        """Parse xml_file and return its root element. The namespace prefixes and URIs declared in the file are
+        collected into namespace_map. Comments and processing instructions are dropped, as etree does.
+        The file is fed to the parser in chunks, so both text and binary file objects can be parsed"""
+        xml_file.seek(0)
+        parser = lxml_etree.XMLPullParser(events=("start-ns",), remove_comments=True, remove_pis=True, huge_tree=True)
+        for chunk in iter(lambda: xml_file.read(LXMLEngine.read_size), ""):
+            if not chunk:  # End of a binary file
+                break
+            parser.feed(chunk)
+            for _, (prefix, uri) in parser.read_events():
+                namespace_map[prefix or ""] = uri
+        return parser.close()
+
+    def get_path_namespaces(self, ns_prefix_map: Dict[str, str]) -> Dict[Optional[str], str]:
+        """Return ns_prefix_map with the default namespace mapped to the None prefix, as lxml requires"""
+        return {prefix or None: uri for prefix, uri in ns_prefix_map.items()}
+
+    def get_appendable_element(self, element, xml_tree_root):
+        """Return element in a form that can be appended to the tree of xml_tree_root. An lxml element has a single
+        parent and is moved when appended, so an element already in that tree is copied. It then appears in the tree
+        as many times as it was appended, the same as with etree"""
+        if element.getroottree().getroot() is xml_tree_root:
+            return copy.deepcopy(element)
+        return element
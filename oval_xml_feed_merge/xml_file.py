@@ -1,116 +1,169 @@
+import copy
 import logging
-import os
-import re
-import sys
-from collections import defaultdict
-from typing import IO, Dict, Set, List, Generator
-from xml.dom import minidom
+from typing import IO, Dict, List, Generator, Optional
 
 from oval_xml_feed_merge.definition_tree import DefinitionTree
+from oval_xml_feed_merge.duplicate_id_detector import DuplicateIDDetector
 
+from oval_xml_feed_merge.xml_engine import XMLEngine
+from oval_xml_feed_merge.xml_file_base import XMLFileBase
 from oval_xml_feed_merge.xml_utils import XMLUtils
+from oval_xml_feed_merge.xml_writer import XMLWriter
 import xml.etree.ElementTree as ET
 
 
-class XMLFile:
-    def __init__(self, raw_xml_file, ns_prefix_map: Dict[str, str]):
-        self.raw_xml_file: IO = raw_xml_file  # Raw file object
-        self.name: str = raw_xml_file.name  # Name of the file on disk or stdout
-        self.xml_tree_root: ET.Element = XMLUtils.get_xml_root(raw_xml_file)  # Object of root element in the file
+class XMLFile(XMLFileBase):
+    """An XML file parsed into a tree kept in memory, either an input file or the output file of a merge"""
+
+    def __init__(
+        self,
+        raw_xml_file,
+        ns_prefix_map: Dict[str, str],
+        xml_engine: XMLEngine = None,
+        xml_tree_root: Optional[ET.Element] = None,
+        namespace_map: Optional[Dict[str, str]] = None,
+    ):
+        super().__init__(raw_xml_file, ns_prefix_map, xml_engine)
+        if namespace_map is not None:
+            self.namespace_map = namespace_map
+        self.xml_tree_root: ET.Element = (
+            self.xml_engine.parse(raw_xml_file, self.namespace_map) if xml_tree_root is None else xml_tree_root
+        )  # Object of root element in the file. The file is only parsed if it is not given
         self.id_to_element_map: Dict[str, ET.Element] = XMLUtils.generate_id_map(
-            self.xml_tree_root
+            self.xml_tree_root,
+            self.id_to_referenced_ids_map,
+            self.duplicate_ids,
+            self.element_ids,
+            self.id_to_nested_ids_map,
         )  # A map that tracks element identifier
-        # to the respective element object
-
-        self.ns_prefix_map: Dict[str, str] = ns_prefix_map  # A map of namespace prefix and URIs
-        self.type_to_referenced_ids_map: Dict[str, Set[str]] = defaultdict(
-            set
-        )  # A map of element type (test, variable, object, state,
-        # definition) to a set of element identifiers that were directly or indirectly referenced by a definition
-        # element in the file that is chosen to be written to the output file
+        # to the respective element object, built along with the other maps of the file in a single pass over the
+        # tree. Once the IDs are regenerated it is keyed by the new IDs, while the elements of the tree keep the IDs of
+        # the file until they are written to the output file, see old_to_new_id_map
+        self.duplicate_id_detector: DuplicateIDDetector = DuplicateIDDetector()  # Identifiers of the elements added
+        # to the file once it is cleared, when it is the output XML file
+
+    def replace_element_ids_in_tree(self):
+        """Put the new IDs in place in the whole tree right away, rather than in the elements written to the output
+        file only, e.g. for a file whose elements are written to the output of several merges"""
+        XMLUtils.replace_element_ids_in_tree(self.old_to_new_id_map, self.xml_tree_root)
+        self.old_to_new_id_map = {}
+
+    def replace_element_ids_in_elements(self, elements: List[ET.Element]):
+        """Put the new IDs in place in the trees of the given elements, chosen to be written to the output file"""
+        if self.old_to_new_id_map:
+            for element in elements:
+                XMLUtils.replace_element_ids_in_tree(self.old_to_new_id_map, element)
+
+    def get_element_ids(self, elements: List[ET.Element]) -> List[str]:
+        """Return the identifiers in the trees of the given children of the sections of the file, with the regenerated
+        identifiers in place, as they are written to the output file. They are looked up in id_to_nested_ids_map, only
+        the trees of the elements without an identifier are searched"""
+        element_ids = []
+        for element in elements:
+            if element.get("id") is None:
+                element_ids += [child.attrib["id"] for child in element.iter() if "id" in child.attrib]
+            else:
+                element_ids += super().get_element_ids([element])
+        return element_ids
+
+    def copy_skeleton(self, xml_elements_to_clear: List[str]) -> "XMLFile":
+        """Return an XMLFile made of copies of the root element and the sections of the current XML file, with the
+        sections listed in "xml_elements_to_clear" left empty, the same as clear_elements leaves them. Only the
+        sections that are kept are copied, and the file is not read again"""
+        path_namespaces = self.xml_engine.get_path_namespaces(self.namespace_map)
+        elements_to_clear = [self.xml_tree_root.find(path, path_namespaces) for path in xml_elements_to_clear]
+        root = self.xml_tree_root
+        skeleton_root = root.makeelement(root.tag, dict(root.attrib))
+        skeleton_root.text, skeleton_root.tail = root.text, root.tail
+        for section in root:
+            if any(section is element for element in elements_to_clear):
+                skeleton_root.append(section.makeelement(section.tag, {}))
+            else:
+                skeleton_section = copy.deepcopy(section)
+                XMLUtils.replace_element_ids_in_tree(self.old_to_new_id_map, skeleton_section)
+                skeleton_root.append(skeleton_section)
+        return XMLFile(self.raw_xml_file, self.ns_prefix_map, self.xml_engine, skeleton_root, dict(self.namespace_map))
+
+    def get_definition_elements(self) -> List[ET.Element]:
+        """Return the definition elements of the current file"""
+        return list(self.find_element("./definitions"))
 
     def get_definition_trees(self) -> Generator[DefinitionTree, None, None]:
         """Find all definition elements in the current file, create a DefinitionTree object for them and return it"""
-        for definition in self.xml_tree_root.find("./definitions", self.ns_prefix_map):
+        for definition in self.get_definition_elements():
             if definition.attrib["class"] == "inventory":  # Definition elements with class "inventory" are preserved
                 # only if referenced by a non-"inventory" definition element chosen to be written to the output file
                 continue
             yield DefinitionTree(
-                definition, self.ns_prefix_map, self.id_to_element_map, self.type_to_referenced_ids_map
+                definition,
+                self.xml_engine.get_path_namespaces(self.ns_prefix_map),
+                self.id_to_element_map,
+                self.type_to_referenced_ids_map,
+                self.id_to_referenced_ids_map,
+                id_interner=self.id_interner,
+                xml_file_name=self.name,
+                old_to_new_id_map=self.old_to_new_id_map,
+                id_to_nested_ids_map=self.id_to_nested_ids_map,
             )
 
     def get_referenced_elements(self, path) -> List[ET.Element]:
         """Return all elements relevant to the parameter "path" referenced directly or indirectly by a definition
-        element chosen to be written to the output file
+        element chosen to be written to the output file, with the regenerated identifiers in place
         """
-        for ref_type, element_ids in self.type_to_referenced_ids_map.items():
-            if ref_type in path:
-                return [self.id_to_element_map[element_id] for element_id in sorted(element_ids)]  # Sort so that output
-                # order is always deterministic
-
-        return []
-
-    def update_namespace_map(self):
-        """Extract all namespace prefixes and URIs from the XML file and update ns_prefix_map"""
-        xml_ns_regex_literal = (
-            r'xmlns:?([a-z\-]*)="(https?:\/\/(?:www\.)?'
-            r'[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b(?:[-a-zA-Z0-9()@:%_\+.~#?&\/=]*))"'
-        )
-        xml_ns_regex = re.compile(xml_ns_regex_literal)
-        self.raw_xml_file.seek(0)
-
-        for line in self.raw_xml_file:
-            for match in xml_ns_regex.finditer(line):
-                prefix = match.group(1) if match.group(1) else ""
-                uri = match.group(2)
-                self.ns_prefix_map[prefix] = uri
-        logging.debug(
-            "Extracted namespaces from {}.\nUpdated namespace map: {}".format(
-                self.raw_xml_file.name, self.ns_prefix_map
-            )
-        )
+        elements = super().get_referenced_elements(path)
+        self.replace_element_ids_in_elements(elements)
+        return elements
 
-    def register_namespaces(self):
-        """Register namespace prefixes and URIs so that ET does not generate new namespace prefixes
-        when creating the output XML string
-        """
-        for prefix, uri in self.ns_prefix_map.items():
-            ET.register_namespace(prefix, uri)
-            logging.debug("Registered namespace {} with prefix: {}".format(uri, prefix))
-
-    def update_ns_map_and_register_ns(self):
-        """Find namespaces in the XML file, update the internal ns_prefix_map and register namespaces with ET"""
-        self.update_namespace_map()
-        self.register_namespaces()
+    def find_element(self, path: str) -> ET.Element:
+        """Return the first element matching the given path, resolving namespace prefixes from ns_prefix_map"""
+        return self.xml_tree_root.find(path, self.xml_engine.get_path_namespaces(self.ns_prefix_map))
 
     def clear_elements(self, xml_elements_to_clear: List[str]):
-        """Clear all elements listed in "xml_elements_to_clear" from the current XML file"""
+        """Clear all elements listed in "xml_elements_to_clear" from the current XML file. The identifiers of the
+        elements left in the file are recorded, to check the identifiers of the elements added later against them"""
         for element in xml_elements_to_clear:
             logging.debug("Element: {}".format(element))
-            self.xml_tree_root.find(element, self.ns_prefix_map).clear()
-
-    def append_element_to_path(self, path: str, element: ET.Element):
-        """Append a single element to the given path"""
-        element_at_path = self.xml_tree_root.find(path, self.ns_prefix_map)
-        element_at_path.append(element)
+            self.find_element(element).clear()
+        self.duplicate_id_detector.add_all(
+            [element.attrib["id"] for element in self.xml_tree_root.iter() if "id" in element.attrib], self.name
+        )
 
-    def extend_element_at_path(self, path: str, elements: List[ET.Element]):
-        """Append a sequence of elements to the given path"""
-        self.xml_tree_root.find(path, self.ns_prefix_map).extend(elements)
+    def append_element_to_path(
+        self,
+        path: str,
+        element: ET.Element,
+        source_name: Optional[str] = None,
+        element_ids: Optional[List[str]] = None,
+    ):
+        """Append a single element to the given path. source_name is the name of the file it comes from, reported if
+        an identifier in its tree is a duplicate. element_ids are the identifiers in its tree, see
+        XMLFile.get_element_ids, the tree is searched for them if None"""
+        self.extend_element_at_path(path, [element], source_name, element_ids)
+
+    def extend_element_at_path(
+        self,
+        path: str,
+        elements: List[ET.Element],
+        source_name: Optional[str] = None,
+        element_ids: Optional[List[str]] = None,
+    ):
+        """Append a sequence of elements to the given path. source_name is the name of the file they come from,
+        reported if an identifier in their trees is a duplicate. element_ids are the identifiers in their trees, see
+        XMLFile.get_element_ids, the trees are searched for them if None"""
+        if element_ids is None:
+            element_ids = [
+                child.attrib["id"] for element in elements for child in element.iter() if "id" in child.attrib
+            ]
+        self.duplicate_id_detector.add_all(element_ids, source_name or self.name)
+        self.find_element(path).extend(
+            [self.xml_engine.get_appendable_element(element, self.xml_tree_root) for element in elements]
+        )
 
     def validate_xml_ids(self):
-        """Validate that each element with an "id" attribute has a unique value for that attribute"""
-        element_id_set: Set[str] = set()
-        for element in self.xml_tree_root.findall(".//*[@id]"):
-            element_id = element.attrib["id"]
-            if element_id in element_id_set:
-                logging.critical("Found elements with duplicate id '{}'".format(element_id))
-                sys.exit(1)
-            element_id_set.add(element_id)
+        """Validate that each element with an "id" attribute has a unique value for that attribute. The identifiers
+        are checked while the elements are added to the file, and all the duplicates are reported at once"""
+        self.duplicate_id_detector.validate()
 
     def dump_to_file(self, output_file: IO):
-        """Write XML to specified file"""
-        output_string = ET.tostring(self.xml_tree_root, encoding="unicode")
-        output_string = minidom.parseString(output_string).toprettyxml(indent="  ")
-        pretty_output_string = os.linesep.join([s for s in output_string.splitlines() if s.strip()])
-        output_file.write(pretty_output_string)
+        """Write XML to specified file. The XML is serialized and written incrementally, in chunks"""
+        XMLWriter(output_file, self.ns_prefix_map).write_document(self.xml_tree_root)
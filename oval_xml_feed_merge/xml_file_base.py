@@ -0,0 +1,164 @@
+import logging
+import sys
+from collections import defaultdict
+from typing import IO, Any, Dict, Generator, Iterable, List, Set, Tuple, Union
+
+from oval_xml_feed_merge.id_interner import IDInterner
+from oval_xml_feed_merge.xml_engine import XMLEngine
+from oval_xml_feed_merge.xml_utils import XMLUtils
+import xml.etree.ElementTree as ET
+
+
+class XMLFileBase:
+    """The index of the identified elements of an input XML file and the lookups on it, shared by the files parsed
+    into a tree, see XMLFile, and the files indexed in a streaming pass, see XMLFileIndex. The subclasses fill the
+    maps of the index, with the elements they hold"""
+
+    def __init__(self, raw_xml_file, ns_prefix_map: Dict[str, str], xml_engine: XMLEngine = None):
+        self.raw_xml_file: IO = raw_xml_file  # Raw file object
+        self.name: str = raw_xml_file.name  # Name of the file on disk or stdout
+        self.xml_engine: XMLEngine = xml_engine or XMLEngine()  # Engine that parses the file
+        self.namespace_map: Dict[str, str] = {}  # A map of namespace prefix and URIs declared in this file
+        self.id_to_element_map: Dict[str, Any] = {}  # A map that tracks element identifier to the respective element
+        self.id_to_referenced_ids_map: Dict[str, List[Tuple[str, str]]] = {}  # An index of element identifier to
+        # the references found in that element's tree, shared by all DefinitionTree objects of the file
+        self.duplicate_ids: Set[str] = set()  # Identifiers of more than one element of the file
+        self.old_to_new_id_map: Dict[str, str] = {}  # Identifiers that were given a new ID, mapped to the new ID
+        self.element_ids: List[str] = []  # OVAL identifiers in the "id" attributes of all elements, in document
+        # order, until they are regenerated
+        self.id_to_nested_ids_map: Dict[str, List[str]] = {}  # Identifier of every child of a section whose tree
+        # holds other identifiers to these identifiers, see XMLUtils.generate_id_map
+
+        self.ns_prefix_map: Dict[str, str] = ns_prefix_map  # A map of namespace prefix and URIs
+        self.type_to_referenced_ids_map: Dict[str, Set[int]] = defaultdict(
+            set
+        )  # A map of element type (test, variable, object, state,
+        # definition) to a set of handles of element identifiers that were directly or indirectly referenced by a
+        # definition element in the file that is chosen to be written to the output file
+        self.id_interner: IDInterner = IDInterner()  # Interns the references of the file into the handles stored in
+        # type_to_referenced_ids_map, once the IDs are regenerated
+
+    def regenerate_element_ids(self, suffix_int_generator: Generator[int, None, None], global_input_id_set: Set[str]):
+        """Give a new ID, generated using suffix_int_generator, to every OVAL element whose ID is already in
+        global_input_id_set, i.e. was seen in a preceding input file, and update all references to it"""
+        self.replace_element_ids(self.allocate_element_ids(suffix_int_generator, global_input_id_set))
+
+    def allocate_element_ids(
+        self, suffix_int_generator: Generator[int, None, None], global_input_id_set: Set[str]
+    ) -> Dict[str, Union[str, None]]:
+        """Return the OVAL IDs of the file mapped to the new ID they are given, generated using suffix_int_generator,
+        or to None if they are not in global_input_id_set. This is the only step of the ID regeneration that depends
+        on the preceding input files, so it is the only one that must run for one file after another"""
+        logging.debug("Regenerating OVAL IDs in {}".format(self.name))
+        current_file_old_to_new_id_map: Dict[str, Union[str, None]] = {}
+        XMLUtils.update_current_to_new_element_id_map(
+            current_file_old_to_new_id_map, suffix_int_generator, global_input_id_set, self.element_ids, self.name
+        )
+        return current_file_old_to_new_id_map
+
+    def replace_element_ids(self, current_file_old_to_new_id_map: Dict[str, Union[str, None]]):
+        """Replace the OVAL IDs of the file with the new IDs allocated by allocate_element_ids. References to them are
+        updated in the maps of the file, and in the elements themselves only once they are chosen to be written to
+        the output file, so the elements of the shadowed definitions are never rewritten"""
+        self.element_ids = []
+        self.old_to_new_id_map = {
+            element_id: new_element_id
+            for element_id, new_element_id in current_file_old_to_new_id_map.items()
+            if new_element_id
+        }
+        self.id_to_element_map = {
+            current_file_old_to_new_id_map.get(element_id) or element_id: element
+            for element_id, element in self.id_to_element_map.items()
+        }
+        self.id_to_referenced_ids_map = XMLUtils.replace_element_ids_in_reference_map(
+            current_file_old_to_new_id_map, self.id_to_referenced_ids_map
+        )
+        self.duplicate_ids = {
+            current_file_old_to_new_id_map.get(element_id) or element_id for element_id in self.duplicate_ids
+        }
+        self.id_to_nested_ids_map = {
+            current_file_old_to_new_id_map.get(element_id)
+            or element_id: [current_file_old_to_new_id_map.get(nested_id) or nested_id for nested_id in nested_ids]
+            for element_id, nested_ids in self.id_to_nested_ids_map.items()
+        }
+
+    def get(self, element_id: str) -> Any:
+        """Return the element with the attribute "id" equal to element_id, looked up in id_to_element_map. Exit if
+        there is no such element or more than one, the same as XMLUtils.find_element_by_id.
+        element_id is the regenerated ID, but the element is returned as the file holds it: the elements of an
+        XMLFile tree keep the IDs of the file until they are written to the output file, see
+        XMLFile.get_referenced_elements"""
+        element = self.id_to_element_map.get(element_id)
+        if element is None:
+            logging.critical("No element found with id '{}' ".format(element_id))
+            sys.exit(1)
+        if element_id in self.duplicate_ids:
+            logging.critical("Found more than one element with same id: {}".format(element_id))
+            sys.exit(1)
+        return element
+
+    def get_many(self, element_ids: Iterable[str]) -> List[Any]:
+        """Return the elements with the given identifiers, in the same order. Exit if any of them is missing or
+        ambiguous, as get does. The elements are returned as get returns them"""
+        element_ids = list(element_ids)
+        id_to_element_map = self.id_to_element_map
+        elements = [id_to_element_map.get(element_id) for element_id in element_ids]
+        if None in elements or (self.duplicate_ids and not self.duplicate_ids.isdisjoint(element_ids)):
+            return [self.get(element_id) for element_id in element_ids]  # Exits on the first bad identifier
+        return elements
+
+    def ids_of_type(self, element_type: str) -> List[str]:
+        """Return the identifiers of the OVAL elements of the given type, e.g. "def", "tst", "obj", "ste" or "var", as
+        found in the "oval:<namespace>:<type>:<number>" identifiers, in document order"""
+        return [
+            element_id
+            for element_id in self.id_to_element_map
+            if element_id.startswith("oval:") and element_id.split(":", 3)[2:3] == [element_type]
+        ]
+
+    def get_element_ids(self, elements: List[Any]) -> List[str]:
+        """Return the identifiers in the trees of the given children of the sections of the file, with the regenerated
+        identifiers in place, as they are written to the output file. They are looked up in id_to_nested_ids_map"""
+        element_ids = []
+        for element in elements:
+            element_id = element.get("id")
+            if element_id is not None:
+                element_ids.append(element_id)
+                element_ids += self.id_to_nested_ids_map.get(element_id, ())
+        return element_ids
+
+    def get_element_id_count(self) -> int:
+        """Return the number of distinct identifiers in the "id" attributes of the file, at any depth, all of which
+        are in id_to_referenced_ids_map"""
+        return len(self.id_to_referenced_ids_map)
+
+    def get_referenced_elements(self, path) -> List[Any]:
+        """Return all elements relevant to the parameter "path" referenced directly or indirectly by a definition
+        element chosen to be written to the output file
+        """
+        for ref_type, handles in self.type_to_referenced_ids_map.items():
+            if ref_type in path:
+                element_ids = sorted(self.id_interner.get_ids(handles))  # Sort so that output order is always
+                # deterministic
+                return [self.id_to_element_map[element_id] for element_id in element_ids]
+
+        return []
+
+    def update_namespace_map(self):
+        """Update ns_prefix_map with the namespace prefixes and URIs declared in the XML file. These were collected
+        while the file was parsed, so the file is not read again"""
+        self.ns_prefix_map.update(self.namespace_map)
+        logging.debug("Extracted namespaces from {}.\nUpdated namespace map: {}".format(self.name, self.ns_prefix_map))
+
+    def register_namespaces(self):
+        """Register namespace prefixes and URIs so that ET does not generate new namespace prefixes
+        when creating the output XML string
+        """
+        for prefix, uri in self.ns_prefix_map.items():
+            ET.register_namespace(prefix, uri)
+            logging.debug("Registered namespace {} with prefix: {}".format(uri, prefix))
+
+    def update_ns_map_and_register_ns(self):
+        """Find namespaces in the XML file, update the internal ns_prefix_map and register namespaces with ET"""
+        self.update_namespace_map()
+        self.register_namespaces()
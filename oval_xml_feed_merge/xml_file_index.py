@@ -0,0 +1,622 @@
+import hashlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from typing import IO, Any, Dict, Generator, Iterable, List, Optional, Tuple
+from xml.parsers import expat
+
+from oval_xml_feed_merge.compression import Compression
+from oval_xml_feed_merge.definition_tree import DefinitionTree
+from oval_xml_feed_merge.duplicate_id_detector import DuplicateIDDetector
+from oval_xml_feed_merge.index_cache import IndexCache
+from oval_xml_feed_merge.xml_engine import XMLEngine
+from oval_xml_feed_merge.xml_file_base import XMLFileBase
+from oval_xml_feed_merge.xml_utils import XMLUtils
+from oval_xml_feed_merge.xml_writer import XMLWriter
+
+
+class IndexedSection:
+    """A child of the root element of an indexed XML file, e.g. the generator or one of the OVAL sections"""
+
+    def __init__(self, tag: str, start: int, fragment_scope: Dict[str, str], scope: Dict[str, str]):
+        self.tag: str = tag  # Tag in "{uri}local" notation
+        self.start: int = start  # Byte offset of the start tag in the file
+        self.end: int = start  # Byte offset of the first byte after the element and its tail
+        self.fragment_scope: Dict[str, str] = fragment_scope  # Namespace declarations in scope at the element
+        self.scope: Dict[str, str] = scope  # Namespace declarations in scope at the children of the element
+        self.definitions: List[Tuple[IndexedElement, Optional[str], List[Tuple[str, str, Optional[str]]]]] = []  # The
+        # children of a "definitions" element, each with its "class" attribute and the tags and text of its
+        # metadata/title elements
+
+
+class IndexedElement:
+    """A child of one of the sections of an indexed XML file, e.g. a definition or a test, recorded by its location in
+    the file instead of being kept in memory"""
+
+    __slots__ = ("xml_file_index", "section", "start", "end", "element_id", "namespace_uris")
+
+    def __init__(self, xml_file_index: "XMLFileIndex", section: IndexedSection, start: int, element_id: Optional[str]):
+        self.xml_file_index: XMLFileIndex = xml_file_index  # File the element is in
+        self.section: IndexedSection = section  # Section the element is in
+        self.start: int = start  # Byte offset of the start tag in the file
+        self.end: int = start  # Byte offset of the first byte after the element and its tail
+        self.element_id: Optional[str] = element_id  # Value of the "id" attribute, as in the file
+        self.namespace_uris: Tuple[str, ...] = ()  # Namespace URIs of the tags and attribute names in the element's
+        # tree, in the order they are first used
+
+    def __getstate__(self) -> Tuple:
+        """Return the state of the element to cache it, without the index of the file, which is set again when the
+        cached index is loaded"""
+        return tuple(getattr(self, name) for name in IndexedElement.__slots__[1:])
+
+    def __setstate__(self, state: Tuple):
+        self.xml_file_index = None
+        for name, value in zip(IndexedElement.__slots__[1:], state):
+            setattr(self, name, value)
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """Return the identifier of the element after its regeneration, for the "id" key. This mirrors
+        ET.Element.get for the only attribute DefinitionTree looks up"""
+        if key != "id" or self.element_id is None:
+            return default
+        return self.xml_file_index.get_new_element_id(self.element_id)
+
+
+class XMLFileIndexBuilder:
+    """Builds an XMLFileIndex in a single pass of an expat parser over the file. Elements are indexed as they are
+    parsed and discarded right away, so memory use does not grow with the size of the file"""
+
+    read_size = 65536  # Number of bytes read from the file and fed to the parser at a time
+
+    def __init__(self, xml_file_index: "XMLFileIndex"):
+        self.xml_file_index: XMLFileIndex = xml_file_index  # Index being built
+        self.parser = expat.ParserCreate(xml_file_index.encoding_override, namespace_separator="}")
+        self.parser.buffer_text = True
+        self.parser.ordered_attributes = True
+        self.parser.XmlDeclHandler = self.handle_xml_declaration
+        self.parser.StartNamespaceDeclHandler = self.handle_namespace_declaration
+        self.parser.StartElementHandler = self.handle_start
+        self.parser.EndElementHandler = self.handle_end
+        self.parser.CharacterDataHandler = self.handle_data
+        self.depth: int = 0  # Nesting level of the element being parsed, 1 for the root element
+        self.pending_namespaces: Dict[str, str] = {}  # Namespaces declared on the element about to start
+        self.scopes: List[Dict[str, str]] = [{}]  # Namespace declarations in scope, down to the section elements
+        self.referenced_ids_lists: List[Tuple[List[Tuple[str, str]], ...]] = []  # For every open element below
+        # the root, the reference lists in id_to_referenced_ids_map of itself and its ancestors that have an "id"
+        self.section: Optional[IndexedSection] = None  # Section being parsed
+        self.element: Optional[IndexedElement] = None  # Child of a section being parsed or last parsed
+        self.element_ids: List[str] = []  # "id" attributes of the descendants of self.element
+        self.namespace_uris: Dict[str, None] = {}  # Namespace URIs in the tree of self.element, in order
+        self.definition: Optional[Tuple[IndexedElement, Optional[str], List]] = None  # Definition being parsed
+        self.metadata_tag: Optional[str] = None  # Tag of the definition child being parsed
+        self.text_parts: List[str] = []  # Character data of the element whose text is collected
+        self.text_element: Optional[ET.Element] = None  # Element whose text is collected to find references
+        self.text_title_tags: Optional[Tuple[str, str]] = None  # Tags of the metadata/title whose text is collected
+        self.is_root_text: bool = False  # True while the text of the root element is collected
+
+    @staticmethod
+    def fix_name(name: str) -> str:
+        """Return an expat name in the "{uri}local" notation used by ET"""
+        return "{" + name if "}" in name else name
+
+    def build(self, file_descriptor: Optional[int] = None):
+        """Parse the whole file, building the index. If file_descriptor, the descriptor of the file, is given, the file
+        is read from it with os.pread, which leaves the offset of the descriptor untouched, e.g. in a worker process
+        sharing it with the process it was forked from"""
+        binary_file = self.xml_file_index.binary_file
+        if file_descriptor is None:
+            binary_file.seek(0)
+            chunks = iter(lambda: binary_file.read(XMLFileIndexBuilder.read_size), b"")
+        else:
+            chunks = XMLFileIndexBuilder.read_chunks(file_descriptor)
+        for chunk in chunks:
+            self.parser.Parse(chunk, False)
+        self.parser.Parse(b"", True)
+
+    @staticmethod
+    def read_chunks(file_descriptor: int) -> Generator[bytes, None, None]:
+        """Yield the whole contents of the file with the given descriptor, read_size bytes at a time, with os.pread"""
+        offset = 0
+        for chunk in iter(lambda: os.pread(file_descriptor, XMLFileIndexBuilder.read_size, offset), b""):
+            yield chunk
+            offset += len(chunk)
+
+    @staticmethod
+    def get_file_descriptor(binary_file: IO) -> Optional[int]:
+        """Return the descriptor of binary_file if it can be read with os.pread, else None, e.g. for an in-memory
+        file"""
+        if not hasattr(os, "pread"):
+            return None
+        try:
+            return binary_file.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            return None
+
+    def handle_xml_declaration(self, version: str, encoding: Optional[str], standalone: int):
+        if encoding:
+            self.xml_file_index.encoding = encoding
+
+    def handle_namespace_declaration(self, prefix: Optional[str], uri: Optional[str]):
+        self.xml_file_index.namespace_map[prefix or ""] = uri or ""
+        self.pending_namespaces[prefix or ""] = uri or ""
+
+    def handle_data(self, data: str):
+        if self.text_element is not None or self.text_title_tags or self.is_root_text:
+            self.text_parts.append(data)
+
+    def finish_text(self):
+        """Set the text of the element that started last, now that all of it has been parsed"""
+        text = "".join(self.text_parts) or None
+        self.text_parts = []
+        if self.text_element is not None:
+            self.text_element.text = text
+            referenced_ids = []
+            XMLUtils.find_refs_in_element(self.text_element, referenced_ids)
+            if referenced_ids:
+                for ancestor_referenced_ids in self.referenced_ids_lists[-1]:
+                    ancestor_referenced_ids += referenced_ids
+            self.text_element = None
+        if self.text_title_tags:
+            self.definition[2].append(self.text_title_tags + (text,))
+            self.text_title_tags = None
+        if self.is_root_text:
+            self.xml_file_index.root_text = text
+            self.is_root_text = False
+
+    def handle_start(self, name: str, attributes: List[str]):
+        self.finish_text()
+        start = self.parser.CurrentByteIndex
+        tag = XMLFileIndexBuilder.fix_name(name)
+        attrib = {XMLFileIndexBuilder.fix_name(attributes[i]): attributes[i + 1] for i in range(0, len(attributes), 2)}
+        element_id = attrib.get("id")
+        xml_file_index = self.xml_file_index
+        self.depth += 1
+        if self.depth <= 2:
+            self.scopes.append(dict(self.scopes[-1], **self.pending_namespaces))
+        self.pending_namespaces = {}
+        if element_id is not None and element_id.startswith("oval:"):
+            xml_file_index.element_ids.append(element_id)
+
+        if self.depth == 1:
+            xml_file_index.root_tag, xml_file_index.root_attrib = tag, attrib
+            self.is_root_text = True
+            return
+        if self.depth == 2:
+            if self.section is not None:
+                self.section.end = start
+            self.section = IndexedSection(tag, start, self.scopes[-2], self.scopes[-1])
+            xml_file_index.sections.append(self.section)
+        elif self.depth == 3:
+            if self.element is not None and self.element.section is self.section:
+                self.element.end = start
+            self.element = IndexedElement(xml_file_index, self.section, start, element_id)
+            self.element_ids, self.namespace_uris = [], {}
+            if element_id is not None:
+                xml_file_index.id_to_element_map[element_id] = self.element
+            if self.section.tag.rsplit("}", 1)[-1] == "definitions":
+                self.definition = (self.element, attrib.get("class"), [])
+                self.section.definitions.append(self.definition)
+        elif self.depth == 4 and self.definition is not None:
+            self.metadata_tag = tag
+        elif self.depth == 5 and self.definition is not None:
+            if self.metadata_tag.rsplit("}", 1)[-1] == "metadata" and tag.rsplit("}", 1)[-1] == "title":
+                self.text_title_tags = (self.metadata_tag, tag)
+
+        if self.depth >= 3:
+            if element_id is not None and self.depth > 3:
+                self.element_ids.append(element_id)
+            for qualified_name in [tag, *attrib]:
+                if qualified_name[:1] == "{":
+                    self.namespace_uris[qualified_name[1:].rsplit("}", 1)[0]] = None
+
+        referenced_ids_lists = self.referenced_ids_lists[-1] if self.referenced_ids_lists else ()
+        if element_id is not None:
+            if element_id in xml_file_index.id_to_referenced_ids_map:
+                xml_file_index.duplicate_ids.add(element_id)
+            xml_file_index.id_to_referenced_ids_map[element_id] = []
+            referenced_ids_lists += (xml_file_index.id_to_referenced_ids_map[element_id],)
+        self.referenced_ids_lists.append(referenced_ids_lists)
+        if referenced_ids_lists:
+            self.text_element = ET.Element(tag, attrib)
+
+    def handle_end(self, name: str):
+        self.finish_text()
+        end = self.parser.CurrentByteIndex
+        if self.depth == 1:
+            if self.section is not None:
+                self.section.end = end
+        elif self.depth == 2:
+            if self.element is not None and self.element.section is self.section:
+                self.element.end = end
+        elif self.depth == 3:
+            if self.element_ids and self.element.element_id is not None:
+                self.xml_file_index.id_to_nested_ids_map[self.element.element_id] = self.element_ids
+            self.element.namespace_uris = self.xml_file_index.intern(tuple(self.namespace_uris))
+            self.definition = None
+        if self.depth >= 2:
+            self.referenced_ids_lists.pop()
+        if self.depth <= 2:
+            self.scopes.pop()
+        self.depth -= 1
+
+
+class XMLFileIndex(XMLFileBase):
+    """An input XML file that is indexed in a single streaming pass instead of being kept in memory as a tree.
+    The index holds the location of every child of the OVAL sections in the file, the references found in the tree of
+    every element with an "id" and what is needed to choose the definitions written to the output file. The elements
+    chosen to be written are read from the file again, only when the output is written"""
+
+    cached_attributes = (
+        "encoding",
+        "namespace_map",
+        "root_tag",
+        "root_attrib",
+        "root_text",
+        "sections",
+        "element_ids",
+        "id_to_element_map",
+        "id_to_referenced_ids_map",
+        "duplicate_ids",
+        "id_to_nested_ids_map",
+    )  # Attributes making up the index of the file, as stored in an IndexCache
+
+    def __init__(
+        self,
+        raw_xml_file,
+        ns_prefix_map: Dict[str, str],
+        xml_engine: XMLEngine = None,
+        index_cache: Optional[IndexCache] = None,
+        defer_build: bool = False,
+    ):
+        super().__init__(raw_xml_file, ns_prefix_map, xml_engine)
+        self.encoding_override: Optional[str] = None  # Encoding that overrides the one declared in the file
+        self.binary_file: IO = self.get_binary_file(raw_xml_file)  # Seekable binary file object the index refers to
+        self.encoding: str = "utf-8"  # Encoding declared in the file
+        self.root_tag: str = ""  # Tag of the root element
+        self.root_attrib: Dict[str, str] = {}  # Attributes of the root element
+        self.root_text: Optional[str] = None  # Text of the root element
+        self.sections: List[IndexedSection] = []  # Children of the root element
+        self.id_to_element_map: Dict[str, IndexedElement] = {}  # A map that tracks element identifier
+        # to the respective indexed element, for the children of the sections. The identifiers at any depth are in
+        # id_to_referenced_ids_map
+        self.namespace_uri_tuples: Dict[Tuple[str, ...], Tuple[str, ...]] = {}  # Interned namespace URI tuples
+        self.content_hash: Optional[str] = None  # SHA-256 of the contents of the file, computed when first needed
+        self.index_cache: Optional[IndexCache] = index_cache  # Cache of the indexes of input files seen before
+        self.indexed: bool = False  # True once the index is built or loaded from index_cache
+        if not self.load_index() and not defer_build:  # A deferred index is built by build_index, or elsewhere and
+            # given to set_index
+            self.build_index()
+
+    def load_index(self) -> bool:
+        """Load the index of the file from index_cache if the file was indexed before. Return True if it was"""
+        if self.index_cache is None:
+            return False
+        index = self.index_cache.load(self.get_cache_key())
+        if index is None:
+            return False
+        logging.debug("Loaded the index of {} from the cache".format(self.name))
+        self.set_index(index)
+        return True
+
+    def build_index(self):
+        """Build the index of the file and store it in index_cache"""
+        XMLFileIndexBuilder(self).build()
+        self.indexed = True
+        self.store_index()
+
+    def store_index(self):
+        """Store the index of the file in index_cache, if there is one"""
+        if self.index_cache is not None:
+            self.index_cache.store(self.get_cache_key(), self.get_index())
+
+    def get_index(self) -> Dict[str, Any]:
+        """Return the index of the file, as stored in an IndexCache. It can be pickled, e.g. to send it from the
+        worker process that built it"""
+        return {name: getattr(self, name) for name in XMLFileIndex.cached_attributes}
+
+    def set_index(self, index: Dict[str, Any]):
+        """Set the index of the file to one returned by get_index, linking its elements back to this file"""
+        for name in XMLFileIndex.cached_attributes:
+            setattr(self, name, index[name])
+        for element in self.id_to_element_map.values():
+            element.xml_file_index = self
+        for section in self.sections:
+            for definition in section.definitions:
+                definition[0].xml_file_index = self
+        self.indexed = True
+
+    def get_cache_key(self) -> str:
+        """Return the key of the index of the file in index_cache"""
+        return IndexCache.get_key(self.get_content_hash(), self.encoding_override)
+
+    def get_content_hash(self) -> str:
+        """Return the SHA-256 of the contents of the file"""
+        if self.content_hash is None:
+            self.content_hash = IndexCache.get_content_hash(self.binary_file)
+        return self.content_hash
+
+    def get_binary_file(self, raw_xml_file: IO) -> IO:
+        """Return a seekable binary file object with the contents of raw_xml_file. Files that cannot be read again,
+        like stdin, and decompressed files, which cannot be read at random offsets efficiently, are copied to a
+        temporary file"""
+        binary_file = raw_xml_file
+        if isinstance(raw_xml_file, io.TextIOBase):
+            binary_file = getattr(raw_xml_file, "buffer", None)
+            if binary_file is None:  # An in-memory text file, store it as UTF-8
+                self.encoding_override = "utf-8"
+                raw_xml_file.seek(0)
+                temporary_file = tempfile.TemporaryFile()
+                for chunk in iter(lambda: raw_xml_file.read(XMLFileIndexBuilder.read_size), ""):
+                    temporary_file.write(chunk.encode("utf-8"))
+                temporary_file.flush()  # Written to the descriptor, where the index is read from, see read_chunks
+                return temporary_file
+        return Compression.get_random_access_file(binary_file)
+
+    def intern(self, namespace_uris: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Return a shared copy of namespace_uris, so that elements using the same namespaces share one tuple"""
+        return self.namespace_uri_tuples.setdefault(namespace_uris, namespace_uris)
+
+    def get_new_element_id(self, element_id: str) -> str:
+        """Return the identifier that replaces element_id in the elements written to the output file"""
+        if self.old_to_new_id_map and "oval:" in element_id:
+            return XMLUtils.replace_element_ids(self.old_to_new_id_map, element_id)
+        return element_id
+
+    @staticmethod
+    def get_qualified_tag(name: str, ns_prefix_map: Dict[str, str]) -> str:
+        """Return a tag name used in a find path in "{uri}local" notation, resolving it the same way ET does"""
+        if ":" in name:
+            prefix, local_name = name.split(":", 1)
+            return "{{{}}}{}".format(ns_prefix_map[prefix], local_name)
+        if ns_prefix_map.get(""):
+            return "{{{}}}{}".format(ns_prefix_map[""], name)
+        return name
+
+    def find_section(self, path: str) -> Optional[IndexedSection]:
+        """Return the first section matching the given "./name" path"""
+        tag = XMLFileIndex.get_qualified_tag(path[len("./") :], self.ns_prefix_map)
+        for section in self.sections:
+            if section.tag == tag:
+                return section
+        return None
+
+    def get_pkg_name(self, titles: List[Tuple[str, str, Optional[str]]]) -> Optional[str]:
+        """Return the text of the first metadata/title element of a definition"""
+        metadata_tag = XMLFileIndex.get_qualified_tag("metadata", self.ns_prefix_map)
+        title_tag = XMLFileIndex.get_qualified_tag("title", self.ns_prefix_map)
+        for title in titles:
+            if title[:2] == (metadata_tag, title_tag):
+                return title[2]
+        return None
+
+    def get_definition_trees(self) -> Generator[DefinitionTree, None, None]:
+        """Find all definition elements in the current file, create a DefinitionTree object for them and return it"""
+        for definition, definition_class, titles in self.find_section("./definitions").definitions:
+            if definition_class == "inventory":  # Definition elements with class "inventory" are preserved
+                # only if referenced by a non-"inventory" definition element chosen to be written to the output file
+                continue
+            pkg_name = self.get_pkg_name(titles)
+            if pkg_name is None:
+                logging.critical("Found a definition without a package name in {}".format(self.name))
+                sys.exit(1)
+            yield DefinitionTree(
+                definition,
+                self.ns_prefix_map,
+                self.id_to_element_map,
+                self.type_to_referenced_ids_map,
+                self.id_to_referenced_ids_map,
+                pkg_name,
+                self.id_interner,
+                self.name,
+                id_to_nested_ids_map=self.id_to_nested_ids_map,
+            )
+
+    def read_fragments(self, locations: List[Tuple[int, int]], scope: Dict[str, str]) -> ET.Element:
+        """Read the elements at the given (start, end) byte offsets from the file and parse them, with their tails,
+        as the children of a single element declaring the namespaces in scope at them"""
+        encoding = self.encoding_override or self.encoding
+        declarations = "".join(
+            ' xmlns{}="{}"'.format(":" + prefix if prefix else "", XMLWriter.escape(uri))
+            for prefix, uri in scope.items()
+        )
+        fragments = [
+            '<?xml version="1.0" encoding="{}"?>\n<fragments{}>'.format(encoding, declarations).encode(encoding)
+        ]
+        for start, end in locations:
+            self.binary_file.seek(start)
+            fragments.append(self.binary_file.read(end - start))
+        fragments.append("</fragments>".encode(encoding))
+        return self.xml_engine.parse(io.BytesIO(b"".join(fragments)), {})
+
+    def read_sections(self, sections: List[IndexedSection]) -> List[ET.Element]:
+        """Read the given sections from the file and return them parsed, with the regenerated identifiers in place"""
+        fragments_root = self.read_fragments(
+            [(section.start, section.end) for section in sections], sections[0].fragment_scope
+        )
+        XMLUtils.replace_element_ids_in_tree(self.old_to_new_id_map, fragments_root)
+        return list(fragments_root)
+
+    def read_elements(self, indexed_elements: List[IndexedElement]) -> List[ET.Element]:
+        """Read the given elements of a single section from the file and return them parsed, with the regenerated
+        identifiers in place"""
+        fragments_root = self.read_fragments(
+            [(element.start, element.end) for element in indexed_elements], indexed_elements[0].section.scope
+        )
+        XMLUtils.replace_element_ids_in_tree(self.old_to_new_id_map, fragments_root)
+        return list(fragments_root)
+
+    def get_element_keys(self, indexed_elements: List[IndexedElement]) -> List[str]:
+        """Return a key for each of the given elements of the file identifying how it is written to the output file:
+        a hash of its bytes in the file, with its tail, the encoding and namespace declarations they are parsed with
+        and the identifiers regenerated in them. Elements next to each other in the file are read together"""
+        encoding = self.encoding_override or self.encoding
+        element_to_key: Dict[IndexedElement, str] = {}
+        run: List[IndexedElement] = []
+        for indexed_element in sorted(indexed_elements, key=lambda element: element.start) + [None]:
+            if run and (
+                indexed_element is None
+                or indexed_element.start != run[-1].end
+                or run[-1].end - run[0].start >= IndexedOutputXMLFile.batch_size
+            ):
+                self.binary_file.seek(run[0].start)
+                data = self.binary_file.read(run[-1].end - run[0].start)
+                for element in run:
+                    element_data = data[element.start - run[0].start : element.end - run[0].start]
+                    new_element_ids = []
+                    if self.old_to_new_id_map:
+                        new_element_ids = sorted(
+                            (element_id, self.old_to_new_id_map[element_id])
+                            for element_id in set(XMLUtils.oval_id_regex.findall(element_data.decode(encoding)))
+                            if element_id in self.old_to_new_id_map
+                        )
+                    key = hashlib.sha256(element_data)
+                    key.update(repr((encoding, sorted(element.section.scope.items()), new_element_ids)).encode())
+                    element_to_key[element] = key.hexdigest()
+                run = []
+            if indexed_element is not None:
+                run.append(indexed_element)
+        return [element_to_key[element] for element in indexed_elements]
+
+
+class IndexedOutputXMLFile:
+    """The output XML file of a streaming merge. It is made of the root element and the sections of the last input
+    file, with the OVAL sections holding the indexed elements chosen to be written to the output file. The elements
+    are only read from their input files, in batches, while the output is written"""
+
+    batch_size = 1048576  # Maximum number of bytes of input elements read and parsed at a time
+
+    def __init__(self, xml_file_index: XMLFileIndex, ns_prefix_map: Dict[str, str]):
+        self.xml_file_index: XMLFileIndex = xml_file_index  # Index of the last input file
+        self.ns_prefix_map: Dict[str, str] = ns_prefix_map  # A map of namespace prefix and URIs
+        self.path_to_elements: Dict[str, List[IndexedElement]] = {}  # Elements to write in each cleared section
+        self.section_to_path: Dict[IndexedSection, str] = {}  # Path of each cleared section
+        self.section_to_element: Dict[IndexedSection, ET.Element] = {}  # Parsed sections that are not cleared
+        self.duplicate_id_detector: DuplicateIDDetector = DuplicateIDDetector()  # Identifiers of the elements of the
+        # output
+
+    def update_ns_map_and_register_ns(self):
+        """Find namespaces in the XML file, update the internal ns_prefix_map and register namespaces with ET"""
+        self.xml_file_index.update_ns_map_and_register_ns()
+
+    def clear_elements(self, xml_elements_to_clear: List[str]):
+        """Clear all sections listed in "xml_elements_to_clear". The other sections are read from the file"""
+        for path in xml_elements_to_clear:
+            logging.debug("Element: {}".format(path))
+            section = self.xml_file_index.find_section(path)
+            if section is None:
+                logging.critical("No element found at '{}' in {}".format(path, self.xml_file_index.name))
+                sys.exit(1)
+            self.section_to_path[section] = path
+            self.path_to_elements[path] = []
+        sections = [section for section in self.xml_file_index.sections if section not in self.section_to_path]
+        if sections:
+            self.section_to_element = dict(zip(sections, self.xml_file_index.read_sections(sections)))
+        self.duplicate_id_detector.add_all(
+            [
+                element.attrib["id"]
+                for section_element in self.section_to_element.values()
+                for element in section_element.iter()
+                if "id" in element.attrib
+            ],
+            self.xml_file_index.name,
+        )
+
+    def append_element_to_path(
+        self,
+        path: str,
+        element: IndexedElement,
+        source_name: Optional[str] = None,
+        element_ids: Optional[List[str]] = None,
+    ):
+        """Append a single element to the given path. The name of the file it comes from, reported if an identifier
+        in its tree is a duplicate, is always the one of its index. element_ids are the identifiers in its tree, see
+        XMLFileIndex.get_element_ids, looked up in its index if None"""
+        self.add_element_ids([element], element_ids)
+        self.path_to_elements[path].append(element)
+
+    def extend_element_at_path(
+        self,
+        path: str,
+        elements: List[IndexedElement],
+        source_name: Optional[str] = None,
+        element_ids: Optional[List[str]] = None,
+    ):
+        """Append a sequence of elements of a single file to the given path. The name of the file they come from,
+        reported if an identifier in their trees is a duplicate, is always the one of their index. element_ids are
+        the identifiers in their trees, see XMLFileIndex.get_element_ids, looked up in their index if None"""
+        self.add_element_ids(elements, element_ids)
+        self.path_to_elements[path].extend(elements)
+
+    def add_element_ids(self, elements: List[IndexedElement], element_ids: Optional[List[str]] = None):
+        """Record the identifiers in the trees of the given elements of a single file, as they are written to the
+        output, looked up in the index of their file if element_ids is None"""
+        if elements:
+            xml_file_index = elements[0].xml_file_index
+            if element_ids is None:
+                element_ids = xml_file_index.get_element_ids(elements)
+            self.duplicate_id_detector.add_all(element_ids, xml_file_index.name)
+
+    def validate_xml_ids(self):
+        """Validate that each element with an "id" attribute has a unique value for that attribute. The identifiers
+        are checked while the elements are added to the file, and all the duplicates are reported at once"""
+        self.duplicate_id_detector.validate()
+
+    def read_elements(self, indexed_elements: Iterable[IndexedElement]) -> Generator[ET.Element, None, None]:
+        """Read and return the given elements, in order, keeping at most batch_size bytes of them in memory"""
+        batch: List[IndexedElement] = []
+        batch_bytes = 0
+        for indexed_element in indexed_elements:
+            if batch and (
+                indexed_element.section is not batch[0].section or batch_bytes >= IndexedOutputXMLFile.batch_size
+            ):
+                yield from batch[0].xml_file_index.read_elements(batch)
+                batch, batch_bytes = [], 0
+            batch.append(indexed_element)
+            batch_bytes += indexed_element.end - indexed_element.start
+        if batch:
+            yield from batch[0].xml_file_index.read_elements(batch)
+
+    def write_elements(self, xml_writer: XMLWriter, indexed_elements: List[IndexedElement]):
+        """Write the given elements as the children of an open section"""
+        for element in self.read_elements(indexed_elements):
+            xml_writer.write_child(element, 2)
+
+    def collect_namespaces(self, xml_writer: XMLWriter, xml_tree_root: ET.Element) -> Dict[str, str]:
+        """Return the namespace URIs used in the output mapped to their prefix, collected in the same order as
+        XMLWriter.collect_namespaces would collect them from the whole output tree"""
+        xml_writer.collect_namespaces(xml_tree_root)
+        for section in self.xml_file_index.sections:
+            if section in self.section_to_path:
+                xml_writer.get_qname(section.tag)
+                for element in self.path_to_elements[self.section_to_path[section]]:
+                    for uri in element.namespace_uris:
+                        xml_writer.get_prefix(uri)
+            else:
+                xml_writer.collect_namespaces(self.section_to_element[section])
+        return dict(xml_writer.used_namespaces)
+
+    def dump_to_file(self, output_file: IO):
+        """Write XML to specified file. The XML is serialized and written incrementally, in chunks"""
+        xml_writer = XMLWriter(output_file, self.ns_prefix_map)
+        xml_tree_root = ET.Element(self.xml_file_index.root_tag, self.xml_file_index.root_attrib)
+        xml_tree_root.text = self.xml_file_index.root_text
+        namespaces = self.collect_namespaces(xml_writer, xml_tree_root)
+        xml_writer.write_declaration()
+        xml_writer.write_open_element(xml_tree_root, 0, namespaces)
+        for section in self.xml_file_index.sections:
+            if section not in self.section_to_path:
+                xml_writer.write_child(self.section_to_element[section], 1)
+                continue
+            section_element = ET.Element(section.tag)
+            elements = self.path_to_elements[self.section_to_path[section]]
+            if not elements:
+                xml_writer.write_child(section_element, 1)
+                continue
+            xml_writer.write_open_element(section_element, 1)
+            self.write_elements(xml_writer, elements)
+            xml_writer.write_close_element(section_element, 1)
+        xml_writer.write_close_element(xml_tree_root, 0)
+        xml_writer.flush(final=True)
@@ -1,24 +1,38 @@
-import functools
-import multiprocessing
 import re
 import sys
 import xml.etree.ElementTree as ET
 import logging
-from io import StringIO
-from math import ceil
-from typing import Dict, IO, Generator, Set, Union
+from typing import Dict, IO, Generator, Set, Union, Iterable, List, Tuple
 
 
 class XMLUtils:
+
+    """Matches a complete OVAL identifier token, e.g. oval:com.ubuntu.jammy:tst:2023123400000000. The token is
+    matched greedily up to the next character that cannot be part of an identifier, so that a shorter identifier
+    never matches inside a longer one (oval:...:tst:1 inside oval:...:tst:10)"""
+
+    oval_id_regex = re.compile(r"oval:[A-Za-z0-9_.:\-]*[A-Za-z0-9_\-]")
+
+    ref_regex = re.compile(r"([a-z]+)_ref")  # Regex to find references to other XML elements
+
     @staticmethod
-    def get_xml_root(xml_file: IO) -> ET.Element:
-        """Get the root element object by parsing xml_file"""
+    def get_xml_root(xml_file: IO, namespace_map: Dict[str, str]) -> ET.Element:
+        """Get the root element object by parsing xml_file. The file is parsed incrementally, so its contents are
+        never held in memory as a whole next to the parsed tree.
+        The namespace prefixes and URIs declared in the file are collected from the parser's start-ns events
+        into namespace_map during the same parse"""
         xml_file.seek(0)
-        return ET.fromstring(xml_file.read())
+        xml_parse_events = ET.iterparse(xml_file, events=("start-ns",))
+        for _, (prefix, uri) in xml_parse_events:
+            namespace_map[prefix] = uri
+        return xml_parse_events.root
 
     @staticmethod
     def find_element_by_id(element_id: str, xml_tree_root: ET.Element) -> ET.Element:
-        """Return an element object with the attribute "id" equal to "element_id" in the given XML tree"""
+        """Return an element object with the attribute "id" equal to "element_id" in the given XML tree. The whole
+        tree is searched, XMLFile.get looks the identifiers of a parsed file up in its index instead. The tree of an
+        XMLFile holds the IDs of the file until replace_element_ids_in_tree, so a regenerated ID is only found with
+        XMLFile.get before that"""
         children = xml_tree_root.findall(".//*[@id='{}']".format(element_id))
         if not children:
             logging.critical("No element found with id '{}' ".format(element_id))
@@ -29,76 +43,135 @@ class XMLUtils:
         return children[0]
 
     @staticmethod
-    def generate_id_map(xml_tree_root: ET.Element) -> Dict[str, ET.Element]:
+    def find_refs_in_element(element: ET.Element, referenced_ids: List[Tuple[str, str]]):
+        """Find references to the identifiers of other XML elements in the given element and add them to
+        referenced_ids as (element type, identifier) tuples"""
+        for attr, val in element.attrib.items():
+            match = XMLUtils.ref_regex.match(attr)
+            if match:
+                referenced_ids += [(match.group(1), val)]
+        match = XMLUtils.ref_regex.search(element.tag)
+        if match:
+            referenced_ids += [(match.group(1), element.text)]
+
+    @staticmethod
+    def generate_id_map(
+        xml_tree_root: ET.Element,
+        id_to_referenced_ids_map: Dict[str, List[Tuple[str, str]]] = None,
+        duplicate_ids: Set[str] = None,
+        oval_element_ids: List[str] = None,
+        id_to_nested_ids_map: Dict[str, List[str]] = None,
+    ) -> Dict[str, ET.Element]:
         """Generate and return a map of element identifier to the element object of all elements
-        that have the "id" attribute
+        that have the "id" attribute.
+        If id_to_referenced_ids_map is given, it is filled in the same pass over the tree with the references found
+        in each of these elements and their descendants, so that they can be followed without walking the tree again.
+        If duplicate_ids is given, the identifiers of more than one element are added to it. The map holds the last
+        of these elements.
+        If oval_element_ids is given, the OVAL identifiers are appended to it in document order, as many times as they
+        occur.
+        If id_to_nested_ids_map is given, the identifiers of the descendants of every child of a section of the root
+        element, e.g. a definition or a test, are added to it under the identifier of that child, for the children
+        whose trees hold any, so that the trees written to the output file do not have to be searched for them again
         """
         id_to_element_map = {}
-        for element in xml_tree_root.findall(".//*[@id]"):
-            element_id = element.attrib["id"]
-            id_to_element_map[element_id] = element
+        elements = [(child, (), None) for child in reversed(xml_tree_root)]  # Elements left to visit in document
+        # order, each with the reference lists of its ancestors that have an "id" attribute, itself included, and the
+        # child of a section it is in, None for the sections themselves
+        while elements:
+            element, referenced_ids_lists, top_level_element = elements.pop()
+            element_id = element.get("id")
+            if element_id is not None:
+                if (
+                    id_to_nested_ids_map is not None
+                    and top_level_element is not None
+                    and top_level_element is not element
+                ):
+                    top_level_id = top_level_element.get("id")
+                    if top_level_id is not None:
+                        id_to_nested_ids_map.setdefault(top_level_id, []).append(element_id)
+                if duplicate_ids is not None and element_id in id_to_element_map:
+                    duplicate_ids.add(element_id)
+                id_to_element_map[element_id] = element
+                if oval_element_ids is not None and element_id.startswith("oval:"):
+                    oval_element_ids.append(element_id)
+                if id_to_referenced_ids_map is not None:
+                    id_to_referenced_ids_map[element_id] = []
+                    referenced_ids_lists += (id_to_referenced_ids_map[element_id],)
+            if referenced_ids_lists:
+                referenced_ids = []
+                XMLUtils.find_refs_in_element(element, referenced_ids)
+                if referenced_ids:
+                    for ancestor_referenced_ids in referenced_ids_lists:
+                        ancestor_referenced_ids += referenced_ids
+            if top_level_element is None:  # A section, its children are the top level elements
+                elements += [(child, referenced_ids_lists, child) for child in reversed(element)]
+            else:
+                elements += [(child, referenced_ids_lists, top_level_element) for child in reversed(element)]
         return id_to_element_map
 
     @staticmethod
-    def as_string_io_with_regenerated_ids(
-        raw_xml_file: IO, suffix_int_generator: Generator[int, None, None], global_input_id_set: Set[str]
-    ) -> IO:
-        """Returns content within "raw_xml_file" as a StringIO object with new IDs for OVAL elements
-        generated using the suffix_int_generator"""
-        xml_file_contents = XMLUtils.regenerate_and_replace_ids(raw_xml_file, suffix_int_generator, global_input_id_set)
-        xml_file_as_io = StringIO(xml_file_contents)
-        xml_file_as_io.name = raw_xml_file.name
-        return xml_file_as_io
+    def replace_element_ids(current_file_old_to_new_id_map: Dict[str, Union[str, None]], xml_file_line: str) -> str:
+        """Replaces all keys from current_file_old_to_new_id_map present in xml_file_line
+        with the replacement mapped in current_file_old_to_new_id_map and returns the result str.
+        OVAL IDs are found in a single scan of xml_file_line and each one is looked up in the map, so the cost
+        is linear in the length of the line rather than proportional to the number of IDs in the map"""
+
+        def replacement(match) -> str:
+            # Replace the ID only if it has a new_element_id that is not None
+            return current_file_old_to_new_id_map.get(match.group(0)) or match.group(0)
+
+        return XMLUtils.oval_id_regex.sub(replacement, xml_file_line)
 
     @staticmethod
-    def regenerate_and_replace_ids(
-        raw_xml_file: IO, suffix_int_generator: Generator[int, None, None], global_input_id_set: Set[str]
-    ) -> str:
-        """Finds and replaces OVAL element IDs with new IDs in the "raw_xml_file".
-        raw_xml_file contents are split and processed by multiple worker processes
-        Result is returned as a str"""
-        logging.debug("Regenerating OVAL IDs in {}, this may take a while...".format(raw_xml_file.name))
-        xml_file_contents = raw_xml_file.read()
-        raw_xml_file.seek(0)
-        current_file_old_to_new_id_map = {}
-        XMLUtils.update_current_to_new_element_id_map(
-            current_file_old_to_new_id_map,
-            suffix_int_generator,
-            global_input_id_set,
-            xml_file_contents,
-            raw_xml_file.name,
-        )
-        curried_replace_element_ids_func = functools.partial(
-            XMLUtils.replace_element_ids, current_file_old_to_new_id_map
-        )
-        pool = multiprocessing.Pool(8)
-        xml_file_lines = xml_file_contents.splitlines()
-        xml_file_lines = pool.map(curried_replace_element_ids_func, xml_file_lines, ceil(len(xml_file_lines) / 8))
-        return "\n".join(xml_file_lines)
+    def replace_element_ids_in_tree(
+        current_file_old_to_new_id_map: Dict[str, Union[str, None]], xml_tree_root: ET.Element
+    ):
+        """Replaces all keys from current_file_old_to_new_id_map present in the attribute values, text and tail of
+        every element in the given XML tree with the replacement mapped in current_file_old_to_new_id_map"""
+        if not any(current_file_old_to_new_id_map.values()):  # No colliding IDs, nothing to replace
+            return
+        for element in xml_tree_root.iter():
+            for attr, val in element.attrib.items():
+                if "oval:" in val:
+                    element.set(attr, XMLUtils.replace_element_ids(current_file_old_to_new_id_map, val))
+            if element.text and "oval:" in element.text:
+                element.text = XMLUtils.replace_element_ids(current_file_old_to_new_id_map, element.text)
+            if element.tail and "oval:" in element.tail:
+                element.tail = XMLUtils.replace_element_ids(current_file_old_to_new_id_map, element.tail)
 
     @staticmethod
-    def replace_element_ids(current_file_old_to_new_id_map: Dict[str, Union[str, None]], xml_file_line: str) -> str:
-        """Replaces all keys from current_file_old_to_new_id_map present in xml_file_line
-        with the replacement mapped in current_file_old_to_new_id_map and returns the result str"""
-        for current_element_id, new_element_id in current_file_old_to_new_id_map.items():
-            if new_element_id:  # Replace current_element_id only if new_element_id is not None
-                xml_file_line = xml_file_line.replace(current_element_id, new_element_id)
-        return xml_file_line
+    def replace_element_ids_in_reference_map(
+        current_file_old_to_new_id_map: Dict[str, Union[str, None]],
+        id_to_referenced_ids_map: Dict[str, List[Tuple[str, str]]],
+    ) -> Dict[str, List[Tuple[str, str]]]:
+        """Return id_to_referenced_ids_map with the keys from current_file_old_to_new_id_map replaced in its element
+        identifiers and references the same way replace_element_ids_in_tree replaces them in the XML tree"""
+        if not any(current_file_old_to_new_id_map.values()):  # No colliding IDs, nothing to replace
+            return id_to_referenced_ids_map
+        new_id_to_referenced_ids_map = {}
+        for element_id, referenced_ids in id_to_referenced_ids_map.items():
+            new_referenced_ids = []
+            for ref_type, referenced_id in referenced_ids:
+                if referenced_id and "oval:" in referenced_id:
+                    referenced_id = XMLUtils.replace_element_ids(current_file_old_to_new_id_map, referenced_id)
+                new_referenced_ids += [(ref_type, referenced_id)]
+            new_element_id = current_file_old_to_new_id_map.get(element_id) or element_id
+            new_id_to_referenced_ids_map[new_element_id] = new_referenced_ids
+        return new_id_to_referenced_ids_map
 
     @staticmethod
     def update_current_to_new_element_id_map(
         current_file_old_to_new_id_map: Dict[str, Union[str, None]],
         suffix_int_generator: Generator[int, None, None],
         global_input_id_set: Set[str],
-        xml_file_content: str,
+        element_ids: Iterable[str],
         raw_xml_file_name: str,
     ):
-        """Finds OVAL element IDs in xml_file_content and updates current_file_old_to_new_id_map with the found
-        IDs mapped to new generated ID. A new ID is generated only for a duplicate ID.
+        """Updates current_file_old_to_new_id_map with the OVAL element IDs in element_ids mapped to new generated ID.
+        A new ID is generated only for a duplicate ID.
         IDs are generated using suffix_int_generator"""
-        element_id_regex = re.compile(r'id="(oval:.*?)"\s+')
-        for match in element_id_regex.finditer(xml_file_content):
-            element_id = match.group(1)
+        for element_id in element_ids:
             if element_id in current_file_old_to_new_id_map:  # We have already decided if we need to generate a new ID
                 # for element_id the last time we saw this ID for this file, so we can log a warning and return
                 logging.warning(f"Duplicate element ID: {element_id} in {raw_xml_file_name}")
@@ -0,0 +1,150 @@
+import io
+import os
+import xml.etree.ElementTree as ET
+from typing import IO, Dict, List
+
+
+class XMLWriter:
+    """Writes an element tree to a file as indented XML, incrementally and in chunks.
+    The output is identical to serializing the tree with ET.tostring, pretty printing the result with minidom's
+    toprettyxml(indent="  ") and dropping the blank lines, without ever holding the whole document in memory.
+    The XML is written UTF-8 encoded to a binary file object, or as is to a text file object"""
+
+    xml_namespace_uri = "http://www.w3.org/XML/1998/namespace"  # Always bound to the "xml" prefix, never declared
+
+    def __init__(self, output_file: IO, ns_prefix_map: Dict[str, str], indent: str = "  ", chunk_size: int = 65536):
+        self.output_file: IO = output_file  # File object the XML is written to
+        self.is_text: bool = XMLWriter.is_text_file(output_file)  # False to encode the XML before writing it
+        self.indent: str = indent  # Indentation added for every nesting level
+        self.chunk_size: int = chunk_size  # Number of characters buffered before they are written to output_file
+        self.uri_to_prefix_map: Dict[str, str] = {XMLWriter.xml_namespace_uri: "xml"}  # Prefix used for each
+        # namespace URI, resolved the same way ET.register_namespace does
+        for prefix, uri in ns_prefix_map.items():
+            for registered_uri, registered_prefix in list(self.uri_to_prefix_map.items()):
+                if registered_uri == uri or registered_prefix == prefix:
+                    del self.uri_to_prefix_map[registered_uri]
+            self.uri_to_prefix_map[uri] = prefix
+        self.qnames: Dict[str, str] = {}  # Cache of "{uri}local" names to "prefix:local" names
+        self.used_namespaces: Dict[str, str] = {}  # Namespace URIs used in the document mapped to their prefix
+        self.pending_chunks: List[str] = []  # Serialized XML that has not been written to output_file yet
+        self.pending_size: int = 0  # Number of characters in pending_chunks
+        self.partial_line: str = ""  # Last line of the flushed XML if it was not terminated yet
+        self.is_first_line: bool = True  # Lines after the first one are preceded by os.linesep
+
+    @staticmethod
+    def is_text_file(output_file: IO) -> bool:
+        """Return True if output_file is a text file object. A file object wrapping another one, such as
+        CountingOutputFile, tells through its is_text attribute"""
+        return getattr(output_file, "is_text", isinstance(output_file, io.TextIOBase))
+
+    def get_prefix(self, uri: str) -> str:
+        """Return the prefix for a namespace URI, recording the namespace as used by the document"""
+        prefix = self.used_namespaces.get(uri)
+        if prefix is None:
+            prefix = self.uri_to_prefix_map.get(uri)
+            if prefix is None:  # Unregistered namespace, make up a prefix the same way ET does
+                prefix = "ns{}".format(len(self.used_namespaces))
+            if prefix != "xml":
+                self.used_namespaces[uri] = prefix
+        return prefix
+
+    def get_qname(self, name: str) -> str:
+        """Return the prefixed name for a tag or attribute name in "{uri}local" notation, recording its namespace
+        as used by the document"""
+        qname = self.qnames.get(name)
+        if qname is None:
+            qname = name
+            if name[:1] == "{":
+                uri, local_name = name[1:].rsplit("}", 1)
+                prefix = self.get_prefix(uri)
+                qname = "{}:{}".format(prefix, local_name) if prefix else local_name
+            self.qnames[name] = qname
+        return qname
+
+    @staticmethod
+    def escape(data: str) -> str:
+        """Escape text and attribute values the way minidom does"""
+        return data.replace("&", "&amp;").replace("<", "&lt;").replace('"', "&quot;").replace(">", "&gt;")
+
+    def write(self, data: str):
+        """Buffer serialized XML and flush it once a whole chunk is pending"""
+        self.pending_chunks.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= self.chunk_size:
+            self.flush()
+
+    def flush(self, final: bool = False):
+        """Write the complete lines of the pending XML to output_file, leaving out blank lines and joining the rest
+        with os.linesep. The last line is kept back until it is terminated, unless this is the final flush"""
+        lines = (self.partial_line + "".join(self.pending_chunks)).splitlines(keepends=True)
+        self.pending_chunks, self.pending_size, self.partial_line = [], 0, ""
+        if lines and not final and lines[-1].splitlines()[0] == lines[-1]:  # Last line is not terminated yet
+            self.partial_line = lines.pop()
+        lines = [line.splitlines()[0] for line in lines]
+        lines = [line for line in lines if line.strip()]
+        if lines:
+            data = ("" if self.is_first_line else os.linesep) + os.linesep.join(lines)
+            self.output_file.write(data if self.is_text else data.encode("utf-8"))
+            self.is_first_line = False
+
+    def write_declaration(self):
+        """Write the XML declaration. It declares no encoding, the output is always UTF-8, the default of XML"""
+        self.write('<?xml version="1.0" ?>\n')
+
+    def write_start_tag(self, element: ET.Element, level: int, namespaces: Dict[str, str] = None):
+        """Write the opening of element's start tag along with its attributes. Namespace declarations are written
+        for each URI and prefix in namespaces"""
+        self.write(self.indent * level + "<" + self.get_qname(element.tag))
+        if namespaces:
+            for uri, prefix in sorted(namespaces.items(), key=lambda item: item[1]):
+                self.write(' xmlns{}="{}"'.format(":" + prefix if prefix else "", XMLWriter.escape(uri)))
+        for name, value in element.items():
+            self.write(' {}="{}"'.format(self.get_qname(name), XMLWriter.escape(value)))
+
+    def write_element(self, element: ET.Element, level: int, namespaces: Dict[str, str] = None):
+        """Write element and all its descendants indented for the given nesting level"""
+        if not len(element):
+            self.write_start_tag(element, level, namespaces)
+            if element.text:  # A single text node is written inline
+                self.write(">" + XMLWriter.escape(element.text) + "</" + self.get_qname(element.tag) + ">\n")
+            else:
+                self.write("/>\n")
+            return
+
+        self.write_open_element(element, level, namespaces)
+        for child in element:
+            self.write_child(child, level + 1)
+        self.write_close_element(element, level)
+
+    def write_open_element(self, element: ET.Element, level: int, namespaces: Dict[str, str] = None):
+        """Write element's start tag and text, leaving it open for children to be written with write_child"""
+        self.write_start_tag(element, level, namespaces)
+        self.write(">\n")
+        if element.text:
+            self.write(self.indent * (level + 1) + XMLWriter.escape(element.text) + "\n")
+
+    def write_child(self, child: ET.Element, level: int):
+        """Write a child of an element opened with write_open_element, followed by its tail"""
+        self.write_element(child, level)
+        if child.tail:
+            self.write(self.indent * level + XMLWriter.escape(child.tail) + "\n")
+
+    def write_close_element(self, element: ET.Element, level: int):
+        """Write the end tag of an element opened with write_open_element"""
+        self.write(self.indent * level + "</" + self.get_qname(element.tag) + ">\n")
+
+    def collect_namespaces(self, xml_tree_root: ET.Element) -> Dict[str, str]:
+        """Return the namespace URIs used by the tags and attributes in the given tree, mapped to their prefix"""
+        for element in xml_tree_root.iter():
+            self.get_qname(element.tag)
+            for name in element.keys():
+                self.get_qname(name)
+        return dict(self.used_namespaces)
+
+    def write_document(self, xml_tree_root: ET.Element):
+        """Write the XML declaration followed by the whole tree. All namespaces used in the tree are declared on
+        its root element"""
+        namespaces = self.collect_namespaces(xml_tree_root)
+        self.write_declaration()
+        self.write_element(xml_tree_root, 0, namespaces)
+        self.flush(final=True)
@@ -11,9 +11,14 @@ with open("HISTORY.rst") as history_file:
     history = history_file.read()
 
 requirements = [
-    "Click>=7.0",
+    "Click>=8.0",
 ]
 
+extra_requirements = {
+    "lxml": ["lxml>=4.4"],
+    "zstd": ["zstandard>=0.16"],
+}
+
 test_requirements = [
     "pytest>=3",
 ]
@@ -36,9 +41,11 @@ setup(
     entry_points={
         "console_scripts": [
             "oval-xml-feed-merge=oval_xml_feed_merge.cli:main",
+            "oval-xml-feed-merge-gen=oval_xml_feed_merge.cli:generate",
         ],
     },
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="GNU General Public License v3",
     long_description=readme + "\n\n" + history,
     include_package_data=True,
@@ -0,0 +1,33 @@
+from io import StringIO
+from pathlib import Path
+from typing import List, Optional
+
+import pytest
+
+from oval_xml_feed_merge.oval_xml_feed_merge import OvalXMLFeedMerge
+from oval_xml_feed_merge.xml_engine import XMLEngine
+
+requires_lxml = pytest.mark.skipif(not XMLEngine.is_lxml_available(), reason="lxml is not installed")
+
+TEST_DATA_PATH = Path(__file__).parent.joinpath("test_data")
+
+
+def merge(
+    xml_file_names: List[str], merge_class=OvalXMLFeedMerge, output_path: Optional[str] = None, **kwargs
+) -> OvalXMLFeedMerge:
+    """Merge the given test data files, or files at absolute paths, with merge_class, created with the extra keyword
+    arguments, and return the merge object. The output is written to output_path, or else to memory and kept in the
+    "output" attribute of the merge object"""
+    raw_xml_files = [open(TEST_DATA_PATH.joinpath(xml_file_name), "r") for xml_file_name in xml_file_names]
+    output_file = open(output_path, "wb") if output_path else StringIO()
+    try:
+        if not output_path:
+            output_file.name = "merged.xml"
+        oxfm = merge_class(raw_xml_files, output_file, **kwargs)
+        oxfm.merge_oval_xml_feeds()
+        oxfm.output = None if output_path else output_file.getvalue()
+    finally:
+        output_file.close()
+        for raw_xml_file in raw_xml_files:
+            raw_xml_file.close()
+    return oxfm
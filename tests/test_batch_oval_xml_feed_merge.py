@@ -0,0 +1,79 @@
+import gzip
+from io import StringIO
+from pathlib import Path
+
+import pytest
+
+from oval_xml_feed_merge.batch_oval_xml_feed_merge import BatchOvalXMLFeedMerge, OverlayOvalXMLFeedMerge, SharedXMLFile
+from oval_xml_feed_merge.worker_pool import WorkerPool
+from oval_xml_feed_merge.xml_engine import XMLEngine
+from tests.conftest import TEST_DATA_PATH, merge, requires_lxml
+
+requires_fork = pytest.mark.skipif(not WorkerPool.can_fork(), reason="worker processes cannot be forked")
+
+BASE_XML_FILE_NAME = "com.ubuntu.gke-1.27_jammy.pkg.oval.xml"
+
+OVERLAY_XML_FILE_NAMES = [
+    "com.ubuntu.gke-1.28_jammy.pkg.oval.xml",
+    "com.ubuntu.gke-1.27_jammy.pkg.oval-duplicate-id.xml",
+    "com.ubuntu.gke-1.27_jammy.pkg.oval.xml",
+    "com.ubuntu.gke-1.31_jammy.pkg.oval.xml",
+]
+
+
+class TestBatchOvalXMLFeedMerge:
+    @pytest.mark.parametrize("jobs", [1, pytest.param(2, marks=requires_fork)])
+    @pytest.mark.parametrize("xml_engine_name", [XMLEngine.name, pytest.param("lxml", marks=requires_lxml)])
+    def test_merge_oval_xml_feeds(self, tmp_path, jobs, xml_engine_name):
+        """Test that every output of a batch merge is identical to merging the base feed and the overlay"""
+        overlays = [
+            (str(TEST_DATA_PATH.joinpath(xml_file_name)), str(tmp_path.joinpath("merged-{}.xml".format(number))))
+            for number, xml_file_name in enumerate(OVERLAY_XML_FILE_NAMES)
+        ]
+        with open(TEST_DATA_PATH.joinpath(BASE_XML_FILE_NAME), "rb") as raw_base_file:
+            batch_merge = BatchOvalXMLFeedMerge(raw_base_file, overlays, jobs, xml_engine_name)
+            assert batch_merge.merge_oval_xml_feeds() == 0
+        for xml_file_name, (_, output_file_name) in zip(OVERLAY_XML_FILE_NAMES, overlays):
+            expected_output = merge([BASE_XML_FILE_NAME, xml_file_name]).output
+            assert Path(output_file_name).read_text(encoding="utf-8") == expected_output
+
+    def test_compressed_output(self, tmp_path):
+        """Test that the outputs are compressed according to their suffix"""
+        output_path = tmp_path.joinpath("merged.xml.gz")
+        overlays = [(str(TEST_DATA_PATH.joinpath(OVERLAY_XML_FILE_NAMES[0])), str(output_path))]
+        with open(TEST_DATA_PATH.joinpath(BASE_XML_FILE_NAME), "rb") as raw_base_file:
+            assert BatchOvalXMLFeedMerge(raw_base_file, overlays).merge_oval_xml_feeds() == 0
+        expected_output = merge([BASE_XML_FILE_NAME, OVERLAY_XML_FILE_NAMES[0]]).output
+        assert gzip.decompress(output_path.read_bytes()).decode("utf-8") == expected_output
+
+    def test_failed_overlay(self, tmp_path):
+        """Test that an overlay that cannot be merged fails the batch without stopping the other overlays"""
+        output_path = tmp_path.joinpath("merged.xml")
+        overlays = [
+            (str(tmp_path.joinpath("missing.xml")), str(tmp_path.joinpath("missing-merged.xml"))),
+            (str(TEST_DATA_PATH.joinpath(OVERLAY_XML_FILE_NAMES[0])), str(output_path)),
+        ]
+        with open(TEST_DATA_PATH.joinpath(BASE_XML_FILE_NAME), "rb") as raw_base_file:
+            assert BatchOvalXMLFeedMerge(raw_base_file, overlays).merge_oval_xml_feeds() == 1
+        assert output_path.read_text(encoding="utf-8") == merge([BASE_XML_FILE_NAME, OVERLAY_XML_FILE_NAMES[0]]).output
+
+
+class TestSharedXMLFile:
+    @pytest.mark.parametrize("xml_engine_name", [XMLEngine.name, pytest.param("lxml", marks=requires_lxml)])
+    def test_merges(self, xml_engine_name):
+        """Test that a shared file gives the same output in every merge it is part of, even when the merges moved
+        its elements to their output tree"""
+        xml_engine = XMLEngine.get_engine(xml_engine_name)
+        with open(TEST_DATA_PATH.joinpath(BASE_XML_FILE_NAME), "r") as raw_base_file:
+            base_xml_file = SharedXMLFile(raw_base_file, xml_engine)
+        for xml_file_name in OVERLAY_XML_FILE_NAMES * 2:
+            output_file = StringIO()
+            output_file.name = "merged.xml"
+            with open(TEST_DATA_PATH.joinpath(xml_file_name), "r") as raw_xml_file:
+                oxfm = OverlayOvalXMLFeedMerge(base_xml_file, [raw_xml_file], output_file, xml_engine_name)
+                oxfm.merge_oval_xml_feeds()
+            assert oxfm.xml_files[0] is base_xml_file
+            assert (
+                output_file.getvalue()
+                == merge([BASE_XML_FILE_NAME, xml_file_name], xml_engine_name=xml_engine_name).output
+            )
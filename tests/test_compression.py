@@ -0,0 +1,171 @@
+import bz2
+import gzip
+import io
+import lzma
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from oval_xml_feed_merge.compression import CompressedFile, Compression, DecompressedFile
+from oval_xml_feed_merge.oval_xml_feed_merge import OvalXMLFeedMerge
+from oval_xml_feed_merge.streaming_oval_xml_feed_merge import StreamingOvalXMLFeedMerge
+
+requires_zstandard = pytest.mark.skipif(not Compression.is_zstandard_available(), reason="zstandard is not installed")
+
+CODEC_NAMES = ["bz2", "xz", "gz", pytest.param("zst", marks=requires_zstandard)]
+
+XML_FILE_PATH = Path(__file__).parent.joinpath("test_data", "com.ubuntu.gke-1.27_jammy.pkg.oval.xml")
+
+
+def _compress(data: bytes, codec_name: str) -> bytes:
+    """Compress data with the standard tool of each codec"""
+    if codec_name == "bz2":
+        return bz2.compress(data)
+    if codec_name == "xz":
+        return lzma.compress(data)
+    if codec_name == "gz":
+        return gzip.compress(data)
+    import zstandard
+
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _decompress(data: bytes, codec_name: str) -> bytes:
+    """Decompress data with the standard tool of each codec"""
+    if codec_name == "bz2":
+        return bz2.decompress(data)
+    if codec_name == "xz":
+        return lzma.decompress(data)
+    if codec_name == "gz":
+        return gzip.decompress(data)
+    import zstandard
+
+    return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True).read()
+
+
+def _binary_file(data: bytes, name: str) -> io.BufferedReader:
+    """Return a peekable binary file object with a name, like the files opened by the CLI"""
+    raw_file = io.BytesIO(data)
+    raw_file.name = name
+    return io.BufferedReader(raw_file)
+
+
+class TestCompression:
+    @pytest.mark.parametrize(
+        "file_name, expected_codec_name",
+        [
+            ("feed.oval.xml.bz2", "bz2"),
+            ("feed.oval.xml.xz", "xz"),
+            ("feed.oval.xml.gz", "gz"),
+            ("feed.oval.xml.zst", "zst"),
+            ("feed.oval.xml", None),
+            ("<stdout>", None),
+            (None, None),
+        ],
+    )
+    def test_get_codec_name_by_suffix(self, file_name, expected_codec_name):
+        """Test that get_codec_name_by_suffix recognizes the suffix of every codec"""
+        assert Compression.get_codec_name_by_suffix(file_name) == expected_codec_name
+
+    @pytest.mark.parametrize(
+        "compress, file_name, expected_codec_name",
+        [
+            ("auto", "merged.xml.xz", "xz"),
+            ("auto", "merged.xml", None),
+            ("none", "merged.xml.xz", None),
+            ("gz", "merged.xml.xz", "gz"),
+        ],
+    )
+    def test_get_output_codec_name(self, compress, file_name, expected_codec_name):
+        """Test that get_output_codec_name follows the --compress option"""
+        assert Compression.get_output_codec_name(compress, file_name) == expected_codec_name
+
+    @pytest.mark.parametrize("codec_name", ["bz2", "xz", "gz"])
+    @pytest.mark.parametrize("file_name", ["feed.oval.xml", "feed.oval.xml.bz2"])
+    def test_detect_codec_name(self, codec_name, file_name):
+        """Test that detect_codec_name relies on the first bytes of a file rather than on its suffix, without
+        consuming them"""
+        binary_file = _binary_file(_compress(b"<root/>", codec_name), file_name)
+        assert Compression.detect_codec_name(binary_file) == codec_name
+        assert binary_file.tell() == 0
+
+    @pytest.mark.parametrize("codec_name", ["gz", "zst"])
+    def test_get_codec_name_by_magic(self, codec_name):
+        """Test that get_codec_name_by_magic recognizes the magic bytes of codecs whose library may be missing"""
+        magic = {"gz": b"\x1f\x8b\x08\x00", "zst": b"\x28\xb5\x2f\xfd\x00"}[codec_name]
+        assert Compression.get_codec_name_by_magic(magic) == codec_name
+
+    @pytest.mark.parametrize("raw_xml_file", [io.StringIO("<root/>"), _binary_file(b"<root/>", "feed.oval.xml")])
+    def test_open_input_uncompressed(self, raw_xml_file):
+        """Test that open_input returns files that are not compressed as they are"""
+        assert Compression.open_input(raw_xml_file) is raw_xml_file
+
+    @pytest.mark.parametrize("codec_name", CODEC_NAMES)
+    @pytest.mark.parametrize("chunk_size", [7, 1048576])
+    def test_open_input(self, codec_name, chunk_size):
+        """Test that open_input decompresses compressed files, including concatenated streams, and that seeking back
+        decompresses the file again"""
+        data = b"".join(b"<line>%d</line>\n" % i for i in range(100))
+        compressed_data = _compress(data[:500], codec_name) + _compress(data[500:], codec_name)
+        with mock.patch.object(Compression, "chunk_size", chunk_size):
+            decompressed_file = Compression.open_input(_binary_file(compressed_data, "feed.oval.xml"))
+            assert Compression.is_decompressed_file(decompressed_file)
+            assert decompressed_file.name == "feed.oval.xml"
+            assert decompressed_file.read() == data
+            decompressed_file.seek(0)
+            assert decompressed_file.read(10) == data[:10]
+            decompressed_file.seek(600)
+            assert decompressed_file.read() == data[600:]
+            decompressed_file.seek(300)
+            assert decompressed_file.read() == data[300:]
+            decompressed_file.close()
+
+    @pytest.mark.parametrize("compressed_data", [bz2.compress(b"<root/>" * 1000)[:-10], b"BZh9 not bzip2 data"])
+    def test_open_input_corrupted(self, compressed_data):
+        """Test that reading a corrupted compressed file exits"""
+        decompressed_file = Compression.open_input(_binary_file(compressed_data, "feed.oval.xml.bz2"))
+        with pytest.raises(SystemExit):
+            decompressed_file.read()
+
+    def test_stop(self):
+        """Test that closing a decompressed file stops its thread, even when it is blocked on a full queue"""
+        with mock.patch.object(Compression, "chunk_size", 1):
+            decompressed_file = DecompressedFile(_binary_file(gzip.compress(b"x" * 1000), "feed.xml.gz"), "gz")
+            decompressed_file.close()
+        assert not decompressed_file.thread.is_alive()
+
+    @pytest.mark.parametrize("codec_name", CODEC_NAMES + [None])
+    def test_open_output(self, codec_name):
+        """Test that open_output compresses what is written with the given codec and leaves the output file open"""
+        output_file = io.BytesIO()
+        with Compression.open_output(output_file, codec_name) as binary_file:
+            for i in range(1000):
+                binary_file.write("<line>{} é</line>\n".format(i).encode("utf-8"))
+        data = "".join("<line>{} é</line>\n".format(i) for i in range(1000)).encode("utf-8")
+        assert not output_file.closed
+        output = output_file.getvalue()
+        assert (output if codec_name is None else _decompress(output, codec_name)) == data
+
+    def test_compressed_file_error(self):
+        """Test that an error while writing the compressed data is raised in the thread writing to the file"""
+        output_file = mock.MagicMock()
+        output_file.write.side_effect = OSError("No space left on device")
+        compressed_file = CompressedFile(output_file, "gz")
+        compressed_file.write(b"<root/>")
+        with pytest.raises(OSError):
+            compressed_file.close()
+
+    @pytest.mark.parametrize("codec_name", CODEC_NAMES)
+    @pytest.mark.parametrize("merge_class", [OvalXMLFeedMerge, StreamingOvalXMLFeedMerge])
+    def test_merge_compressed(self, codec_name, merge_class):
+        """Test that merging compressed input files gives the same output as merging the uncompressed files"""
+        outputs = []
+        for compress in [False, True]:
+            data = XML_FILE_PATH.read_bytes()
+            raw_xml_files = [_binary_file(_compress(data, codec_name) if compress else data, XML_FILE_PATH.name)]
+            output_file = io.StringIO()
+            output_file.name = "merged.xml"
+            merge_class(raw_xml_files, output_file).merge_oval_xml_feeds()
+            outputs.append(output_file.getvalue())
+        assert outputs[0] == outputs[1]
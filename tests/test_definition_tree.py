@@ -1,3 +1,4 @@
+from collections import defaultdict
 from unittest.mock import MagicMock
 
 import pytest
@@ -6,6 +7,14 @@ import xml.etree.ElementTree as ET
 from oval_xml_feed_merge.definition_tree import DefinitionTree
 
 
+def get_local_type_to_referenced_ids_map(dt):
+    """Return the local_type_to_referenced_ids_map of dt with its handles converted back to element identifiers"""
+    return {
+        ref_type: set(dt.id_interner.get_ids(handles))
+        for ref_type, handles in dt.local_type_to_referenced_ids_map.items()
+    }
+
+
 class TestDefinitionTree:
     @pytest.mark.parametrize(
         "def_element, pkg_name, ns_prefix_map, id_to_ele_map, type_to_ref_ids_map",
@@ -27,6 +36,14 @@ class TestDefinitionTree:
         assert dt.ns_prefix_map == ns_prefix_map
         assert dt.id_to_element_map == id_to_ele_map
         assert dt.type_to_referenced_ids_map == type_to_ref_ids_map
+        assert dt.id_to_referenced_ids_map == {}
+
+    def test_ctor_pkg_name(self):
+        """Test that the constructor uses the given package name instead of looking it up in the definition element"""
+        def_element = MagicMock()
+        dt = DefinitionTree(def_element, {}, {}, {}, pkg_name="docker.io")
+        assert dt.pkg_name == "docker.io"
+        def_element.find.assert_not_called()
 
     @pytest.mark.parametrize(
         "id_to_ele_map, list_of_list_ref_ids, expected_local_type_to_ref_ids_map",
@@ -53,7 +70,125 @@ class TestDefinitionTree:
         dt = DefinitionTree(list(id_to_ele_map.values())[0], {}, id_to_ele_map, {})
         dt.find_refs_in_tree = _mock_find_refs_in_tree
         dt.build_referenced_elements_tree()
-        assert dt.local_type_to_referenced_ids_map == expected_local_type_to_ref_ids_map
+        assert get_local_type_to_referenced_ids_map(dt) == expected_local_type_to_ref_ids_map
+
+    @pytest.mark.parametrize(
+        "elements, expected_local_type_to_ref_ids_map",
+        [
+            (
+                [
+                    '<definition id="def1"><metadata><title>pkg</title></metadata>'
+                    '<criterion test_ref="test1"/><criterion test_ref="test2"/></definition>',
+                    '<test id="test1"><object object_ref="object1"/></test>',
+                    '<test id="test2"><object object_ref="object1"/><state state_ref="state1"/></test>',
+                    '<object id="object1"><var_ref>var1</var_ref></object>',
+                    '<state id="state1" var_ref="var1"/>',
+                    '<variable id="var1"><object_component object_ref="object1"/></variable>',
+                ],
+                {"test": {"test1", "test2"}, "object": {"object1"}, "state": {"state1"}, "var": {"var1"}},
+            )
+        ],
+    )
+    def test_build_referenced_elements_tree_shared_and_cyclic(self, elements, expected_local_type_to_ref_ids_map):
+        """Test that build_referenced_elements_tree terminates on reference cycles and searches every element reached
+        through several paths only once"""
+        id_to_ele_map = {}
+        for element_string in elements:
+            element = ET.fromstring(element_string)
+            id_to_ele_map[element.attrib["id"]] = element
+        dt = DefinitionTree(id_to_ele_map["def1"], {}, id_to_ele_map, {})
+        searched_elements = []
+        find_refs_in_tree = dt.find_refs_in_tree
+
+        def _find_refs_in_tree(element):
+            searched_elements.append(element)
+            return find_refs_in_tree(element)
+
+        dt.find_refs_in_tree = _find_refs_in_tree
+        dt.build_referenced_elements_tree()
+        assert get_local_type_to_referenced_ids_map(dt) == expected_local_type_to_ref_ids_map
+        assert len(searched_elements) == len(elements)
+        assert sorted(dt.id_to_referenced_ids_map.keys()) == sorted(id_to_ele_map.keys() - {"def1"})
+
+    def test_build_referenced_elements_tree_from_index(self):
+        """Test that build_referenced_elements_tree follows the references in id_to_referenced_ids_map without
+        searching any XML tree"""
+        id_to_ele_map = {
+            "def1": ET.fromstring('<definition id="def1"><metadata><title>pkg</title></metadata></definition>')
+        }
+        id_to_referenced_ids_map = {"def1": [("test", "test1")], "test1": [("object", "object1")], "object1": []}
+        dt = DefinitionTree(id_to_ele_map["def1"], {}, id_to_ele_map, {}, id_to_referenced_ids_map)
+        dt.find_refs_in_tree = MagicMock()
+        dt.build_referenced_elements_tree()
+        dt.find_refs_in_tree.assert_not_called()
+        assert get_local_type_to_referenced_ids_map(dt) == {"test": {"test1"}, "object": {"object1"}}
+        assert id_to_referenced_ids_map["def1"] == [("test", "test1")]
+
+    def test_build_referenced_elements_tree_new_ids(self):
+        """Test that build_referenced_elements_tree puts the new IDs in place in the definition element before
+        following its references, which are indexed by the new IDs"""
+        definition = ET.fromstring('<definition id="oval:x:def:1"><criterion test_ref="oval:x:tst:1"/></definition>')
+        id_to_referenced_ids_map = {"oval:x:def:10": [("test", "oval:x:tst:10")], "oval:x:tst:10": []}
+        dt = DefinitionTree(
+            definition,
+            {},
+            {},
+            {},
+            id_to_referenced_ids_map,
+            pkg_name="pkg",
+            old_to_new_id_map={"oval:x:def:1": "oval:x:def:10", "oval:x:tst:1": "oval:x:tst:10"},
+        )
+        dt.build_referenced_elements_tree()
+        assert ET.tostring(definition, encoding="unicode") == (
+            '<definition id="oval:x:def:10"><criterion test_ref="oval:x:tst:10" /></definition>'
+        )
+        assert get_local_type_to_referenced_ids_map(dt) == {"test": {"oval:x:tst:10"}}
+
+    def test_build_referenced_elements_tree_shared_interner(self):
+        """Test that DefinitionTree objects of the same file give the same handles to the same references, look up the
+        references of a shared element only once and do not expand the elements already synced to the file"""
+        id_to_ele_map = {
+            "def1": ET.fromstring('<definition id="def1"><criterion test_ref="test1"/></definition>'),
+            "def2": ET.fromstring(
+                '<definition id="def2"><criterion test_ref="test1"/><criterion test_ref="test2"/></definition>'
+            ),
+            "test1": ET.fromstring('<test id="test1"><object object_ref="object1"/></test>'),
+            "test2": ET.fromstring('<test id="test2"><object object_ref="object1"/></test>'),
+            "object1": ET.fromstring('<object id="object1"/>'),
+        }
+        type_to_ref_ids_map = defaultdict(set)
+        dt1 = DefinitionTree(id_to_ele_map["def1"], {}, id_to_ele_map, type_to_ref_ids_map, pkg_name="pkg1")
+        dt2 = DefinitionTree(
+            id_to_ele_map["def2"], {}, id_to_ele_map, type_to_ref_ids_map, pkg_name="pkg2", id_interner=dt1.id_interner
+        )
+        dt1.build_referenced_elements_tree()
+        assert get_local_type_to_referenced_ids_map(dt1) == {"test": {"test1"}, "object": {"object1"}}
+        dt1.sync_referenced_element_ids_to_xml_file()
+        get_refs_of_element = dt2.get_refs_of_element
+        dt2.get_refs_of_element = MagicMock(side_effect=get_refs_of_element)
+        dt2.build_referenced_elements_tree()
+        dt2.get_refs_of_element.assert_called_once_with("test2")
+        assert get_local_type_to_referenced_ids_map(dt2) == {"test": {"test2"}}
+        dt2.sync_referenced_element_ids_to_xml_file()
+        assert {
+            ref_type: set(dt1.id_interner.get_ids(handles)) for ref_type, handles in type_to_ref_ids_map.items()
+        } == {
+            "test": {"test1", "test2"},
+            "object": {"object1"},
+        }
+
+    def test_get_refs_of_element(self):
+        """Test that get_refs_of_element searches an element for references once and is served from the cache shared
+        between DefinitionTree objects afterwards"""
+        id_to_ele_map = {"test1": ET.fromstring('<test id="test1"><object object_ref="object1"/></test>')}
+        id_to_referenced_ids_map = {}
+        dt1 = DefinitionTree(MagicMock(), {}, id_to_ele_map, {}, id_to_referenced_ids_map)
+        dt2 = DefinitionTree(MagicMock(), {}, id_to_ele_map, {}, id_to_referenced_ids_map)
+        assert dt1.get_refs_of_element("test1") == [("object", "object1")]
+        dt2.find_refs_in_tree = MagicMock()
+        assert dt2.get_refs_of_element("test1") == [("object", "object1")]
+        dt2.find_refs_in_tree.assert_not_called()
+        assert id_to_referenced_ids_map == {"test1": [("object", "object1")]}
 
     @pytest.mark.parametrize(
         "element, expected_ref_ids",
@@ -120,3 +255,4 @@ class TestDefinitionTree:
         dt.local_type_to_referenced_ids_map = local_type_to_referenced_ids_map
         dt.sync_referenced_element_ids_to_xml_file()
         assert dt.type_to_referenced_ids_map == expected_type_to_referenced_ids_map
+        assert dt.local_type_to_referenced_ids_map == {}
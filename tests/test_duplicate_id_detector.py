@@ -0,0 +1,31 @@
+from unittest import mock
+
+import pytest
+
+from oval_xml_feed_merge.duplicate_id_detector import DuplicateIDDetector
+
+
+class TestDuplicateIDDetector:
+    @mock.patch("oval_xml_feed_merge.duplicate_id_detector.logging.critical")
+    def test_validate(self, mock_log_critical):
+        """Test that validate logs every duplicate identifier with the files of its elements before exiting"""
+        duplicate_id_detector = DuplicateIDDetector()
+        duplicate_id_detector.add_all(["oval:x:tst:1", "oval:x:tst:2"], "a.xml")
+        duplicate_id_detector.add_all(["oval:x:tst:2"], "b.xml")
+        duplicate_id_detector.add_all(["oval:x:tst:1", "oval:x:tst:3", "oval:x:tst:1"], "a.xml")
+        with pytest.raises(SystemExit):
+            duplicate_id_detector.validate()
+        assert mock_log_critical.call_args_list == [
+            mock.call("Found elements with duplicate id 'oval:x:tst:2' in a.xml, b.xml"),
+            mock.call("Found elements with duplicate id 'oval:x:tst:1' in a.xml, a.xml, a.xml"),
+        ]
+
+    def test_validate_unique(self):
+        """Test that validate does not exit when every identifier is unique"""
+        duplicate_id_detector = DuplicateIDDetector()
+        duplicate_id_detector.add_all(["oval:x:tst:1", "oval:x:tst:2"], "a.xml")
+        duplicate_id_detector.add_all(["oval:x:tst:3"], "a.xml")
+        duplicate_id_detector.validate()
+        assert duplicate_id_detector.id_to_source_name == dict.fromkeys(
+            ["oval:x:tst:1", "oval:x:tst:2", "oval:x:tst:3"], "a.xml"
+        )
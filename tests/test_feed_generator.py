@@ -0,0 +1,69 @@
+import gzip
+import re
+from io import StringIO
+from pathlib import Path
+
+import pytest
+
+from oval_xml_feed_merge.feed_generator import FeedGenerator
+from oval_xml_feed_merge.oval_xml_feed_merge import OvalXMLFeedMerge
+from oval_xml_feed_merge.xml_engine import XMLEngine
+from tests.conftest import requires_lxml
+
+
+class TestFeedGenerator:
+    @pytest.mark.parametrize("xml_engine_name", [XMLEngine.name, pytest.param("lxml", marks=requires_lxml)])
+    @pytest.mark.parametrize(
+        "params",
+        [
+            {},
+            {"overlay_count": 3, "overlap_ratio": 1, "collision_ratio": 1},
+            {"overlay_package_count": 80, "overlap_ratio": 0, "collision_ratio": 0, "kernel_ratio": 0},
+            {"fan_out": 9, "criteria_depth": 4, "kernel_ratio": 1},
+        ],
+    )
+    def test_merge(self, tmp_path, xml_engine_name, params):
+        """Test that the generated feeds can be merged, and that the output has one definition per package and every
+        element it references"""
+        feed_generator = FeedGenerator(**dict({"package_count": 60, "overlay_package_count": 20}, **params))
+        paths = feed_generator.write_feeds(str(tmp_path))
+        assert len(paths) == feed_generator.overlay_count + 1
+        raw_xml_files = [open(path, "rb") for path in paths]
+        output_file = StringIO()
+        output_file.name = "merged.xml"
+        try:
+            OvalXMLFeedMerge(raw_xml_files, output_file, xml_engine_name=xml_engine_name).merge_oval_xml_feeds()
+        finally:
+            for raw_xml_file in raw_xml_files:
+                raw_xml_file.close()
+        output = output_file.getvalue()
+        package_names = {
+            package.name for feed_number in range(len(paths)) for package in feed_generator.get_packages(feed_number)
+        }
+        assert sorted(re.findall(r"<title>([\w-]+)</title>", output)) == sorted(package_names)
+        element_ids = set(re.findall(r' id="([^"]+)"', output))
+        assert set(re.findall(r'_ref="([^"]+)"', output)) <= element_ids
+        assert set(re.findall(r"<ind-def:var_ref>([^<]+)<", output)) <= element_ids
+
+    @pytest.mark.parametrize("collision_ratio, expected_collisions", [(0, 0), (0.5, None), (1, 20)])
+    def test_collisions(self, collision_ratio, expected_collisions):
+        """Test that collision_ratio of the packages of an overlay take their IDs from the base feed"""
+        feed_generator = FeedGenerator(package_count=60, overlay_package_count=20, collision_ratio=collision_ratio)
+        base_ids = {package.get_id("def") for package in feed_generator.get_packages(0)}
+        collisions = sum(package.get_id("def") in base_ids for package in feed_generator.get_packages(1))
+        assert collisions == expected_collisions if expected_collisions is not None else 0 < collisions < 20
+
+    def test_seed(self, tmp_path):
+        """Test that the feeds only depend on the parameters and the seed"""
+        contents = []
+        for number, seed in enumerate([1, 1, 2]):
+            paths = FeedGenerator(package_count=30, seed=seed).write_feeds(str(tmp_path.joinpath(str(number))))
+            contents.append([Path(path).read_bytes() for path in paths])
+        assert contents[0] == contents[1]
+        assert contents[0] != contents[2]
+
+    def test_compressed(self, tmp_path):
+        """Test that the feeds are compressed with the given codec"""
+        paths = FeedGenerator(package_count=10, overlay_count=0).write_feeds(str(tmp_path), "gz")
+        assert paths == [str(tmp_path.joinpath("base.oval.xml.gz"))]
+        assert gzip.decompress(Path(paths[0]).read_bytes()).startswith(b'<?xml version="1.0" ?>')
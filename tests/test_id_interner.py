@@ -0,0 +1,22 @@
+import pytest
+
+from oval_xml_feed_merge.id_interner import IDInterner
+
+
+class TestIDInterner:
+    @pytest.mark.parametrize(
+        "references, expected_handles",
+        [
+            ([], []),
+            ([("test", "test1"), ("object", "object1")], [0, 1]),
+            ([("test", "test1"), ("object", "object1"), ("test", "test1")], [0, 1, 0]),
+            ([("test", "1"), ("object", "1")], [0, 1]),
+        ],
+    )
+    def test_intern_all(self, references, expected_handles):
+        """Test that every reference gets a dense handle, and that a reference interned again keeps its handle"""
+        id_interner = IDInterner()
+        assert id_interner.intern_all(references) == expected_handles
+        assert len(id_interner) == len(set(references))
+        assert id_interner.referenced_handles == [None] * len(id_interner)
+        assert id_interner.get_ids(expected_handles) == [element_id for _, element_id in references]
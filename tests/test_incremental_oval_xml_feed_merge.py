@@ -0,0 +1,157 @@
+import os
+import stat
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from oval_xml_feed_merge import __version__
+from oval_xml_feed_merge.feed_generator import FeedGenerator
+from oval_xml_feed_merge.incremental_oval_xml_feed_merge import IncrementalOvalXMLFeedMerge, MergeManifest
+from tests.conftest import merge
+
+
+class TestIncrementalOvalXMLFeedMerge:
+    @pytest.mark.parametrize(
+        "previous_xml_file_names, xml_file_names",
+        [
+            (["com.ubuntu.gke-1.27_jammy.pkg.oval.xml"], ["com.ubuntu.gke-1.27_jammy.pkg.oval.xml"]),
+            (
+                ["com.ubuntu.gke-1.27_jammy.pkg.oval.xml", "com.ubuntu.gke-1.28_jammy.pkg.oval.xml"],
+                ["com.ubuntu.gke-1.27_jammy.pkg.oval.xml", "com.ubuntu.gke-1.29_jammy.pkg.oval.xml"],
+            ),
+            (
+                ["com.ubuntu.gke-1.27_jammy.pkg.oval.xml", "com.ubuntu.gke-1.28_jammy.pkg.oval.xml"],
+                ["com.ubuntu.gke-1.28_jammy.pkg.oval.xml", "com.ubuntu.gke-1.27_jammy.pkg.oval.xml"],
+            ),
+            (
+                ["com.ubuntu.gke-1.27_jammy.pkg.oval.xml", "com.ubuntu.gke-1.31_jammy.pkg.oval.xml"],
+                ["com.ubuntu.gke-1.27_jammy.pkg.oval.xml", "com.ubuntu.gke-1.30_jammy.pkg.oval.xml"],
+            ),
+            (
+                ["com.ubuntu.gke-1.28_jammy.pkg.oval.xml", "com.ubuntu.gke-1.27_jammy.pkg.oval.xml"],
+                ["com.ubuntu.gke-1.27_jammy.pkg.oval-duplicate-id.xml", "com.ubuntu.gke-1.27_jammy.pkg.oval.xml"],
+            ),
+            (
+                ["com.ubuntu.gke-1.30_jammy.pkg.oval.xml"],
+                [
+                    "com.ubuntu.gke-1.27_jammy.pkg.oval.xml",
+                    "com.ubuntu.gke-1.28_jammy.pkg.oval.xml",
+                    "com.ubuntu.gke-1.29_jammy.pkg.oval.xml",
+                    "com.ubuntu.gke-1.30_jammy.pkg.oval.xml",
+                ],
+            ),
+        ],
+    )
+    def test_merge_oval_xml_feeds(self, tmp_path, previous_xml_file_names, xml_file_names):
+        """Test that an incremental merge writes exactly the same output as a full merge, whatever changed in the
+        input files since the previous merge"""
+        previous_output_path = str(tmp_path.joinpath("previous.xml"))
+        merge(previous_xml_file_names, IncrementalOvalXMLFeedMerge, previous_output_path)
+        output_path = str(tmp_path.joinpath("merged.xml"))
+        merge(xml_file_names, IncrementalOvalXMLFeedMerge, output_path, previous_output_name=previous_output_path)
+        assert Path(output_path).read_text(encoding="utf-8") == merge(xml_file_names).output
+        assert Path(MergeManifest.get_path(output_path)).exists()
+
+    def test_copied_elements(self, tmp_path):
+        """Test that the elements that did not change are copied from the previous output, and only them"""
+        xml_file_names = ["com.ubuntu.gke-1.27_jammy.pkg.oval.xml", "com.ubuntu.gke-1.31_jammy.pkg.oval.xml"]
+        previous_output_path = str(tmp_path.joinpath("previous.xml"))
+        oxfm = merge(
+            xml_file_names,
+            IncrementalOvalXMLFeedMerge,
+            previous_output_path,
+            previous_output_name=str(tmp_path.joinpath("missing.xml")),
+        )
+        assert oxfm.output_xml_file.copied_element_count == 0
+        element_count = len(oxfm.output_xml_file.manifest.element_locations)
+
+        oxfm = merge(
+            xml_file_names,
+            IncrementalOvalXMLFeedMerge,
+            str(tmp_path.joinpath("same.xml")),
+            previous_output_name=previous_output_path,
+        )
+        assert oxfm.output_xml_file.copied_element_count == element_count
+
+        xml_file_names[1] = "com.ubuntu.gke-1.30_jammy.pkg.oval.xml"  # Updates some of the packages
+        oxfm = merge(
+            xml_file_names,
+            IncrementalOvalXMLFeedMerge,
+            str(tmp_path.joinpath("changed.xml")),
+            previous_output_name=previous_output_path,
+        )
+        assert 0 < oxfm.output_xml_file.copied_element_count < element_count
+
+    def test_changed_element(self, tmp_path):
+        """Test that when a single element changes, shifting the elements after it in its input file, only the
+        package referencing it is rebuilt and all the other elements are copied from the previous output"""
+        feed_generator = FeedGenerator(package_count=20, overlay_package_count=10)
+        xml_file_names = feed_generator.write_feeds(str(tmp_path.joinpath("feeds")))
+        previous_output_path = str(tmp_path.joinpath("previous.xml"))
+        oxfm = merge(xml_file_names, IncrementalOvalXMLFeedMerge, previous_output_path)
+        element_count = len(oxfm.output_xml_file.manifest.element_locations)
+
+        base_path = Path(xml_file_names[0])
+        state = '<linux-def:dpkginfo_state id="oval:com.ubuntu.jammy:ste:11110000002000" version="1"'
+        assert state in base_path.read_text()
+        base_path.write_text(base_path.read_text().replace(state, state.replace('version="1"', 'version="10"')))
+        output_path = str(tmp_path.joinpath("merged.xml"))
+        oxfm = merge(
+            xml_file_names, IncrementalOvalXMLFeedMerge, output_path, previous_output_name=previous_output_path
+        )
+        assert oxfm.changed_pkg_names == ["package-1"]
+        assert oxfm.output_xml_file.copied_element_count == element_count - 1
+        assert Path(output_path).read_text(encoding="utf-8") == merge(xml_file_names).output
+
+    def test_changed_previous_output(self, tmp_path):
+        """Test that a previous output that changed since its manifest was written is not reused"""
+        xml_file_names = ["com.ubuntu.gke-1.27_jammy.pkg.oval.xml"]
+        previous_output_path = tmp_path.joinpath("previous.xml")
+        merge(xml_file_names, IncrementalOvalXMLFeedMerge, str(previous_output_path))
+        previous_output_path.write_text(previous_output_path.read_text().replace("Ubuntu", "Debian"))
+        output_path = str(tmp_path.joinpath("merged.xml"))
+        oxfm = merge(
+            xml_file_names, IncrementalOvalXMLFeedMerge, output_path, previous_output_name=str(previous_output_path)
+        )
+        assert oxfm.output_xml_file.copied_element_count == 0
+        assert Path(output_path).read_text(encoding="utf-8") == merge(xml_file_names).output
+
+
+class TestMergeManifest:
+    def test_save_load(self, tmp_path):
+        """Test that a saved manifest is loaded back"""
+        manifest = MergeManifest()
+        manifest.element_locations = {"oval:com.ubuntu:def:1": ["key", 20, 30]}
+        manifest.package_keys = {"package": "key"}
+        path = str(tmp_path.joinpath("merged.xml.manifest.json"))
+        manifest.save(path)
+        assert vars(MergeManifest.load(path)) == vars(manifest)
+
+    def test_save_permissions(self, tmp_path):
+        """Test that a saved manifest has the permissions set by the umask, like the output file"""
+        path = tmp_path.joinpath("merged.xml.manifest.json")
+        umask = os.umask(0o027)
+        try:
+            MergeManifest().save(str(path))
+        finally:
+            os.umask(umask)
+        assert stat.S_IMODE(path.stat().st_mode) == 0o640
+
+    @pytest.mark.parametrize("contents", [None, "not json", '{"version": ["0.0.0", 1]}', '{"package_keys": {}}'])
+    def test_load_invalid(self, tmp_path, contents):
+        """Test that a missing, unreadable or outdated manifest is ignored"""
+        path = tmp_path.joinpath("merged.xml.manifest.json")
+        if contents is not None:
+            path.write_text(contents)
+        assert MergeManifest.load(str(path)) is None
+
+    def test_load_other_version(self, tmp_path):
+        """Test that a manifest written by another version of the tool is ignored"""
+        path = str(tmp_path.joinpath("merged.xml.manifest.json"))
+        with mock.patch("oval_xml_feed_merge.incremental_oval_xml_feed_merge.__version__", "0.0.0"):
+            MergeManifest().save(path)
+        assert MergeManifest.load(path) is None
+        MergeManifest().save(path)
+        assert MergeManifest.load(path) is not None
+        assert __version__ != "0.0.0"
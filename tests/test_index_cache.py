@@ -0,0 +1,57 @@
+import os
+from io import BytesIO
+from unittest import mock
+
+import pytest
+
+from oval_xml_feed_merge.index_cache import IndexCache
+
+
+class TestIndexCache:
+    @pytest.mark.parametrize(
+        "contents, parameters, other_contents, other_parameters, expected_same_key",
+        [
+            (b"<root/>", (), b"<root/>", (), True),
+            (b"<root/>", (), b"<root />", (), False),
+            (b"<root/>", (None,), b"<root/>", ("utf-8",), False),
+        ],
+    )
+    def test_get_key(self, contents, parameters, other_contents, other_parameters, expected_same_key):
+        """Test that the cache key depends on the contents of the file and on the other parameters"""
+        key = IndexCache.get_key(IndexCache.get_content_hash(BytesIO(contents)), *parameters)
+        other_key = IndexCache.get_key(IndexCache.get_content_hash(BytesIO(other_contents)), *other_parameters)
+        assert (key == other_key) == expected_same_key
+
+    def test_get_key_version(self):
+        """Test that the cache key changes with the version of the tool"""
+        content_hash = IndexCache.get_content_hash(BytesIO(b"<root/>"))
+        key = IndexCache.get_key(content_hash)
+        with mock.patch("oval_xml_feed_merge.index_cache.__version__", "0.0.0"):
+            assert IndexCache.get_key(content_hash) != key
+
+    def test_store_load(self, tmp_path):
+        """Test that a stored index is loaded back, and that missing entries are reported as such"""
+        index_cache = IndexCache(str(tmp_path.joinpath("cache")), 1048576)
+        index = {"element_ids": ["oval:1"], "sections": [("tag", 0, 10)]}
+        index_cache.store("key", index)
+        assert index_cache.load("key") == index
+        assert index_cache.load("other") is None
+        assert os.listdir(index_cache.cache_dir) == ["key" + IndexCache.suffix]
+
+    def test_load_unreadable(self, tmp_path):
+        """Test that an unreadable entry is removed and reported as missing"""
+        index_cache = IndexCache(str(tmp_path), 1048576)
+        tmp_path.joinpath("key" + IndexCache.suffix).write_bytes(b"not a pickle")
+        assert index_cache.load("key") is None
+        assert os.listdir(index_cache.cache_dir) == []
+
+    def test_evict(self, tmp_path):
+        """Test that the least recently used entries are evicted once the cache is too large"""
+        index_cache = IndexCache(str(tmp_path), 1048576)
+        for age, key in enumerate(["recent", "used", "old"]):
+            index_cache.store(key, "x" * 1000)
+            os.utime(index_cache.get_path(key), (1000 - age, 1000 - age))
+        index_cache.load("old")  # The oldest entry is now the most recently used one
+        index_cache.max_size = 2500
+        index_cache.store("new", "x" * 1000)
+        assert sorted(os.listdir(index_cache.cache_dir)) == ["new.index", "old.index"]
@@ -0,0 +1,103 @@
+import json
+import os
+import re
+from io import BytesIO, StringIO
+
+import pytest
+
+from oval_xml_feed_merge import __version__
+from oval_xml_feed_merge.merge_stats import CountingOutputFile, MergeStats
+from oval_xml_feed_merge.oval_xml_feed_merge import OvalXMLFeedMerge
+from oval_xml_feed_merge.streaming_oval_xml_feed_merge import StreamingOvalXMLFeedMerge
+from tests.conftest import TEST_DATA_PATH
+
+
+XML_FILE_NAMES = ["com.ubuntu.gke-1.27_jammy.pkg.oval.xml", "com.ubuntu.gke-1.28_jammy.pkg.oval.xml"]
+
+
+class TestMergeStats:
+    def test_phase(self):
+        """Test that a phase that runs several times accumulates its times"""
+        merge_stats = MergeStats()
+        for _ in range(2):
+            with merge_stats.phase("parse"):
+                [str(number) for number in range(10000)]
+        merge_stats.write(os.devnull)
+        phase = merge_stats.phases["parse"]
+        assert list(merge_stats.phases) == ["parse"]
+        assert phase["wall_seconds"] > 0 and phase["cpu_seconds"] > 0
+        assert phase["peak_rss_bytes"] >= 0 and phase["tracemalloc_peak_bytes"] > 0
+
+    def test_disabled(self):
+        """Test that a disabled MergeStats keeps the counts only"""
+        merge_stats = MergeStats(False)
+        with merge_stats.phase("parse"):
+            merge_stats.count("elements_indexed", 3)
+        merge_stats.count_bytes_read([StringIO("<xml/>")])
+        assert merge_stats.phases == {}
+        assert merge_stats.counters["elements_indexed"] == 3
+        assert merge_stats.counters["bytes_read"] == 0
+
+    @pytest.mark.parametrize("to_stderr", [True, False])
+    def test_write(self, tmp_path, capsys, to_stderr):
+        """Test that the report is written as JSON to stderr or to a file"""
+        merge_stats = MergeStats()
+        with merge_stats.phase("dump_to_file"):
+            CountingOutputFile(StringIO(), merge_stats).write("Ubuntu é")
+        stats_path = tmp_path.joinpath("stats.json")
+        merge_stats.write("-" if to_stderr else str(stats_path))
+        stats = json.loads(capsys.readouterr().err if to_stderr else stats_path.read_text())
+        assert stats["version"] == __version__
+        assert stats["counters"]["bytes_written"] == 9
+        assert list(stats["phases"]) == ["dump_to_file"]
+        assert stats["throughput"]["bytes_written_per_second"] > 0
+
+    @pytest.mark.parametrize("output_file, data", [(StringIO(), "Ubuntu é"), (BytesIO(), "Ubuntu é".encode("utf-8"))])
+    def test_counting_output_file(self, output_file, data):
+        """Test that CountingOutputFile counts the bytes of the UTF-8 encoded output, written to a text or binary
+        file object"""
+        merge_stats = MergeStats(False)
+        CountingOutputFile(output_file, merge_stats).write(data)
+        assert output_file.getvalue() == data
+        assert merge_stats.counters["bytes_written"] == 9
+
+    @pytest.mark.parametrize("output_file_class", [StringIO, BytesIO])
+    @pytest.mark.parametrize("merge_class", [OvalXMLFeedMerge, StreamingOvalXMLFeedMerge])
+    def test_merge(self, merge_class, output_file_class):
+        """Test that a merge records every phase and counts what it processed, writing to a text or binary file"""
+        merge_stats = MergeStats()
+        raw_xml_files = [open(TEST_DATA_PATH.joinpath(xml_file_name), "rb") for xml_file_name in XML_FILE_NAMES]
+        output_file = output_file_class()
+        output_file.name = "merged.xml"
+        try:
+            merge_class(raw_xml_files, output_file, stats=merge_stats).merge_oval_xml_feeds()
+        finally:
+            for raw_xml_file in raw_xml_files:
+                raw_xml_file.close()
+        merge_stats.write(os.devnull)
+        output = output_file.getvalue()
+        if isinstance(output, bytes):
+            output = output.decode("utf-8")
+        assert list(merge_stats.phases) == [
+            "parse",
+            "id_regeneration",
+            "setup_output",
+            "process_files",
+            "closure_building",
+            "reference_collection",
+            "validation",
+            "dump_to_file",
+        ]
+        counters = merge_stats.counters
+        assert counters["bytes_read"] == sum(
+            TEST_DATA_PATH.joinpath(xml_file_name).stat().st_size for xml_file_name in XML_FILE_NAMES
+        )
+        assert counters["elements_indexed"] == sum(
+            len(set(re.findall(' id="([^"]*)"', TEST_DATA_PATH.joinpath(xml_file_name).read_text())))
+            for xml_file_name in XML_FILE_NAMES
+        )
+        assert counters["elements_indexed"] > counters["elements_emitted"] > 0
+        assert counters["ids_rewritten"] == 0  # The files use different namespaces
+        assert counters["definitions_shadowed"] > 0
+        assert counters["elements_emitted"] == output.count(' id="')
+        assert counters["bytes_written"] == len(output.encode("utf-8"))
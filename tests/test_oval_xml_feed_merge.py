@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 """Tests for `oval_xml_feed_merge` package."""
+from io import StringIO
 from unittest import mock
 from unittest.mock import MagicMock, call
 
@@ -11,34 +12,35 @@ import xml.etree.ElementTree as ET
 from oval_xml_feed_merge.oval_xml_feed_merge import OvalXMLFeedMerge
 
 
-@mock.patch.object(OvalXMLFeedMerge, "setup_output_xml_file", lambda x, y: y)
+@mock.patch.object(OvalXMLFeedMerge, "setup_output_xml_file", lambda x: None)
 class TestOvalXMLFeedMergeTestCtor:
     @pytest.mark.parametrize(("xml_file_names",), [(["first.xml", "second.xml"],)])
     @mock.patch("oval_xml_feed_merge.oval_xml_feed_merge.XMLFile")
-    @mock.patch("oval_xml_feed_merge.oval_xml_feed_merge.XMLUtils.as_string_io_with_regenerated_ids")
-    def test_ctor(self, mock_as_string_io, mock_xml_file, xml_file_names):
+    def test_ctor(self, mock_xml_file, xml_file_names):
         """Test that OvalXMLFeedMerge constructor initializes all attributes to the expected values"""
-        mock_as_string_io.side_effect = lambda x, y, z: x
         mock_output_file = MagicMock()
         oxfm = OvalXMLFeedMerge(xml_file_names, mock_output_file)
         calls = []
         for xml_file_name in xml_file_names:
-            calls += [call(xml_file_name, {})]
-        mock_xml_file.assert_has_calls(calls)
-        assert mock_as_string_io.call_count == len(xml_file_names)
+            calls += [call(xml_file_name, {}, oxfm.xml_engine)]
+        mock_xml_file.assert_has_calls(calls, any_order=True)
+        assert oxfm.xml_engine.name == "etree"
+        assert mock_xml_file.return_value.allocate_element_ids.call_count == len(xml_file_names)
+        assert mock_xml_file.return_value.replace_element_ids.call_count == len(xml_file_names)
+        assert oxfm.xml_files == [mock_xml_file.return_value] * len(xml_file_names)
         assert oxfm.ns_prefix_map == {}
         assert oxfm.pkgname_to_definition_tree == {}
         assert oxfm.output_file == mock_output_file
 
 
-@mock.patch.object(OvalXMLFeedMerge, "setup_output_xml_file", lambda x, y: y)
+@mock.patch.object(OvalXMLFeedMerge, "setup_output_xml_file", lambda x: None)
 @mock.patch("oval_xml_feed_merge.oval_xml_feed_merge.XMLFile", new=MagicMock())
-@mock.patch("oval_xml_feed_merge.oval_xml_feed_merge.XMLUtils.as_string_io_with_regenerated_ids", new=MagicMock())
 class TestOvalXMLFeedMerge:
     @pytest.mark.parametrize(
         "definition_trees, expected_pkgnames",
         [
             ([MagicMock(pkg_name="docker.io"), MagicMock(pkg_name="vim")], ["docker.io", "vim"]),
+            ([MagicMock(pkg_name="docker.io"), MagicMock(pkg_name="docker.io")], ["docker.io"]),
         ],
     )
     def test_update_package_to_definition_map(self, definition_trees, expected_pkgnames):
@@ -51,7 +53,7 @@ class TestOvalXMLFeedMerge:
         oxfm.update_package_to_definition_map(mock_xml_file)
         assert list(oxfm.pkgname_to_definition_tree.keys()) == expected_pkgnames
         for definition_tree in definition_trees:
-            definition_tree.build_referenced_elements_tree.assert_called()
+            definition_tree.build_referenced_elements_tree.assert_not_called()
 
     @pytest.mark.parametrize(
         "definition_trees, expected_pkgnames",
@@ -68,7 +70,7 @@ class TestOvalXMLFeedMerge:
         mock_xml_file.update_ns_map_and_register_ns.assert_called()
         assert list(oxfm.pkgname_to_definition_tree.keys()) == expected_pkgnames
         for definition_tree in definition_trees:
-            definition_tree.build_referenced_elements_tree.assert_called()
+            definition_tree.build_referenced_elements_tree.assert_not_called()
 
     @pytest.mark.parametrize("xml_files", [([MagicMock(name="xml_file1.xml"), MagicMock(name="xml_file2.xml")])])
     @mock.patch.object(OvalXMLFeedMerge, "process_xml_file")
@@ -84,26 +86,19 @@ class TestOvalXMLFeedMerge:
         mock_process_xml_file.assert_has_calls(calls)
 
     @pytest.mark.parametrize(
-        "element_path, xml_files_referenced_elements, expected_referenced_elements",
-        [
-            (
-                "./tests",
-                [["element1", "element2"], ["element3", "element4"]],
-                ["element1", "element2", "element3", "element4"],
-            )
-        ],
+        "element_path, xml_files_referenced_elements",
+        [("./tests", [["element1", "element2"], ["element3", "element4"]])],
     )
     @mock.patch("oval_xml_feed_merge.oval_xml_feed_merge.XMLFile", new=MagicMock())
-    def test_update_definition_element_references_at_path(
-        self, element_path, xml_files_referenced_elements, expected_referenced_elements
-    ):
+    def test_update_definition_element_references_at_path(self, element_path, xml_files_referenced_elements):
         """Test update_definition_element_references_at_path adds all the referenced elements across all input XML files
-        to the output XML
+        to the output XML, along with the names of their files
         """
         mock_output_xml_file = MagicMock()
         xml_files = []
-        for referenced_elements in xml_files_referenced_elements:
+        for file_number, referenced_elements in enumerate(xml_files_referenced_elements):
             xml_file = MagicMock()
+            xml_file.name = "xml_file{}.xml".format(file_number)
             xml_file.get_referenced_elements.return_value = referenced_elements
             xml_files += [xml_file]
 
@@ -114,15 +109,22 @@ class TestOvalXMLFeedMerge:
         for xml_file in xml_files:
             xml_file.get_referenced_elements.assert_called_with(element_path)
 
-        mock_output_xml_file.extend_element_at_path.assert_called_with(element_path, expected_referenced_elements)
+        mock_output_xml_file.extend_element_at_path.assert_has_calls(
+            [
+                call(element_path, referenced_elements, xml_file.name, xml_file.get_element_ids.return_value)
+                for xml_file, referenced_elements in zip(xml_files, xml_files_referenced_elements)
+            ]
+        )
+        for xml_file, referenced_elements in zip(xml_files, xml_files_referenced_elements):
+            xml_file.get_element_ids.assert_called_with(referenced_elements)
 
     @pytest.mark.parametrize(
         "pkgname_to_def_tree, definition_element_list, xml_elements_to_merge",
         [
             (
                 {
-                    "docker.io": MagicMock(definition_element="docker.io_xml"),
-                    "vim": MagicMock(definition_element="vim_xml"),
+                    "docker.io": MagicMock(definition_element="docker.io_xml", xml_file_name="xml_file1.xml"),
+                    "vim": MagicMock(definition_element="vim_xml", xml_file_name="xml_file2.xml"),
                 },
                 ["docker.io_xml", "vim_xml"],
                 ["./tests", "./definitions"],
@@ -148,10 +150,18 @@ class TestOvalXMLFeedMerge:
         oxfm.update_definitions_element_and_references()
 
         calls = []
-        for definition_element in definition_element_list:
-            calls += [call("./definitions", definition_element)]
+        for definition_element, def_tree in zip(definition_element_list, pkgname_to_def_tree.values()):
+            calls += [
+                call(
+                    "./definitions",
+                    definition_element,
+                    def_tree.xml_file_name,
+                    def_tree.get_element_ids.return_value,
+                )
+            ]
         mock_output_xml_file.append_element_to_path.assert_has_calls(calls)
         for def_tree in pkgname_to_def_tree.values():
+            def_tree.build_referenced_elements_tree.assert_called_once()
             def_tree.sync_referenced_element_ids_to_xml_file.assert_called()
         mock_update_definition_element_references_at_path.assert_has_calls(
             [call(element) for element in xml_elements_to_merge]
@@ -201,34 +211,33 @@ class TestOvalXMLFeedMergeSetupOutputXMLFile:
             )
         ],
     )
-    @mock.patch("oval_xml_feed_merge.oval_xml_feed_merge.XMLUtils.as_string_io_with_regenerated_ids")
     def test_setup_output_xml_file(
-        self, mock_as_string_io, xml_files, xml_files_contents, expected_output_xml_file_contents, mock_ns_prefix_map
+        self, xml_files, xml_files_contents, expected_output_xml_file_contents, mock_ns_prefix_map
     ):
         """Test that the constructor calls setup_output_xml_file. Also test that setup_output_xml_file
         sets up a cleared output_xml_file
         """
-        mock_as_string_io.side_effect = lambda x, y, z: x
-        mock_xml_files = []
+        raw_xml_files = []
         for xml_file_name, content in zip(xml_files, xml_files_contents):
-            mock_xml_file = MagicMock(name=xml_file_name)
-            mock_xml_file.read.return_value = content
-            mock_xml_files += [mock_xml_file]
-        oxfm = OvalXMLFeedMerge(mock_xml_files, None)
+            raw_xml_file = StringIO(content)
+            raw_xml_file.name = xml_file_name
+            raw_xml_files += [raw_xml_file]
+        oxfm = OvalXMLFeedMerge(raw_xml_files, None)
         assert ET.tostring(oxfm.output_xml_file.xml_tree_root, encoding="unicode") == expected_output_xml_file_contents
 
     @mock.patch("oval_xml_feed_merge.oval_xml_feed_merge.XMLFile")
-    @mock.patch("oval_xml_feed_merge.oval_xml_feed_merge.XMLUtils.as_string_io_with_regenerated_ids")
-    def test_setup_output_xml_file_calls(self, mock_as_string_io, mock_xml_file):
+    def test_setup_output_xml_file_calls(self, mock_xml_file):
         """Test that setup_output_xml_file makes the expected calls"""
-        mock_as_string_io.side_effect = lambda x, y, z: x
         xml_file_object = MagicMock()
         mock_xml_file.return_value = xml_file_object
         xml_files = ["test_xml.xml"]
-        OvalXMLFeedMerge(xml_files, None)
+        oxfm = OvalXMLFeedMerge(xml_files, None)
         calls = []
         for xml_file in xml_files:
-            calls += [call(xml_file, {})]
+            calls += [call(xml_file, {}, oxfm.xml_engine)]
         mock_xml_file.assert_has_calls(calls)
-        xml_file_object.update_ns_map_and_register_ns.assert_called()
-        xml_file_object.clear_elements.assert_called()
+        assert mock_xml_file.call_count == len(xml_files)  # The last input file is not parsed again
+        xml_file_object.copy_skeleton.assert_called_with(OvalXMLFeedMerge.xml_elements_to_merge)
+        assert oxfm.output_xml_file is xml_file_object.copy_skeleton.return_value
+        oxfm.output_xml_file.update_ns_map_and_register_ns.assert_called()
+        oxfm.output_xml_file.clear_elements.assert_called()
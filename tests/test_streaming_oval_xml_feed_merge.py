@@ -0,0 +1,106 @@
+import functools
+import gzip
+import os
+from io import StringIO
+
+import pytest
+
+from oval_xml_feed_merge.index_cache import IndexCache
+from oval_xml_feed_merge.oval_xml_feed_merge import OvalXMLFeedMerge
+from oval_xml_feed_merge.streaming_oval_xml_feed_merge import StreamingOvalXMLFeedMerge
+from oval_xml_feed_merge.xml_engine import XMLEngine
+from oval_xml_feed_merge.xml_file_index import IndexedOutputXMLFile, XMLFileIndex
+from tests.conftest import TEST_DATA_PATH, merge, requires_lxml
+
+
+class TestStreamingOvalXMLFeedMerge:
+    @pytest.mark.parametrize(
+        "xml_file_names",
+        [
+            ["com.ubuntu.gke-1.29_jammy.pkg.oval.xml"],
+            ["com.ubuntu.gke-1.27_jammy.pkg.oval.xml", "com.ubuntu.gke-1.28_jammy.pkg.oval.xml"],
+            ["com.ubuntu.gke-1.30_jammy.pkg.oval.xml", "com.ubuntu.gke-1.30_jammy.pkg.oval.xml"],
+            [
+                "com.ubuntu.gke-1.27_jammy.pkg.oval.xml",
+                "com.ubuntu.gke-1.28_jammy.pkg.oval.xml",
+                "com.ubuntu.gke-1.29_jammy.pkg.oval.xml",
+                "com.ubuntu.gke-1.30_jammy.pkg.oval.xml",
+                "com.ubuntu.gke-1.31_jammy.pkg.oval.xml",
+            ],
+        ],
+    )
+    @pytest.mark.parametrize("xml_engine_name", [XMLEngine.name, pytest.param("lxml", marks=requires_lxml)])
+    def test_merge_oval_xml_feeds(self, xml_file_names, xml_engine_name):
+        """Test that the streaming merge writes exactly the same output as the in-memory merge"""
+        expected_output = merge(xml_file_names, OvalXMLFeedMerge).output
+        assert expected_output.startswith("<?xml")
+        assert (
+            merge(xml_file_names, StreamingOvalXMLFeedMerge, xml_engine_name=xml_engine_name).output == expected_output
+        )
+
+    @pytest.mark.parametrize("merge_class", [OvalXMLFeedMerge, StreamingOvalXMLFeedMerge])
+    def test_merge_oval_xml_feeds_jobs(self, merge_class):
+        """Test that ingesting the input files concurrently gives the same output as ingesting them one by one"""
+        xml_file_names = [
+            "com.ubuntu.gke-1.27_jammy.pkg.oval.xml",
+            "com.ubuntu.gke-1.27_jammy.pkg.oval-duplicate-id.xml",
+            "com.ubuntu.gke-1.28_jammy.pkg.oval.xml",
+            "com.ubuntu.gke-1.27_jammy.pkg.oval.xml",
+        ]
+        expected_output = merge(xml_file_names, merge_class).output
+        assert merge(xml_file_names, functools.partial(merge_class, jobs=3)).output == expected_output
+
+    @pytest.mark.parametrize("merge_class", [OvalXMLFeedMerge, StreamingOvalXMLFeedMerge])
+    def test_merge_oval_xml_feeds_nested_duplicate_id(self, tmp_path, merge_class):
+        """Test that both merges reject a duplicate identifier on the children of the elements written to the output,
+        not only on the elements themselves"""
+        contents = TEST_DATA_PATH.joinpath("com.ubuntu.gke-1.27_jammy.pkg.oval.xml").read_text()
+        for test_number in [100, 101]:
+            object_ref = '<ind-def:object object_ref="oval:com.ubuntu.gke-1.27_jammy:obj:{}"'.format(test_number)
+            assert object_ref in contents
+            contents = contents.replace(object_ref, object_ref + ' id="nested"')
+        xml_file_path = tmp_path.joinpath("nested-duplicate-id.xml")
+        xml_file_path.write_text(contents)
+        with pytest.raises(SystemExit):
+            merge([str(xml_file_path)], merge_class).output
+
+    def test_merge_oval_xml_feeds_cached(self, tmp_path):
+        """Test that the streaming merge writes the same output whether the indexes are built or loaded from the
+        cache"""
+        xml_file_names = ["com.ubuntu.gke-1.27_jammy.pkg.oval.xml", "com.ubuntu.gke-1.28_jammy.pkg.oval.xml"]
+        expected_output = merge(xml_file_names, OvalXMLFeedMerge).output
+        index_cache = IndexCache(str(tmp_path), 1048576)
+        for _ in range(2):
+            merge_class = functools.partial(StreamingOvalXMLFeedMerge, index_cache=index_cache)
+            assert merge(xml_file_names, merge_class).output == expected_output
+        assert len(os.listdir(str(tmp_path))) == len(xml_file_names)
+
+    def test_merge_oval_xml_feeds_indexed_in_workers(self, tmp_path):
+        """Test that the indexes built in worker processes, including the one of a decompressed file, give the same
+        output and are stored in the cache"""
+        xml_file_names = ["com.ubuntu.gke-1.27_jammy.pkg.oval.xml", "com.ubuntu.gke-1.28_jammy.pkg.oval.xml"]
+        expected_output = merge(xml_file_names, OvalXMLFeedMerge).output
+        compressed_xml_file_path = tmp_path.joinpath("compressed.xml.gz")
+        with gzip.open(str(compressed_xml_file_path), "wb") as compressed_xml_file:
+            compressed_xml_file.write(TEST_DATA_PATH.joinpath(xml_file_names[1]).read_bytes())
+        cache_path = tmp_path.joinpath("cache")
+        output_file = StringIO()
+        output_file.name = "merged.xml"
+        with open(TEST_DATA_PATH.joinpath(xml_file_names[0]), "rb") as raw_xml_file, open(
+            compressed_xml_file_path, "rb"
+        ) as raw_compressed_xml_file:
+            StreamingOvalXMLFeedMerge(
+                [raw_xml_file, raw_compressed_xml_file],
+                output_file,
+                jobs=2,
+                index_cache=IndexCache(str(cache_path), 1048576),
+            ).merge_oval_xml_feeds()
+        assert output_file.getvalue() == expected_output
+        assert len(os.listdir(str(cache_path))) == len(xml_file_names)
+
+    def test_xml_files(self):
+        """Test that the streaming merge indexes the input files instead of parsing them into trees"""
+        with open(TEST_DATA_PATH.joinpath("com.ubuntu.gke-1.29_jammy.pkg.oval.xml"), "r") as raw_xml_file:
+            oxfm = StreamingOvalXMLFeedMerge([raw_xml_file], StringIO())
+            assert all(isinstance(xml_file, XMLFileIndex) for xml_file in oxfm.xml_files)
+            assert isinstance(oxfm.output_xml_file, IndexedOutputXMLFile)
@@ -0,0 +1,56 @@
+from unittest import mock
+from unittest.mock import mock_open
+
+import pytest
+
+from oval_xml_feed_merge.utils import Utils
+
+
+class TestUtils:
+    def test_next_int(self):
+        """Test that next_int yields consecutive integers starting from the seed"""
+        generator = Utils.next_int(5)
+        assert [next(generator) for _ in range(3)] == [5, 6, 7]
+
+    @pytest.mark.parametrize(
+        "files_content, expected_cpu_limit",
+        [
+            ({"/sys/fs/cgroup/cpu.max": "200000 100000\n"}, 2),
+            ({"/sys/fs/cgroup/cpu.max": "150000 100000\n"}, 2),
+            ({"/sys/fs/cgroup/cpu.max": "max 100000\n"}, None),
+            (
+                {"/sys/fs/cgroup/cpu/cpu.cfs_quota_us": "400000\n", "/sys/fs/cgroup/cpu/cpu.cfs_period_us": "100000\n"},
+                4,
+            ),
+            (
+                {"/sys/fs/cgroup/cpu/cpu.cfs_quota_us": "-1\n", "/sys/fs/cgroup/cpu/cpu.cfs_period_us": "100000\n"},
+                None,
+            ),
+            ({}, None),
+        ],
+    )
+    def test_get_cgroup_cpu_limit(self, files_content, expected_cpu_limit):
+        """Test that get_cgroup_cpu_limit reads the cgroup v2 and v1 CPU quota files"""
+
+        def _mock_open(path, *args, **kwargs):
+            if path not in files_content:
+                raise FileNotFoundError(path)
+            return mock_open(read_data=files_content[path])()
+
+        with mock.patch("builtins.open", _mock_open):
+            assert Utils.get_cgroup_cpu_limit() == expected_cpu_limit
+
+    @pytest.mark.parametrize(
+        "affinity, cgroup_cpu_limit, expected_cpu_count",
+        [
+            ({0, 1, 2, 3}, None, 4),
+            ({0, 1, 2, 3}, 2, 2),
+            ({0, 1}, 8, 2),
+        ],
+    )
+    def test_get_available_cpu_count(self, affinity, cgroup_cpu_limit, expected_cpu_count):
+        """Test that get_available_cpu_count honours both the CPU affinity and the cgroup CPU quota"""
+        with mock.patch(
+            "oval_xml_feed_merge.utils.os.sched_getaffinity", return_value=affinity, create=True
+        ), mock.patch.object(Utils, "get_cgroup_cpu_limit", return_value=cgroup_cpu_limit):
+            assert Utils.get_available_cpu_count() == expected_cpu_count
@@ -0,0 +1,83 @@
+from unittest import mock
+
+import pytest
+
+from oval_xml_feed_merge.worker_pool import WorkerPool
+
+
+forked_state = ""
+
+
+def _get_forked_state(number: int) -> str:
+    """Return the module state seen by a worker process"""
+    return forked_state + str(number)
+
+
+class TestWorkerPool:
+    @pytest.mark.parametrize("jobs, expected_jobs", [(1, 1), (4, 4), (0, 1)])
+    def test_ctor(self, jobs, expected_jobs):
+        """Test that the constructor does not start any worker process"""
+        worker_pool = WorkerPool(jobs)
+        assert worker_pool.jobs == expected_jobs
+        assert worker_pool.pool is None
+        assert worker_pool.executor is None
+
+    @mock.patch("oval_xml_feed_merge.worker_pool.multiprocessing.Pool")
+    def test_map_in_process(self, mock_pool):
+        """Test that map runs in-process without starting a pool when there is a single job"""
+        with WorkerPool(1) as worker_pool:
+            assert worker_pool.map(str.upper, ["a", "b"], 1) == ["A", "B"]
+        mock_pool.assert_not_called()
+
+    def test_map_with_workers(self):
+        """Test that map distributes the work to worker processes, returns results in order and that the pool is
+        shut down on exit"""
+        with WorkerPool(2) as worker_pool:
+            assert worker_pool.map(str.upper, ["a", "b", "c"], 2) == ["A", "B", "C"]
+            pool = worker_pool.pool
+            assert pool is not None
+            assert worker_pool.map(str.lower, ["D"]) == ["d"]
+            assert worker_pool.pool is pool  # The same pool is reused
+        assert worker_pool.pool is None
+
+    @pytest.mark.skipif(not WorkerPool.can_fork(), reason="worker processes cannot be forked")
+    def test_map_with_forked_workers(self):
+        """Test that forked worker processes see the state of the process at the time the pool was started"""
+        global forked_state
+        forked_state = "state"
+        with WorkerPool(2, "fork") as worker_pool:
+            assert worker_pool.map(_get_forked_state, [1, 2]) == ["state1", "state2"]
+
+    @pytest.mark.parametrize("jobs", [1, 3])
+    def test_map_in_threads(self, jobs):
+        """Test that map_in_threads applies func to the items of several iterables and returns the results in order,
+        without starting any worker process"""
+        with WorkerPool(jobs) as worker_pool:
+            assert worker_pool.map_in_threads(str.replace, ["ab", "cb", "eb"], ["b"] * 3, ["x"] * 3) == [
+                "ax",
+                "cx",
+                "ex",
+            ]
+            assert worker_pool.pool is None
+
+    def test_map_in_threads_reuses_executor(self):
+        """Test that the threads are started once for the lifetime of the pool and shut down on exit"""
+        with WorkerPool(2) as worker_pool:
+            assert worker_pool.map_in_threads(str.upper, ["a", "b"]) == ["A", "B"]
+            executor = worker_pool.executor
+            assert executor is not None
+            assert worker_pool.map_in_threads(str.lower, ["C"]) == ["c"]
+            assert worker_pool.executor is executor
+        assert worker_pool.executor is None
+        with pytest.raises(RuntimeError):
+            executor.submit(str.upper, "d")
+
+    @mock.patch("oval_xml_feed_merge.worker_pool.multiprocessing.Pool")
+    def test_close(self, mock_pool):
+        """Test that close closes and joins the pool"""
+        worker_pool = WorkerPool(2)
+        worker_pool.map(str.upper, ["a"])
+        worker_pool.close()
+        mock_pool.return_value.close.assert_called()
+        mock_pool.return_value.join.assert_called()
+        assert worker_pool.pool is None
@@ -0,0 +1,101 @@
+from io import BytesIO, StringIO
+from unittest import mock
+
+import pytest
+import xml.etree.ElementTree as ET
+
+from oval_xml_feed_merge import xml_engine
+from oval_xml_feed_merge.xml_engine import LXMLEngine, XMLEngine
+from oval_xml_feed_merge.xml_utils import XMLUtils
+from tests.conftest import requires_lxml
+
+
+XML_STRING = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<oval_definitions xmlns="urn:default" xmlns:oval="urn:oval">\n'
+    "  <!-- A comment -->\n"
+    '  <definitions><definition id="oval:1" class="vulnerability"><?pi data?>'
+    "<metadata><title>pkg é</title></metadata></definition></definitions>\n"
+    "  <oval:product_name>Generator</oval:product_name>\n"
+    "</oval_definitions>"
+)
+
+
+class TestXMLEngine:
+    @pytest.mark.parametrize(
+        "name, expected_class",
+        [
+            ("etree", XMLEngine),
+            pytest.param("lxml", LXMLEngine, marks=requires_lxml),
+        ],
+    )
+    def test_get_engine(self, name, expected_class):
+        """Test that get_engine returns the engine with the given name"""
+        assert type(XMLEngine.get_engine(name)) is expected_class
+
+    @pytest.mark.parametrize(
+        "lxml_etree, expected_name",
+        [(None, "etree"), pytest.param(xml_engine.lxml_etree, "etree", marks=requires_lxml)],
+    )
+    def test_get_default_engine_name(self, lxml_etree, expected_name):
+        """Test that etree is the default engine, whether lxml is installed or not"""
+        with mock.patch.object(xml_engine, "lxml_etree", lxml_etree):
+            assert XMLEngine.get_default_engine_name() == expected_name
+            assert XMLEngine.get_engine().name == expected_name
+
+    @mock.patch.object(xml_engine, "lxml_etree", None)
+    @pytest.mark.parametrize("name", ["lxml", "unknown"])
+    def test_get_engine_unavailable(self, name):
+        """Test that get_engine raises ValueError for unknown engines and for lxml when it is not installed"""
+        with pytest.raises(ValueError):
+            XMLEngine.get_engine(name)
+
+    @mock.patch.object(XMLUtils, "get_xml_root")
+    def test_parse(self, mock_get_xml_root):
+        """Test that the etree engine parses files with XMLUtils.get_xml_root"""
+        raw_xml_file, namespace_map = StringIO(XML_STRING), {}
+        assert XMLEngine().parse(raw_xml_file, namespace_map) == mock_get_xml_root.return_value
+        mock_get_xml_root.assert_called_with(raw_xml_file, namespace_map)
+
+    @pytest.mark.parametrize(
+        "engine, expected_path_namespaces",
+        [
+            (XMLEngine(), {"": "urn:default", "oval": "urn:oval"}),
+            (LXMLEngine(), {None: "urn:default", "oval": "urn:oval"}),
+        ],
+    )
+    def test_get_path_namespaces(self, engine, expected_path_namespaces):
+        """Test that get_path_namespaces maps the default namespace to the prefix each engine expects"""
+        assert engine.get_path_namespaces({"": "urn:default", "oval": "urn:oval"}) == expected_path_namespaces
+
+    @pytest.mark.parametrize("engine", [XMLEngine(), pytest.param(LXMLEngine(), marks=requires_lxml)])
+    def test_get_appendable_element(self, engine):
+        """Test that an element appended twice to the same tree appears in it twice with every engine"""
+        input_root = engine.parse(StringIO('<root><definition id="oval:1"><title>pkg</title></definition></root>'), {})
+        output_root = engine.parse(StringIO("<root><definitions/></root>"), {})
+        definition = input_root[0]
+        for _ in range(2):
+            output_root[0].append(engine.get_appendable_element(definition, output_root))
+        assert [element.get("id") for element in output_root.iter() if element.get("id")] == ["oval:1", "oval:1"]
+
+
+@requires_lxml
+class TestLXMLEngine:
+    @pytest.mark.parametrize(
+        "raw_xml_file", [StringIO(XML_STRING), BytesIO(XML_STRING.encode("utf-8"))], ids=["text", "binary"]
+    )
+    @pytest.mark.parametrize("read_size", [1, 65536])
+    def test_parse(self, raw_xml_file, read_size):
+        """Test that the lxml engine builds a tree with the same content as the etree engine, along with the same
+        namespace map, from text and binary files"""
+        etree_namespace_map, lxml_namespace_map = {}, {}
+        etree_root = XMLEngine().parse(StringIO(XML_STRING), etree_namespace_map)
+        with mock.patch.object(LXMLEngine, "read_size", read_size):
+            lxml_root = LXMLEngine().parse(raw_xml_file, lxml_namespace_map)
+        assert lxml_namespace_map == etree_namespace_map == {"": "urn:default", "oval": "urn:oval"}
+        assert [(e.tag, e.items(), e.text, e.tail) for e in lxml_root.iter()] == [
+            (e.tag, e.items(), e.text, e.tail) for e in etree_root.iter()
+        ]
+        namespaces = LXMLEngine().get_path_namespaces(lxml_namespace_map)
+        assert lxml_root.find("./definitions/definition/metadata/title", namespaces).text == "pkg é"
+        assert isinstance(etree_root, ET.Element)
@@ -1,7 +1,9 @@
+from io import StringIO
 from unittest import mock
 from unittest.mock import MagicMock, call
 
 import pytest
+from oval_xml_feed_merge.xml_engine import LXMLEngine, XMLEngine
 from oval_xml_feed_merge.xml_file import XMLFile
 
 from oval_xml_feed_merge.xml_utils import XMLUtils
@@ -27,12 +29,149 @@ class TestXMLFile:
         xml_file = XMLFile(raw_xml_file, ns_prefix_map)
         assert xml_file.raw_xml_file == raw_xml_file
         assert xml_file.name == raw_xml_file.name
-        mock_get_xml_root.assert_called_with(raw_xml_file)
-        mock_generate_id_map.assert_called()
+        mock_get_xml_root.assert_called_with(raw_xml_file, {})
+        mock_generate_id_map.assert_called_with(mock_get_xml_root.return_value, {}, set(), [], {})
+        assert xml_file.id_to_referenced_ids_map == {}
         assert xml_file.ns_prefix_map == ns_prefix_map
         assert xml_file.type_to_referenced_ids_map == {}
         assert xml_file.type_to_referenced_ids_map["something"] == set()
 
+    @pytest.mark.parametrize(
+        (
+            "raw_xml_file_content",
+            "global_input_id_set",
+            "expected_xml",
+            "expected_ids",
+            "expected_id_to_referenced_ids_map",
+        ),
+        [
+            (
+                "<root>"
+                '<tests><test id="oval:focal:tst:1"><object object_ref="oval:focal:obj:1"/></test></tests>'
+                '<objects><object id="oval:focal:obj:1"/><object id="oval:focal:obj:10"/></objects>'
+                "</root>",
+                {"oval:focal:obj:1"},
+                "<root>"
+                '<tests><test id="oval:focal:tst:1"><object object_ref="oval:focal:obj:10000000000000007" /></test>'
+                "</tests>"
+                '<objects><object id="oval:focal:obj:10000000000000007" /><object id="oval:focal:obj:10" /></objects>'
+                "</root>",
+                ["oval:focal:tst:1", "oval:focal:obj:10000000000000007", "oval:focal:obj:10"],
+                {
+                    "oval:focal:tst:1": [("object", "oval:focal:obj:10000000000000007")],
+                    "oval:focal:obj:10000000000000007": [],
+                    "oval:focal:obj:10": [],
+                },
+            ),
+        ],
+    )
+    def test_regenerate_element_ids(
+        self, raw_xml_file_content, global_input_id_set, expected_xml, expected_ids, expected_id_to_referenced_ids_map
+    ):
+        """Test that regenerate_element_ids gives new IDs to the elements whose IDs were already seen, updates the
+        references to them and keeps id_to_element_map in sync. The tree is only updated by replace_element_ids_in_tree
+        """
+        raw_xml_file = StringIO(raw_xml_file_content)
+        raw_xml_file.name = "test_xml.xml"
+        xml_file = XMLFile(raw_xml_file, {})
+        xml_file.regenerate_element_ids(iter([7]), global_input_id_set)
+        assert ET.tostring(xml_file.xml_tree_root, encoding="unicode") == raw_xml_file_content.replace("/>", " />")
+        xml_file.replace_element_ids_in_tree()
+        assert xml_file.old_to_new_id_map == {}
+        assert ET.tostring(xml_file.xml_tree_root, encoding="unicode") == expected_xml
+        assert list(xml_file.id_to_element_map.keys()) == expected_ids
+        for element_id, element in xml_file.id_to_element_map.items():
+            assert element.attrib["id"] == element_id
+        assert xml_file.id_to_referenced_ids_map == expected_id_to_referenced_ids_map
+        assert global_input_id_set == {"oval:focal:tst:1", "oval:focal:obj:1", "oval:focal:obj:10"}
+
+    @pytest.mark.parametrize(
+        "element_ids, expected_tags",
+        [
+            (["oval:focal:tst:1"], ["test"]),
+            (["oval:focal:obj:10000000000000007", "oval:focal:tst:1"], ["object", "test"]),
+            (["oval:focal:tst:1", "oval:focal:obj:1"], None),
+            (["oval:focal:ste:10000000000000008"], None),
+            (["oval:focal:tst:1", "oval:focal:ste:10000000000000008"], None),
+        ],
+    )
+    def test_get_many(self, element_ids, expected_tags):
+        """Test that get and get_many look the elements up by their regenerated IDs, and exit if an ID is missing or
+        given to more than one element"""
+        raw_xml_file = StringIO(
+            '<root><tests><test id="oval:focal:tst:1"><object object_ref="oval:focal:obj:1"/></test></tests>'
+            '<objects><object id="oval:focal:obj:1"/></objects>'
+            '<states><state id="oval:focal:ste:1"/><state id="oval:focal:ste:1"/></states></root>'
+        )
+        raw_xml_file.name = "test_xml.xml"
+        xml_file = XMLFile(raw_xml_file, {})
+        xml_file.regenerate_element_ids(iter([7, 8]), {"oval:focal:obj:1", "oval:focal:ste:1"})
+        xml_file.replace_element_ids_in_tree()
+        if expected_tags is None:
+            with pytest.raises(SystemExit):
+                xml_file.get_many(iter(element_ids))
+            with pytest.raises(SystemExit):
+                [xml_file.get(element_id) for element_id in element_ids]
+        else:
+            assert [element.tag for element in xml_file.get_many(iter(element_ids))] == expected_tags
+            assert [xml_file.get(element_id).tag for element_id in element_ids] == expected_tags
+            assert all(xml_file.get(element_id).get("id") == element_id for element_id in element_ids)
+
+    def test_get_referenced_elements_with_new_ids(self):
+        """Test that the new IDs are only put in place in the elements chosen to be written to the output file. The
+        other elements keep the IDs of the file, whether they are looked up by their new ID or searched in the tree"""
+        raw_xml_file = StringIO(
+            '<root><tests><test id="oval:focal:tst:1"><object object_ref="oval:focal:obj:1"/></test>'
+            '<test id="oval:focal:tst:2"><object object_ref="oval:focal:obj:1"/></test></tests>'
+            '<objects><object id="oval:focal:obj:1"/></objects></root>'
+        )
+        raw_xml_file.name = "test_xml.xml"
+        xml_file = XMLFile(raw_xml_file, {})
+        xml_file.regenerate_element_ids(iter([7, 8, 9]), {"oval:focal:tst:1", "oval:focal:tst:2", "oval:focal:obj:1"})
+        xml_file.type_to_referenced_ids_map["test"].update(
+            xml_file.id_interner.intern_all([("test", "oval:focal:tst:10000000000000007")])
+        )
+        assert [
+            ET.tostring(element, encoding="unicode") for element in xml_file.get_referenced_elements("./tests")
+        ] == [
+            '<test id="oval:focal:tst:10000000000000007"><object object_ref="oval:focal:obj:10000000000000009" />'
+            "</test>"
+        ]
+        assert xml_file.get("oval:focal:tst:20000000000000008").get("id") == "oval:focal:tst:2"
+        assert xml_file.get("oval:focal:obj:10000000000000009").get("id") == "oval:focal:obj:1"
+        assert xml_file.get_many(["oval:focal:obj:10000000000000009"]) == [
+            XMLUtils.find_element_by_id("oval:focal:obj:1", xml_file.xml_tree_root)
+        ]
+        with pytest.raises(SystemExit):
+            XMLUtils.find_element_by_id("oval:focal:obj:10000000000000009", xml_file.xml_tree_root)
+
+    def test_ids_of_type(self):
+        """Test that ids_of_type returns the IDs of the elements with the type in their OVAL IDs in document order"""
+        raw_xml_file = StringIO(
+            '<root><tests><test id="oval:focal:tst:2"/><test id="oval:focal:tst:1"/></tests>'
+            '<objects><object id="oval:focal:obj:1"/><object id="other:tst:3"/></objects></root>'
+        )
+        raw_xml_file.name = "test_xml.xml"
+        xml_file = XMLFile(raw_xml_file, {})
+        assert xml_file.ids_of_type("tst") == ["oval:focal:tst:2", "oval:focal:tst:1"]
+        assert xml_file.ids_of_type("obj") == ["oval:focal:obj:1"]
+        assert xml_file.ids_of_type("var") == []
+
+    def test_allocate_element_ids(self):
+        """Test that allocate_element_ids decides the new IDs without changing the tree, so that they can be replaced
+        later"""
+        raw_xml_file = StringIO('<root><object id="oval:focal:obj:1"/><object id="oval:focal:obj:2"/></root>')
+        raw_xml_file.name = "test_xml.xml"
+        xml_file = XMLFile(raw_xml_file, {})
+        global_input_id_set = {"oval:focal:obj:2"}
+        old_to_new_id_map = xml_file.allocate_element_ids(iter([7]), global_input_id_set)
+        assert old_to_new_id_map == {"oval:focal:obj:1": None, "oval:focal:obj:2": "oval:focal:obj:20000000000000007"}
+        assert global_input_id_set == {"oval:focal:obj:1", "oval:focal:obj:2"}
+        assert list(xml_file.id_to_element_map) == ["oval:focal:obj:1", "oval:focal:obj:2"]
+        xml_file.replace_element_ids(old_to_new_id_map)
+        assert list(xml_file.id_to_element_map) == ["oval:focal:obj:1", "oval:focal:obj:20000000000000007"]
+        assert xml_file.element_ids == []
+
     @pytest.mark.parametrize(
         ("raw_xml_file_name", "raw_xml_file_content", "expected_definition_element_strings"),
         [
@@ -56,13 +195,14 @@ class TestXMLFile:
     )
     def test_get_definition_trees(self, raw_xml_file_name, raw_xml_file_content, expected_definition_element_strings):
         """Test that get_definition_trees returns DefinitionTree objects with the right definition elements"""
-        mock_raw_xml_file = MagicMock(name=raw_xml_file_name)
-        mock_raw_xml_file.read.return_value = raw_xml_file_content
+        mock_raw_xml_file = StringIO(raw_xml_file_content)
+        mock_raw_xml_file.name = raw_xml_file_name
         xml_file = XMLFile(mock_raw_xml_file, {})
         actual_definition_element_strings = []
         for definition_tree in xml_file.get_definition_trees():
             definition_element_str = ET.tostring(definition_tree.definition_element, encoding="unicode")
             actual_definition_element_strings += [definition_element_str]
+            assert definition_tree.id_to_referenced_ids_map is xml_file.id_to_referenced_ids_map
         assert sorted(actual_definition_element_strings) == sorted(expected_definition_element_strings)
 
     @pytest.mark.parametrize(
@@ -84,46 +224,47 @@ class TestXMLFile:
         """Make sure get_referenced_elements returns a sorted list of referenced element identifiers for given path"""
         xml_file = XMLFile(MagicMock(), {})
         xml_file.id_to_element_map = id_to_element_map
-        xml_file.type_to_referenced_ids_map = type_to_referenced_ids
+        for ref_type, element_ids in type_to_referenced_ids.items():
+            xml_file.type_to_referenced_ids_map[ref_type] = set(
+                xml_file.id_interner.intern_all((ref_type, element_id) for element_id in element_ids)
+            )
         for path, expected_element_ids in zip(test_paths, expected_element_ids_arr):
             actual_referenced_element_ids = xml_file.get_referenced_elements(path)
             assert expected_element_ids == actual_referenced_element_ids
 
     @pytest.mark.parametrize(
-        "mock_xml_file_content, expected_results",
+        "xml_file_content, ns_prefix_map, expected_results",
         [
             (
-                [
-                    '<oval_definitions xmlns="http://oval.mitre.org/XMLSchema/oval-definitions-5" '
-                    'xmlns:ind-def="http://oval.mitre.org/XMLSchema/oval-definitions-5#independent" '
-                    'xmlns:oval="http://oval.mitre.org/XMLSchema/oval-common-5" '
-                    'xsi:schemaLocation="http://oval.mitre.org/XMLSchema/oval-common-5 oval-common-schema.xsd">'
-                ],
+                '<oval_definitions xmlns="http://oval.mitre.org/XMLSchema/oval-definitions-5" '
+                'xmlns:ind-def="http://oval.mitre.org/XMLSchema/oval-definitions-5#independent" '
+                'xmlns:oval="http://oval.mitre.org/XMLSchema/oval-common-5" '
+                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:schemaLocation="http://oval.mitre.org/XMLSchema/oval-common-5 oval-common-schema.xsd"/>',
+                {},
                 {
                     "": "http://oval.mitre.org/XMLSchema/oval-definitions-5",
                     "ind-def": "http://oval.mitre.org/XMLSchema/oval-definitions-5#independent",
                     "oval": "http://oval.mitre.org/XMLSchema/oval-common-5",
+                    "xsi": "http://www.w3.org/2001/XMLSchema-instance",
                 },
             ),
             (
-                [
-                    "<oval_definitions "
-                    'xsi:schemaLocation="http://oval.mitre.org/XMLSchema/oval-common-5 oval-common-schema.xsd">'
-                ],
-                {},
+                '<oval_definitions xmlns:oval="urn:oval-common" xmlns:Local_NS="local-namespace"/>',
+                {"oval": "http://oval.mitre.org/XMLSchema/oval-common-5", "other": "urn:other"},
+                {"oval": "urn:oval-common", "Local_NS": "local-namespace", "other": "urn:other"},
             ),
+            ("<oval_definitions/>", {}, {}),
         ],
     )
-    @mock.patch.object(XMLUtils, "get_xml_root", new=MagicMock())
-    @mock.patch.object(XMLUtils, "generate_id_map", new=MagicMock())
-    def test_update_namespace_map(self, mock_xml_file_content, expected_results):
+    def test_update_namespace_map(self, xml_file_content, ns_prefix_map, expected_results):
         """Test that update_namespace_map updates the ns_prefix_map
         with new namespaces and their prefixes from the passed in XML file
         """
-        mock_xml_file = MagicMock(name="test_xml.xml")
-        mock_xml_file.__iter__.return_value = mock_xml_file_content
-        mock_xml_file.read.return_value = "".join(mock_xml_file_content)
-        xml_file = XMLFile(mock_xml_file, {})
+        raw_xml_file = StringIO(xml_file_content)
+        raw_xml_file.name = "test_xml.xml"
+        xml_file = XMLFile(raw_xml_file, ns_prefix_map)
+        raw_xml_file.close()  # The namespaces must have been collected while parsing, the file is not read again
         xml_file.update_namespace_map()
         assert xml_file.ns_prefix_map == expected_results
 
@@ -161,6 +302,45 @@ class TestXMLFile:
             mock_update_ns_map.assert_called()
             mock_reg_ns.assert_called()
 
+    @pytest.mark.parametrize(
+        "xml_engine",
+        [
+            XMLEngine(),
+            pytest.param(
+                LXMLEngine(),
+                marks=pytest.mark.skipif(not XMLEngine.is_lxml_available(), reason="lxml is not installed"),
+            ),
+        ],
+    )
+    def test_copy_skeleton(self, xml_engine):
+        """Test that copy_skeleton returns the same tree as the file parsed again and cleared, leaving the file as is"""
+        xml_file_content = (
+            '<root xmlns="urn:default" xmlns:oval="urn:oval" schema="1">\n  '
+            '<generator><oval:product_name attr="x">Name</oval:product_name></generator>\n  '
+            '<tests a="b">\n    <test id="oval:x:tst:1"/>\n  </tests>\n  '
+            '<objects><object id="oval:x:obj:1"/></objects>\n'
+            "</root>"
+        )
+        paths_to_clear = ["./tests", "./objects"]
+        xml_files = []
+        for _ in range(2):
+            raw_xml_file = StringIO(xml_file_content)
+            raw_xml_file.name = "test_xml.xml"
+            xml_files.append(XMLFile(raw_xml_file, {}, xml_engine))
+        xml_file, expected_xml_file = xml_files
+        skeleton_xml_file = xml_file.copy_skeleton(paths_to_clear)
+        for xml_file_to_clear in (skeleton_xml_file, expected_xml_file):
+            xml_file_to_clear.update_namespace_map()
+            xml_file_to_clear.clear_elements(paths_to_clear)
+        assert skeleton_xml_file.name == xml_file.name
+        assert skeleton_xml_file.namespace_map == xml_file.namespace_map
+        assert skeleton_xml_file.xml_tree_root is not xml_file.xml_tree_root
+        skeleton_output, expected_output = StringIO(), StringIO()
+        skeleton_xml_file.dump_to_file(skeleton_output)
+        expected_xml_file.dump_to_file(expected_output)
+        assert skeleton_output.getvalue() == expected_output.getvalue()
+        assert [len(section) for section in xml_file.xml_tree_root] == [1, 1, 1]
+
     @pytest.mark.parametrize(
         ("xml_file_content", "paths_to_clear", "expected_output_xml"),
         [
@@ -177,8 +357,8 @@ class TestXMLFile:
     )
     def test_clear_elements(self, xml_file_content, paths_to_clear, expected_output_xml):
         """Test that clear elements clears the specified element paths from the input XML"""
-        raw_xml_file = MagicMock(name="test_xml.xml")
-        raw_xml_file.read.return_value = xml_file_content
+        raw_xml_file = StringIO(xml_file_content)
+        raw_xml_file.name = "test_xml.xml"
         xml_file = XMLFile(raw_xml_file, {})
         xml_file.clear_elements(paths_to_clear)
         assert ET.tostring(xml_file.xml_tree_root, encoding="unicode") == expected_output_xml
@@ -208,8 +388,8 @@ class TestXMLFile:
         """Test that append_element_to_path appends the input elements at the right place based on the given path
         in the input XML
         """
-        raw_xml_file = MagicMock(name="test_xml.xml")
-        raw_xml_file.read.return_value = raw_xml_file_content
+        raw_xml_file = StringIO(raw_xml_file_content)
+        raw_xml_file.name = "test_xml.xml"
         xml_file = XMLFile(raw_xml_file, {})
         for path, element in zip(append_at_paths, elements_to_append):
             xml_file.append_element_to_path(path, ET.fromstring(element))
@@ -244,8 +424,8 @@ class TestXMLFile:
         """Test that extend_element_at_path appends the sequence of input elements at the right place based on the
         given path in the input XML
         """
-        raw_xml_file = MagicMock(name="test_xml.xml")
-        raw_xml_file.read.return_value = raw_xml_file_content
+        raw_xml_file = StringIO(raw_xml_file_content)
+        raw_xml_file.name = "test_xml.xml"
         xml_file = XMLFile(raw_xml_file, {})
         for path, elements in zip(extend_at_paths, seq_elements_to_extend):
             xml_file.extend_element_at_path(path, elements)
@@ -253,23 +433,60 @@ class TestXMLFile:
         assert ET.tostring(xml_file.xml_tree_root, encoding="unicode") == expected_output_xml
 
     @pytest.mark.parametrize(
-        ("raw_xml_file_content", "sys_exit_called"),
+        "xml_engine",
         [
-            ('<root><def id="1"/><def id="2"/></root>', False),
-            ('<root><def id="1"/><def id="1"/></root>', True),
+            XMLEngine(),
+            pytest.param(
+                LXMLEngine(),
+                marks=pytest.mark.skipif(not XMLEngine.is_lxml_available(), reason="lxml is not installed"),
+            ),
         ],
     )
-    @mock.patch("oval_xml_feed_merge.xml_file.sys.exit")
-    def test_validate_xml_ids(self, mock_sys_exit, raw_xml_file_content, sys_exit_called):
-        """Test that validate_xml_ids calls sys.exit when the XML file has duplicate ids"""
-        raw_xml_file = MagicMock(name="test_xml.xml")
-        raw_xml_file.read.return_value = raw_xml_file_content
+    def test_find_element(self, xml_engine):
+        """Test that find_element resolves unprefixed paths to the default namespace with every engine"""
+        raw_xml_file = StringIO(
+            '<root xmlns="urn:default" xmlns:oval="urn:oval"><definitions><oval:title>pkg</oval:title></definitions>'
+            "</root>"
+        )
+        raw_xml_file.name = "test_xml.xml"
+        xml_file = XMLFile(raw_xml_file, {}, xml_engine)
+        xml_file.update_namespace_map()
+        assert xml_file.find_element("./definitions").tag == "{urn:default}definitions"
+        assert xml_file.find_element("./definitions/oval:title").text == "pkg"
+
+    @pytest.mark.parametrize(
+        ("raw_xml_file_content", "elements_to_append", "expected_duplicate_id_to_source_names"),
+        [
+            ('<root><defs><def id="1"/></defs><gen id="0"/></root>', [("a.xml", ["2"]), ("b.xml", ["3", "4"])], {}),
+            (
+                '<root><defs><def id="1"/></defs><gen id="0"/></root>',
+                [("a.xml", ["1"]), ("b.xml", ["1", "0", "2"]), ("b.xml", ["2", "1"])],
+                {"1": ["a.xml", "b.xml", "b.xml"], "0": ["test_xml.xml", "b.xml"], "2": ["b.xml", "b.xml"]},
+            ),
+        ],
+    )
+    @mock.patch("oval_xml_feed_merge.duplicate_id_detector.logging.critical")
+    def test_validate_xml_ids(
+        self, mock_log_critical, raw_xml_file_content, elements_to_append, expected_duplicate_id_to_source_names
+    ):
+        """Test that validate_xml_ids reports every id given to more than one element of the cleared file or added to
+        it, with the files of the elements, then exits"""
+        raw_xml_file = StringIO(raw_xml_file_content)
+        raw_xml_file.name = "test_xml.xml"
         xml_file = XMLFile(raw_xml_file, {})
-        xml_file.validate_xml_ids()
-        if sys_exit_called:
-            mock_sys_exit.assert_called()
+        xml_file.clear_elements(["./defs"])
+        for source_name, element_ids in elements_to_append:
+            elements = [ET.Element("def", id=element_id) for element_id in element_ids]
+            xml_file.append_element_to_path("./defs", elements[0], source_name)
+            xml_file.extend_element_at_path("./defs", elements[1:], source_name)
+        assert xml_file.duplicate_id_detector.duplicate_id_to_source_names == expected_duplicate_id_to_source_names
+        if expected_duplicate_id_to_source_names:
+            with pytest.raises(SystemExit):
+                xml_file.validate_xml_ids()
+            assert mock_log_critical.call_count == len(expected_duplicate_id_to_source_names)
         else:
-            mock_sys_exit.assert_not_called()
+            xml_file.validate_xml_ids()
+            mock_log_critical.assert_not_called()
 
     @pytest.mark.parametrize(
         ("raw_xml_file_content", "expected_xml_string"),
@@ -284,8 +501,8 @@ class TestXMLFile:
         """Test that dump_to_file calls write on the output file object
         with the expected XML string
         """
-        raw_xml_file = MagicMock(name="test_xml.xml")
-        raw_xml_file.read.return_value = raw_xml_file_content
+        raw_xml_file = StringIO(raw_xml_file_content)
+        raw_xml_file.name = "test_xml.xml"
         mock_output_file = MagicMock()
         xml_file = XMLFile(raw_xml_file, {})
         xml_file.dump_to_file(mock_output_file)
@@ -0,0 +1,221 @@
+from io import BytesIO, StringIO
+from unittest import mock
+
+import pytest
+import xml.etree.ElementTree as ET
+
+from oval_xml_feed_merge.index_cache import IndexCache
+from oval_xml_feed_merge.xml_engine import LXMLEngine, XMLEngine
+from oval_xml_feed_merge.xml_file import XMLFile
+from oval_xml_feed_merge.xml_file_index import IndexedOutputXMLFile, XMLFileIndex, XMLFileIndexBuilder
+from tests.conftest import requires_lxml
+
+
+XML_STRING = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<oval_definitions xmlns="urn:default" xmlns:oval="urn:oval">\n'
+    "  <generator><oval:product_name>Generator é</oval:product_name></generator>\n"
+    "  <definitions>\n"
+    '    <definition id="oval:x:def:1" class="inventory"><metadata><title>inv</title></metadata></definition>\n'
+    '    <definition id="oval:x:def:2" class="vulnerability"><metadata><title>docker.io</title></metadata>'
+    '<criteria><criterion test_ref="oval:x:tst:1"/><extend_definition definition_ref="oval:x:def:1"/>'
+    "</criteria></definition>\n"
+    "  </definitions>\n"
+    '  <tests xmlns:linux="urn:linux">\n'
+    '    <linux:test id="oval:x:tst:1"><linux:object object_ref="oval:x:obj:1"/></linux:test>\n'
+    "  </tests>\n"
+    "  <objects>\n"
+    '    <object id="oval:x:obj:1"><name var_ref="oval:x:var:1"/></object>\n'
+    "  </objects>\n"
+    "  <variables>\n"
+    '    <variable id="oval:x:var:1"><value>oval:x:var:1</value></variable>\n'
+    "  </variables>\n"
+    "</oval_definitions>"
+)
+
+
+def _raw_xml_file(xml_string: str = XML_STRING, binary: bool = False):
+    """Return an in-memory input file with a name, like the files opened by the CLI"""
+    raw_xml_file = BytesIO(xml_string.encode("utf-8")) if binary else StringIO(xml_string)
+    raw_xml_file.name = "test.xml"
+    return raw_xml_file
+
+
+class TestXMLFileIndex:
+    @staticmethod
+    def _index(raw_xml_file=None, xml_engine=None) -> XMLFileIndex:
+        return XMLFileIndex(raw_xml_file or _raw_xml_file(), {"": "urn:default", "oval": "urn:oval"}, xml_engine)
+
+    @pytest.mark.parametrize("binary", [False, True], ids=["text", "binary"])
+    @pytest.mark.parametrize("read_size", [1, 65536])
+    def test_ctor(self, binary, read_size):
+        """Test that the constructor indexes the sections and elements of the file at their byte offsets, along with
+        the namespaces declared in the file and the same reference index XMLFile builds"""
+        with mock.patch.object(XMLFileIndexBuilder, "read_size", read_size):
+            xml_file_index = self._index(_raw_xml_file(binary=binary))
+        xml_bytes = XML_STRING.encode("utf-8")
+        xml_file = XMLFile(_raw_xml_file(), {})
+        assert xml_file_index.namespace_map == {"": "urn:default", "oval": "urn:oval", "linux": "urn:linux"}
+        assert xml_file_index.root_tag == "{urn:default}oval_definitions"
+        assert [section.tag.split("}")[1] for section in xml_file_index.sections] == [
+            "generator",
+            "definitions",
+            "tests",
+            "objects",
+            "variables",
+        ]
+        generator_section = xml_file_index.sections[0]
+        assert xml_bytes[generator_section.start : generator_section.end].decode("utf-8") == (
+            "<generator><oval:product_name>Generator é</oval:product_name></generator>\n  "
+        )
+        test_element = xml_file_index.id_to_element_map["oval:x:tst:1"]
+        assert xml_bytes[test_element.start : test_element.end].decode("utf-8") == (
+            '<linux:test id="oval:x:tst:1"><linux:object object_ref="oval:x:obj:1"/></linux:test>\n  '
+        )
+        assert test_element.namespace_uris == ("urn:linux",)
+        assert test_element.section.scope == {"": "urn:default", "oval": "urn:oval", "linux": "urn:linux"}
+        assert xml_file_index.element_ids == list(xml_file.id_to_element_map)
+        assert xml_file_index.id_to_referenced_ids_map == xml_file.id_to_referenced_ids_map
+
+    def test_get_definition_trees(self):
+        """Test that get_definition_trees skips "inventory" definitions and takes the package names from the index"""
+        definition_trees = list(self._index().get_definition_trees())
+        assert [definition_tree.pkg_name for definition_tree in definition_trees] == ["docker.io"]
+        definition_trees[0].build_referenced_elements_tree()
+        id_interner = definition_trees[0].id_interner
+        assert {
+            ref_type: set(id_interner.get_ids(handles))
+            for ref_type, handles in definition_trees[0].local_type_to_referenced_ids_map.items()
+        } == {
+            "definition": {"oval:x:def:1"},
+            "test": {"oval:x:tst:1"},
+            "object": {"oval:x:obj:1"},
+            "var": {"oval:x:var:1"},
+        }
+
+    def test_get_many(self):
+        """Test that get, get_many and ids_of_type look the indexed elements up by their regenerated IDs, and that get
+        and get_many exit if an ID is missing or given to more than one element, even one in the tree of another"""
+        xml_string = XML_STRING.replace(
+            '<linux:object object_ref="oval:x:obj:1"/>', '<linux:object id="oval:x:var:1" object_ref="oval:x:obj:1"/>'
+        )
+        xml_file_index = self._index(_raw_xml_file(xml_string))
+        assert xml_file_index.duplicate_ids == {"oval:x:var:1"}
+        xml_file_index.regenerate_element_ids(iter([7, 8]), {"oval:x:tst:1", "oval:x:var:1"})
+        new_test_id, new_variable_id = "oval:x:tst:10000000000000007", "oval:x:var:10000000000000008"
+        assert xml_file_index.duplicate_ids == {new_variable_id}
+        element_ids = [new_test_id, "oval:x:obj:1"]
+        assert [element.get("id") for element in xml_file_index.get_many(iter(element_ids))] == element_ids
+        assert [xml_file_index.get(element_id).get("id") for element_id in element_ids] == element_ids
+        assert xml_file_index.ids_of_type("tst") == [new_test_id]
+        assert xml_file_index.ids_of_type("def") == ["oval:x:def:1", "oval:x:def:2"]
+        for element_ids in (["oval:x:tst:1"], [new_test_id, new_variable_id]):
+            with pytest.raises(SystemExit):
+                xml_file_index.get_many(element_ids)
+            with pytest.raises(SystemExit):
+                [xml_file_index.get(element_id) for element_id in element_ids]
+
+    def test_get_element_ids(self):
+        """Test that get_element_ids returns the regenerated IDs in the trees of the indexed elements, that the IDs at
+        any depth are counted, and that the methods of the files parsed into a tree are not exposed by the index"""
+        xml_string = XML_STRING.replace(
+            '<linux:object object_ref="oval:x:obj:1"/>', '<linux:object id="oval:x:ste:1" object_ref="oval:x:obj:1"/>'
+        )
+        xml_file_index = self._index(_raw_xml_file(xml_string))
+        xml_file_index.regenerate_element_ids(iter([7, 8]), {"oval:x:tst:1", "oval:x:ste:1"})
+        new_test_id, new_state_id = "oval:x:tst:10000000000000007", "oval:x:ste:10000000000000008"
+        elements = xml_file_index.get_many([new_test_id, "oval:x:obj:1"])
+        assert xml_file_index.get_element_ids(elements) == [new_test_id, new_state_id, "oval:x:obj:1"]
+        assert xml_file_index.get_element_id_count() == 6
+        for name in ("copy_skeleton", "clear_elements", "duplicate_id_detector", "replace_element_ids_in_elements"):
+            assert not hasattr(xml_file_index, name)
+
+    @pytest.mark.parametrize("xml_engine", [XMLEngine(), pytest.param(LXMLEngine(), marks=requires_lxml)])
+    def test_regenerate_element_ids(self, xml_engine):
+        """Test that regenerate_element_ids gives new IDs to the elements seen in a preceding file, both in the index
+        and in the elements and sections read from the file"""
+        xml_file_index = self._index(xml_engine=xml_engine)
+        xml_file_index.regenerate_element_ids(iter(range(10)), {"oval:x:obj:1", "oval:x:var:1"})
+        new_object_id, new_variable_id = "oval:x:obj:10000000000000000", "oval:x:var:10000000000000001"
+        assert xml_file_index.old_to_new_id_map == {"oval:x:obj:1": new_object_id, "oval:x:var:1": new_variable_id}
+        assert xml_file_index.id_to_referenced_ids_map["oval:x:tst:1"] == [("object", new_object_id)]
+        object_element = xml_file_index.id_to_element_map[new_object_id]
+        assert object_element.get("id") == new_object_id
+        variable_element = xml_file_index.id_to_element_map[new_variable_id]
+        elements = xml_file_index.read_elements([variable_element])
+        assert [ET.tostring(element, encoding="unicode") for element in elements] == [
+            '<ns0:variable xmlns:ns0="urn:default" id="{0}"><ns0:value>{0}</ns0:value></ns0:variable>\n  '.format(
+                new_variable_id
+            )
+        ]
+        (tests_section,) = xml_file_index.read_sections([xml_file_index.sections[2]])
+        assert [child.get("object_ref") for child in tests_section.iter() if child.get("object_ref")] == [new_object_id]
+
+    def test_build_index_cached(self, tmp_path):
+        """Test that an index loaded from the cache is the same as the index built by parsing the file"""
+        index_cache = IndexCache(str(tmp_path), 1048576)
+        built_index = XMLFileIndex(_raw_xml_file(), {"": "urn:default"}, index_cache=index_cache)
+        with mock.patch.object(XMLFileIndexBuilder, "build") as mock_build:
+            cached_index = XMLFileIndex(_raw_xml_file(), {"": "urn:default"}, index_cache=index_cache)
+        mock_build.assert_not_called()
+        for name in XMLFileIndex.cached_attributes:
+            if name not in ("sections", "id_to_element_map"):
+                assert getattr(cached_index, name) == getattr(built_index, name)
+        assert [(section.tag, section.start, section.end) for section in cached_index.sections] == [
+            (section.tag, section.start, section.end) for section in built_index.sections
+        ]
+        for element_id, element in cached_index.id_to_element_map.items():
+            built_element = built_index.id_to_element_map[element_id]
+            assert element.xml_file_index is cached_index
+            assert element.section in cached_index.sections
+            assert (element.start, element.end, element.namespace_uris) == (
+                built_element.start,
+                built_element.end,
+                built_element.namespace_uris,
+            )
+        assert [definition_tree.pkg_name for definition_tree in cached_index.get_definition_trees()] == ["docker.io"]
+
+    def test_get_definition_trees_missing_pkg_name(self):
+        """Test that get_definition_trees exits when a definition has no package name"""
+        xml_file_index = XMLFileIndex(_raw_xml_file("<root><definitions><definition/></definitions></root>"), {})
+        with pytest.raises(SystemExit):
+            list(xml_file_index.get_definition_trees())
+
+
+class TestIndexedOutputXMLFile:
+    @pytest.mark.parametrize(
+        "paths_to_append, sys_exit_called",
+        [
+            (["./tests"], False),
+            (["./tests", "./tests"], True),
+        ],
+    )
+    @mock.patch("sys.exit")
+    def test_validate_xml_ids(self, mock_sys_exit, paths_to_append, sys_exit_called):
+        """Test that validate_xml_ids exits when an element is written to the output more than once"""
+        xml_file_index = XMLFileIndex(_raw_xml_file(), {"": "urn:default"})
+        output_xml_file = IndexedOutputXMLFile(xml_file_index, {"": "urn:default"})
+        output_xml_file.clear_elements(["./tests"])
+        for path in paths_to_append:
+            output_xml_file.append_element_to_path(path, xml_file_index.id_to_element_map["oval:x:tst:1"])
+        output_xml_file.validate_xml_ids()
+        assert mock_sys_exit.called == sys_exit_called
+
+    @pytest.mark.parametrize("batch_size", [1, 1048576])
+    def test_dump_to_file(self, batch_size):
+        """Test that the output written from the index is identical to the one XMLFile writes for the same tree"""
+        ns_prefix_map = {"": "urn:default", "oval": "urn:oval"}
+        xml_file = XMLFile(_raw_xml_file(), ns_prefix_map)
+        xml_file.clear_elements(["./definitions", "./tests"])
+        xml_file.extend_element_at_path("./definitions", [xml_file.id_to_element_map["oval:x:def:2"]])
+        expected_output_file = StringIO()
+        xml_file.dump_to_file(expected_output_file)
+
+        xml_file_index = XMLFileIndex(_raw_xml_file(), ns_prefix_map)
+        output_xml_file = IndexedOutputXMLFile(xml_file_index, ns_prefix_map)
+        output_xml_file.clear_elements(["./definitions", "./tests"])
+        output_xml_file.extend_element_at_path("./definitions", [xml_file_index.id_to_element_map["oval:x:def:2"]])
+        output_file = StringIO()
+        with mock.patch.object(IndexedOutputXMLFile, "batch_size", batch_size):
+            output_xml_file.dump_to_file(output_file)
+        assert output_file.getvalue() == expected_output_file.getvalue()
@@ -1,6 +1,5 @@
 from io import StringIO
 from unittest import mock
-from unittest.mock import MagicMock
 
 import pytest
 
@@ -9,22 +8,26 @@ import xml.etree.ElementTree as ET
 
 
 class TestXMLUtils:
-    @staticmethod
-    def _mock_multiprocessing_pool_map(func, it, chunksize):
-        print("Input", it)
-        return map(func, it)
-
     def test_get_xml_root(self):
         """Test that XMLUtils.get_xml_root reads the passed in XML file and returns an XML root element object
-        of the XML string read from the file
+        of the XML string read from the file, and collects the namespaces declared in the file
         """
-        xml_string = "<root><child>Content</child></root>"
+        xml_string = (
+            '<root xmlns="urn:oval:default" xmlns:oval="http://oval.mitre.org/XMLSchema/oval-common-5">'
+            '<child xmlns:Nested_NS="urn:nested">Content</child>'
+            "</root>"
+        )
         expected = ET.fromstring(xml_string)
-        mock_xml_file = MagicMock()
-        mock_xml_file.read.return_value = xml_string
-        actual = XMLUtils.get_xml_root(mock_xml_file)
+        xml_file = StringIO(xml_string)
+        xml_file.read()  # Move the file position to the end, get_xml_root must rewind it
+        namespace_map = {}
+        actual = XMLUtils.get_xml_root(xml_file, namespace_map)
         assert ET.tostring(actual) == ET.tostring(expected)
-        mock_xml_file.seek.assert_called_with(0)
+        assert namespace_map == {
+            "": "urn:oval:default",
+            "oval": "http://oval.mitre.org/XMLSchema/oval-common-5",
+            "Nested_NS": "urn:nested",
+        }
 
     @pytest.mark.parametrize(
         "id_to_search, xml_tree, expected_element",
@@ -62,69 +65,77 @@ class TestXMLUtils:
         }
 
     @pytest.mark.parametrize(
-        "input_file_content, input_file_name, input_global_input_id_set, expected_content_after_test",
+        "xml_tree, expected_id_to_referenced_ids_map",
         [
             (
-                "<root>"
-                '<test id="oval:focal.tst:1234" >A test element</test>'
-                '<var id="oval:focal.var:4567" >A var element</var>'
-                "</root>",
-                "random.xml",
-                {"oval:focal.tst:1234"},
-                "<root>"
-                '<test id="oval:focal.tst:12340000000000000001" >A test element</test>'
-                '<var id="oval:focal.var:4567" >A var element</var>'
-                "</root>",
-            ),
+                ET.fromstring(
+                    '<root var_ref="ignored">'
+                    '<tests><test id="1"><object object_ref="2"/><state state_ref="3"/></test></tests>'
+                    '<objects><object id="2"><var_ref>4</var_ref><nested id="5" test_ref="1"/></object></objects>'
+                    '<states><state id="3"/><state id="3" var_ref="4"/></states>'
+                    "</root>"
+                ),
+                {
+                    "1": [("object", "2"), ("state", "3")],
+                    "2": [("var", "4"), ("test", "1")],
+                    "5": [("test", "1")],
+                    "3": [("var", "4")],
+                },
+            )
         ],
     )
-    def test_as_string_io_with_regenerated_ids(
-        self, input_file_content, input_file_name, input_global_input_id_set, expected_content_after_test
-    ):
-        """Test that as_string_io_with_regenerated_ids regenerates IDs and returns a StringIO object"""
-        input_file = StringIO(input_file_content)
-        input_file.name = input_file_name
-
-        def int_gen():
-            while True:
-                yield 1
+    def test_generate_id_map_with_references(self, xml_tree, expected_id_to_referenced_ids_map):
+        """Test that generate_id_map indexes the references found in the tree of every element with an "id",
+        including those of descendants with an "id" of their own, keeping the last element for a duplicate ID, and
+        records the identifiers nested in the tree of every child of a section"""
+        actual_id_to_referenced_ids_map = {}
+        actual_duplicate_ids = set()
+        actual_id_to_nested_ids_map = {}
+        actual_map = XMLUtils.generate_id_map(
+            xml_tree, actual_id_to_referenced_ids_map, actual_duplicate_ids, None, actual_id_to_nested_ids_map
+        )
+        assert list(actual_map.keys()) == ["1", "2", "5", "3"]
+        assert actual_map["3"].get("var_ref") == "4"
+        assert actual_id_to_referenced_ids_map == expected_id_to_referenced_ids_map
+        assert actual_duplicate_ids == {"3"}
+        assert actual_id_to_nested_ids_map == {"2": ["5"]}
 
-        result: StringIO = XMLUtils.as_string_io_with_regenerated_ids(input_file, int_gen(), input_global_input_id_set)
-        assert result.getvalue() == expected_content_after_test
-        assert result.name == input_file_name
-        assert type(result) == StringIO
+    @pytest.mark.parametrize(
+        "element, expected_ref_ids",
+        [
+            (ET.fromstring('<tests var_ref="var1" >' '<test object_ref="object1"/>' "</tests>"), [("var", "var1")]),
+            (ET.fromstring("<state_ref>state1</state_ref>"), [("state", "state1")]),
+            (ET.fromstring('<object id="obj1" comment="not_ref"/>'), []),
+        ],
+    )
+    def test_find_refs_in_element(self, element, expected_ref_ids):
+        """Test that find_refs_in_element finds all referenced identifiers in a given element"""
+        actual_ref_ids = []
+        XMLUtils.find_refs_in_element(element, actual_ref_ids)
+        assert sorted(actual_ref_ids) == sorted(expected_ref_ids)
 
     @pytest.mark.parametrize(
-        "input_file_content, input_file_name, input_global_input_id_set, expected_content_after_test",
+        "xml_tree, expected_element_ids",
         [
             (
-                "<root>"
-                '<test id="oval:focal.tst:1234" >A test element</test>'
-                '<var id="oval:focal.var:4567" >A var element</var>'
-                "</root>",
-                "random.xml",
-                {"oval:focal.tst:1234", "oval:focal.var:4567"},
-                "<root>"
-                '<test id="oval:focal.tst:12340000000000000001" >A test element</test>'
-                '<var id="oval:focal.var:45670000000000000001" >A var element</var>'
-                "</root>",
-            ),
+                ET.fromstring(
+                    "<root>"
+                    '<test id="oval:focal.tst:1234" >A test element</test>'
+                    '<var id="oval:focal.var:4567"><value id="not-an-oval-id"/></var>'
+                    '<test id="oval:focal.tst:1234" >A duplicate element</test>'
+                    '<test test_ref="oval:focal.tst:1234"/>'
+                    "</root>"
+                ),
+                ["oval:focal.tst:1234", "oval:focal.var:4567", "oval:focal.tst:1234"],
+            )
         ],
     )
-    def test_regenerate_ids(
-        self, input_file_content, input_file_name, input_global_input_id_set, expected_content_after_test
-    ):
-        """Test that regenerate_ids regenerates IDs and returns a str object"""
-        input_file = StringIO(input_file_content)
-        input_file.name = input_file_name
-
-        def int_gen():
-            while True:
-                yield 1
-
-        result: str = XMLUtils.regenerate_and_replace_ids(input_file, int_gen(), input_global_input_id_set)
-        assert result == expected_content_after_test
-        assert type(result) == str
+    def test_generate_id_map_with_oval_element_ids(self, xml_tree, expected_element_ids):
+        """Test that generate_id_map collects all OVAL IDs in document order in its pass over the tree, including
+        duplicates"""
+        actual_element_ids = []
+        XMLUtils.generate_id_map(xml_tree, oval_element_ids=actual_element_ids)
+        assert actual_element_ids == expected_element_ids
 
     @pytest.mark.parametrize(
         "input_file_line, input_current_file_old_to_new_id_map, expected_return_value",
@@ -136,6 +147,18 @@ class TestXMLUtils:
                 '<test id="oval:focal.tst:12340000000000000001" >A test element</test>'
                 '<var ref_id="oval:focal.tst:12340000000000000001" >A var element</var>',
             ),
+            (
+                '<test id="oval:com.ubuntu.jammy:tst:1" >A test element</test>'
+                '<test id="oval:com.ubuntu.jammy:tst:10" >Another test element</test>'
+                "<test_ref>oval:com.ubuntu.jammy:tst:1</test_ref>",
+                {
+                    "oval:com.ubuntu.jammy:tst:1": "oval:com.ubuntu.jammy:tst:10000000000000002",
+                    "oval:com.ubuntu.jammy:tst:10": None,
+                },
+                '<test id="oval:com.ubuntu.jammy:tst:10000000000000002" >A test element</test>'
+                '<test id="oval:com.ubuntu.jammy:tst:10" >Another test element</test>'
+                "<test_ref>oval:com.ubuntu.jammy:tst:10000000000000002</test_ref>",
+            ),
         ],
     )
     def test_replace_element_ids(self, input_file_line, input_current_file_old_to_new_id_map, expected_return_value):
@@ -146,23 +169,96 @@ class TestXMLUtils:
         assert type(result) == str
 
     @pytest.mark.parametrize(
-        "input_file_content, file_name, expected_id_map",
+        "xml_tree_string, input_current_file_old_to_new_id_map, expected_xml_tree_string",
         [
             (
                 "<root>"
-                '<test id="oval:focal.tst:1234" >A test element</test>'
+                '<test id="oval:focal.tst:1234" comment="Refers to oval:focal.tst:1234">A test element</test>'
                 '<var id="oval:focal.var:4567" >A var element</var>'
+                '<test id="oval:focal.tst:12345" >'
+                '<object object_ref="oval:focal.tst:1234"/>oval:focal.tst:1234'
+                "<var_ref>oval:focal.var:4567</var_ref>"
+                "</test>"
                 "</root>",
+                {
+                    "oval:focal.tst:1234": "oval:focal.tst:12340000000000000001",
+                    "oval:focal.var:4567": None,
+                    "oval:focal.tst:12345": None,
+                },
+                "<root>"
+                '<test id="oval:focal.tst:12340000000000000001" '
+                'comment="Refers to oval:focal.tst:12340000000000000001">A test element</test>'
+                '<var id="oval:focal.var:4567">A var element</var>'
+                '<test id="oval:focal.tst:12345">'
+                '<object object_ref="oval:focal.tst:12340000000000000001" />oval:focal.tst:12340000000000000001'
+                "<var_ref>oval:focal.var:4567</var_ref>"
+                "</test>"
+                "</root>",
+            ),
+        ],
+    )
+    def test_replace_element_ids_in_tree(
+        self, xml_tree_string, input_current_file_old_to_new_id_map, expected_xml_tree_string
+    ):
+        """Test that replace_element_ids_in_tree replaces IDs in the attributes, text and tails of the XML tree"""
+        xml_tree = ET.fromstring(xml_tree_string)
+        XMLUtils.replace_element_ids_in_tree(input_current_file_old_to_new_id_map, xml_tree)
+        assert ET.tostring(xml_tree, encoding="unicode") == expected_xml_tree_string
+
+    @pytest.mark.parametrize(
+        "current_file_old_to_new_id_map, id_to_referenced_ids_map, expected_id_to_referenced_ids_map",
+        [
+            (
+                {"oval:a:tst:1": None, "oval:a:obj:1": "oval:a:obj:10000000000000000"},
+                {
+                    "oval:a:tst:1": [("object", "oval:a:obj:1"), ("var", None)],
+                    "oval:a:obj:1": [("var", " oval:a:obj:1")],
+                },
+                {
+                    "oval:a:tst:1": [("object", "oval:a:obj:10000000000000000"), ("var", None)],
+                    "oval:a:obj:10000000000000000": [("var", " oval:a:obj:10000000000000000")],
+                },
+            ),
+            (
+                {"oval:a:tst:1": None},
+                {"oval:a:tst:1": [("object", "oval:a:obj:1")]},
+                {"oval:a:tst:1": [("object", "oval:a:obj:1")]},
+            ),
+        ],
+    )
+    def test_replace_element_ids_in_reference_map(
+        self, current_file_old_to_new_id_map, id_to_referenced_ids_map, expected_id_to_referenced_ids_map
+    ):
+        """Test that replace_element_ids_in_reference_map gives the indexed elements and references their new IDs"""
+        assert (
+            XMLUtils.replace_element_ids_in_reference_map(current_file_old_to_new_id_map, id_to_referenced_ids_map)
+            == expected_id_to_referenced_ids_map
+        )
+
+    @pytest.mark.parametrize(
+        "element_ids, file_name, global_id_set, expected_id_map",
+        [
+            (
+                ["oval:focal.tst:1234", "oval:focal.var:4567"],
                 "random.xml",
+                set(),
                 {
                     "oval:focal.tst:1234": None,
                     "oval:focal.var:4567": None,
                 },
-            )
+            ),
+            (
+                ["oval:focal.tst:1234", "oval:focal.var:4567"],
+                "random.xml",
+                {"oval:focal.var:4567"},
+                {
+                    "oval:focal.tst:1234": None,
+                    "oval:focal.var:4567": "oval:focal.var:45670000000000000001",
+                },
+            ),
         ],
     )
-    def test_update_current_to_new_element_id_map(self, input_file_content, file_name, expected_id_map):
-        global_id_set = set()
+    def test_update_current_to_new_element_id_map(self, element_ids, file_name, global_id_set, expected_id_map):
         current_file_old_to_new_id_map = {}
 
         def int_gen():
@@ -170,18 +266,16 @@ class TestXMLUtils:
                 yield 1
 
         XMLUtils.update_current_to_new_element_id_map(
-            current_file_old_to_new_id_map, int_gen(), global_id_set, input_file_content, file_name
+            current_file_old_to_new_id_map, int_gen(), global_id_set, element_ids, file_name
         )
         assert current_file_old_to_new_id_map == expected_id_map
+        assert global_id_set == set(element_ids)
 
     @pytest.mark.parametrize(
-        "input_file_content, file_name, duplicate_id, expected_id_map",
+        "element_ids, file_name, duplicate_id, expected_id_map",
         [
             (
-                "<root>"
-                '<test id="oval:focal.tst:1234" >A test element</test>'
-                '<test id="oval:focal.tst:1234" >A duplicate element</test>'
-                "</root>",
+                ["oval:focal.tst:1234", "oval:focal.tst:1234"],
                 "random.xml",
                 "oval:focal.tst:1234",
                 {
@@ -192,7 +286,7 @@ class TestXMLUtils:
     )
     @mock.patch("oval_xml_feed_merge.xml_utils.logging.warning")
     def test_update_current_to_new_element_id_map_log(
-        self, mock_log_warn, input_file_content, file_name, duplicate_id, expected_id_map
+        self, mock_log_warn, element_ids, file_name, duplicate_id, expected_id_map
     ):
         current_file_old_to_new_id_map = {}
         global_id_set = set()
@@ -202,7 +296,7 @@ class TestXMLUtils:
                 yield 1
 
         XMLUtils.update_current_to_new_element_id_map(
-            current_file_old_to_new_id_map, int_gen(), global_id_set, input_file_content, file_name
+            current_file_old_to_new_id_map, int_gen(), global_id_set, element_ids, file_name
         )
         assert current_file_old_to_new_id_map == expected_id_map
         mock_log_warn.assert_called_with(f"Duplicate element ID: {duplicate_id} in {file_name}")
@@ -0,0 +1,132 @@
+import os
+from io import BytesIO, StringIO
+from unittest.mock import MagicMock
+
+import pytest
+import xml.etree.ElementTree as ET
+from xml.dom import minidom
+
+from oval_xml_feed_merge.xml_writer import XMLWriter
+
+
+class TestXMLWriter:
+    @staticmethod
+    def _minidom_pretty_print(xml_tree_root: ET.Element) -> str:
+        """The serialization XMLWriter must reproduce"""
+        output_string = ET.tostring(xml_tree_root, encoding="unicode")
+        output_string = minidom.parseString(output_string).toprettyxml(indent="  ")
+        return os.linesep.join([s for s in output_string.splitlines() if s.strip()])
+
+    @pytest.mark.parametrize(
+        "ns_prefix_map, expected_uri_to_prefix_map",
+        [
+            (
+                {"": "urn:default", "oval": "urn:oval"},
+                {"http://www.w3.org/XML/1998/namespace": "xml", "urn:default": "", "urn:oval": "oval"},
+            ),
+            (
+                {"oval": "urn:oval", "other": "urn:oval", "xml": "urn:not-xml"},
+                {"urn:oval": "other", "urn:not-xml": "xml"},
+            ),
+        ],
+    )
+    def test_ctor(self, ns_prefix_map, expected_uri_to_prefix_map):
+        """Test that the constructor resolves namespace prefixes the same way ET.register_namespace does"""
+        xml_writer = XMLWriter(MagicMock(), ns_prefix_map)
+        assert xml_writer.uri_to_prefix_map == expected_uri_to_prefix_map
+
+    @pytest.mark.parametrize(
+        "name, expected_qname, expected_used_namespaces",
+        [
+            ("definition", "definition", {}),
+            ("{urn:default}definition", "definition", {"urn:default": ""}),
+            ("{urn:oval}product_name", "oval:product_name", {"urn:oval": "oval"}),
+            ("{http://www.w3.org/XML/1998/namespace}lang", "xml:lang", {}),
+            ("{urn:unknown}tag", "ns0:tag", {"urn:unknown": "ns0"}),
+        ],
+    )
+    def test_get_qname(self, name, expected_qname, expected_used_namespaces):
+        """Test that get_qname returns prefixed names and records the namespaces that need a declaration"""
+        xml_writer = XMLWriter(MagicMock(), {"": "urn:default", "oval": "urn:oval"})
+        assert xml_writer.get_qname(name) == expected_qname
+        assert xml_writer.used_namespaces == expected_used_namespaces
+
+    @pytest.mark.parametrize(
+        "chunks, expected_output",
+        [
+            (["<a>\n", "  \n", "  <b/>", "\n</a>\n"], "<a>" + os.linesep + "  <b/>" + os.linesep + "</a>"),
+            (["<a>\r", "\n<b>x y</b>\n\n", "</a>"], os.linesep.join(["<a>", "<b>x", "y</b>", "</a>"])),
+        ],
+    )
+    def test_flush(self, chunks, expected_output):
+        """Test that the flushed output drops blank lines and joins lines with os.linesep, regardless of where the
+        chunk boundaries fall"""
+        output_file = StringIO()
+        xml_writer = XMLWriter(output_file, {}, chunk_size=1)
+        for chunk in chunks:
+            xml_writer.write(chunk)
+        xml_writer.flush(final=True)
+        assert output_file.getvalue() == expected_output
+
+    @pytest.mark.parametrize(
+        "xml_string, ns_prefix_map",
+        [
+            ("<root><child>Content</child></root>", {}),
+            (
+                '<oval_definitions xmlns="urn:default" xmlns:oval="urn:oval" xmlns:xsi="urn:xsi" '
+                'xsi:schemaLocation="urn:oval oval.xsd">\n'
+                "  <generator>\n    <oval:product_name>Generator</oval:product_name>\n  </generator>\n"
+                '  <definitions>\n    <definition id="oval:1" class="vulnerability">\n'
+                '      <description>A &amp; B &lt;C&gt; "D"\n\n   line after a blank line</description>\n'
+                '      <criteria><criterion test_ref="oval:2" comment=\'a "quoted" &#10; comment\'/></criteria>\n'
+                "      <metadata>Mixed <b>content</b> tail\n      </metadata>\n"
+                "      <empty></empty><whitespace> </whitespace>\n"
+                "    </definition>\n  </definitions>\n</oval_definitions>",
+                {"": "urn:default", "oval": "urn:oval", "xsi": "urn:xsi"},
+            ),
+        ],
+    )
+    @pytest.mark.parametrize("chunk_size", [1, 16, 65536])
+    def test_write_document(self, xml_string, ns_prefix_map, chunk_size):
+        """Test that write_document produces exactly what the ET.tostring -> minidom -> strip blank lines pipeline
+        produces"""
+        for prefix, uri in ns_prefix_map.items():
+            ET.register_namespace(prefix, uri)
+        xml_tree_root = ET.fromstring(xml_string)
+        output_file = StringIO()
+        XMLWriter(output_file, ns_prefix_map, chunk_size=chunk_size).write_document(xml_tree_root)
+        assert output_file.getvalue() == self._minidom_pretty_print(xml_tree_root)
+
+    @pytest.mark.parametrize("chunk_size", [1, 65536])
+    def test_write_document_binary(self, chunk_size):
+        """Test that write_document writes the same XML UTF-8 encoded to a binary file object"""
+        xml_tree_root = ET.fromstring("<root><child>Ubuntu é ✓</child><child/></root>")
+        output_file, binary_output_file = StringIO(), BytesIO()
+        XMLWriter(output_file, {}, chunk_size=chunk_size).write_document(xml_tree_root)
+        XMLWriter(binary_output_file, {}, chunk_size=chunk_size).write_document(xml_tree_root)
+        assert binary_output_file.getvalue() == output_file.getvalue().encode("utf-8")
+
+    def test_write_document_chunks(self):
+        """Test that write_document writes the document in several chunks instead of one string"""
+        xml_tree_root = ET.fromstring("<root>" + "<child>Content</child>" * 100 + "</root>")
+        output_file = MagicMock()
+        XMLWriter(output_file, {}, chunk_size=256).write_document(xml_tree_root)
+        assert output_file.write.call_count > 1
+        written = "".join(call.args[0] for call in output_file.write.call_args_list)
+        assert written == self._minidom_pretty_print(xml_tree_root)
+
+    def test_write_open_child_close_element(self):
+        """Test that writing an element piecewise with write_open_element, write_child and write_close_element
+        produces the same output as write_element"""
+        xml_tree_root = ET.fromstring("<root>text<child>Content</child>tail<child/></root>")
+        expected_output_file, output_file = StringIO(), StringIO()
+        expected_xml_writer = XMLWriter(expected_output_file, {})
+        expected_xml_writer.write_element(xml_tree_root, 0)
+        expected_xml_writer.flush(final=True)
+        xml_writer = XMLWriter(output_file, {})
+        xml_writer.write_open_element(xml_tree_root, 0)
+        for child in xml_tree_root:
+            xml_writer.write_child(child, 1)
+        xml_writer.write_close_element(xml_tree_root, 0)
+        xml_writer.flush(final=True)
+        assert output_file.getvalue() == expected_output_file.getvalue()